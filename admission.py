@@ -0,0 +1,363 @@
+"""
+Admission control in front of the Gemini call.
+
+Two checks run before a request may call the model:
+  * token buckets, per client and global, charged with the request's
+    estimated tokens (prompt + expected answer) and settled against the
+    real usage afterwards, so long prompts cost more than short ones;
+  * a per-process concurrency limit with a bounded priority queue. The
+    limit adapts (halved on upstream quota/overload errors, regrown by one
+    slot per limit's worth of successes), and a request that would not
+    start in time to meet its deadline is shed at once instead of waiting.
+
+Rejections raise AdmissionRejected carrying the HTTP status (429 for rate
+limits, 503 for overload) and a Retry-After hint in seconds.
+"""
+import heapq
+import itertools
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from cachetools import LRUCache
+
+import metrics
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError: # The Gemini SDK is optional (OpenAI-only or fake backends)
+    google_exceptions = None
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first; batch work only queues while the queue is at most half full
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# Upstream errors that mean "send less": they shrink the concurrency limit
+OVERLOAD_EXCEPTIONS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+) if google_exceptions is not None else ()
+# Other LLM SDKs (OpenAI, google-genai) report overload only as an HTTP status on the exception
+OVERLOAD_STATUS_CODES = (429, 503)
+GLOBAL_BUCKET_KEY = "global"
+
+ADMISSION_DECISIONS = metrics.counter(
+    "bitcoin_chatbot_admission_decisions_total", "Admission decisions for Gemini calls.", ["outcome"])
+ADMISSION_QUEUE_DEPTH = metrics.gauge(
+    "bitcoin_chatbot_admission_queue_depth", "Requests waiting for a Gemini call slot.")
+ADMISSION_CONCURRENCY_LIMIT = metrics.gauge(
+    "bitcoin_chatbot_admission_concurrency_limit", "Current adaptive limit on concurrent Gemini calls.")
+ADMISSION_QUEUE_SECONDS = metrics.histogram(
+    "bitcoin_chatbot_admission_queue_seconds", "Time admitted requests waited for a slot.")
+
+
+def is_overload_error(error):
+    if isinstance(error, OVERLOAD_EXCEPTIONS):
+        return True
+    return getattr(error, "status_code", getattr(error, "code", None)) in OVERLOAD_STATUS_CODES
+
+
+class AdmissionRejected(Exception):
+    """Raised instead of admitting: status is 429 (rate limited) or 503 (overloaded)."""
+
+    def __init__(self, status, retry_after, reason):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+# --- Token-bucket stores: key -> (tokens, updated_at) ---
+def _refill(tokens, updated_at, rate, capacity, now):
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+def _seconds_until_fits(level, cost, rate, capacity):
+    # A request bigger than the burst still runs once the bucket is full (leaving it in debt)
+    needed = min(cost, capacity)
+    return (needed - level) / rate if level < needed else 0.0
+
+
+class BucketStore:
+    """Interface for token-bucket storage. Both operations must be atomic across everyone sharing the store."""
+
+    def take(self, charges, now):
+        """
+        charges: [(key, cost, rate_per_second, capacity)]. Takes every cost
+        or none; returns 0.0 on success, else seconds until all would fit.
+        """
+        raise NotImplementedError
+
+    def refund(self, key, tokens, rate, capacity, now):
+        """Adds tokens back (negative to charge more), capped at capacity."""
+        raise NotImplementedError
+
+
+class MemoryBucketStore(BucketStore):
+    """Per-process buckets; idle ones fall out of the LRU (and come back full)."""
+
+    def __init__(self, maxsize=100_000):
+        self._buckets = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def take(self, charges, now):
+        with self._lock:
+            levels = [_refill(*self._buckets.get(key, (capacity, now)), rate, capacity, now)
+                      for key, _, rate, capacity in charges]
+            wait = max(_seconds_until_fits(level, cost, rate, capacity)
+                       for level, (_, cost, rate, capacity) in zip(levels, charges))
+            if wait == 0.0:
+                for level, (key, cost, _, _) in zip(levels, charges):
+                    self._buckets[key] = (level - cost, now)
+            return wait
+
+    def refund(self, key, tokens, rate, capacity, now):
+        with self._lock:
+            level = _refill(*self._buckets.get(key, (capacity, now)), rate, capacity, now)
+            self._buckets[key] = (min(capacity, level + tokens), now)
+
+
+class SQLiteBucketStore(BucketStore):
+    """
+    Local stand-in for a shared store such as Redis: every worker on the host
+    opens the same SQLite file, so per-client and global limits hold across
+    workers. Each take() is one IMMEDIATE transaction.
+    """
+
+    # Drop buckets idle this long (they would be full again anyway) every EXPIRE_EVERY_TAKES takes
+    IDLE_SECONDS = 3600
+    EXPIRE_EVERY_TAKES = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads (or a forked child); keep one per thread and process
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _level(self, conn, key, rate, capacity, now):
+        row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+        return _refill(*(row or (capacity, now)), rate, capacity, now)
+
+    def take(self, charges, now):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = [self._level(conn, key, rate, capacity, now) for key, _, rate, capacity in charges]
+            wait = max(_seconds_until_fits(level, cost, rate, capacity)
+                       for level, (_, cost, rate, capacity) in zip(levels, charges))
+            if wait == 0.0:
+                conn.executemany("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                                 [(key, level - cost, now) for level, (key, cost, _, _) in zip(levels, charges)])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._takes += 1
+        if self._takes % self.EXPIRE_EVERY_TAKES == 0:
+            conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - self.IDLE_SECONDS,))
+        return wait
+
+    def refund(self, key, tokens, rate, capacity, now):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            level = self._level(conn, key, rate, capacity, now)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                         (key, min(capacity, level + tokens), now))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def create_bucket_store(backend, path=None, maxsize=100_000):
+    """Builds the configured store: 'memory' (default) or 'sqlite'."""
+    if backend == "sqlite":
+        path = path or os.path.join(os.getcwd(), "admission.sqlite3")
+        logger.info("Using SQLite admission store at %s.", path)
+        return SQLiteBucketStore(path)
+    if backend != "memory":
+        logger.warning("Unknown admission store backend '%s', falling back to memory.", backend)
+    return MemoryBucketStore(maxsize=maxsize)
+
+
+# --- Controller ---
+class Ticket:
+    """An admitted Gemini call. release() frees the slot; it is idempotent, so call it in a finally."""
+
+    def __init__(self, controller, client_key, tokens):
+        self._controller = controller
+        self.client_key = client_key
+        self.tokens = tokens
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self, tokens_used=None, overloaded=False):
+        if self.released:
+            return
+        self.released = True
+        self._controller._release_slot(time.monotonic() - self.started, overloaded)
+        if tokens_used is not None and tokens_used != self.tokens:
+            self._controller._settle(self.client_key, self.tokens - tokens_used)
+
+
+class AdmissionController:
+    def __init__(self, store, client_tokens_per_minute=20_000, client_burst_tokens=40_000,
+                 global_tokens_per_minute=1_000_000, global_burst_tokens=1_000_000,
+                 max_concurrency=16, max_queue=64, expected_service_seconds=2.0):
+        self.store = store
+        self.client_rate = client_tokens_per_minute / 60
+        self.client_capacity = client_burst_tokens
+        self.global_rate = global_tokens_per_minute / 60
+        self.global_capacity = global_burst_tokens
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+
+        self._cond = threading.Condition()
+        self._limit = float(max_concurrency)
+        self._in_use = 0
+        self._waiters = [] # heap of [priority, arrival seq]
+        self._arrivals = itertools.count()
+        self._service_seconds = expected_service_seconds # EWMA of admitted call durations
+        self._outcomes = dict.fromkeys(("admitted", "rate_limited", "queue_full", "deadline", "store_error"), 0)
+        ADMISSION_CONCURRENCY_LIMIT.set(max_concurrency)
+
+    def admit(self, client_key, tokens, priority=PRIORITY_INTERACTIVE, timeout=None):
+        """
+        Returns a Ticket once the call may start, waiting in the queue if all
+        slots are busy. client_key None skips the per-client bucket; timeout
+        (seconds from now) is the deadline the call must be able to meet.
+        Raises AdmissionRejected.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        self._take_tokens(client_key, tokens)
+        try:
+            waited = self._acquire_slot(priority, deadline)
+        except AdmissionRejected:
+            self._settle(client_key, tokens) # not admitted, so not charged
+            raise
+        self._record("admitted")
+        ADMISSION_QUEUE_SECONDS.observe(waited)
+        return Ticket(self, client_key, tokens)
+
+    # --- Token buckets ---
+    def _charges(self, client_key, tokens):
+        charges = [(GLOBAL_BUCKET_KEY, tokens, self.global_rate, self.global_capacity)]
+        if client_key is not None:
+            charges.append((f"client:{client_key}", tokens, self.client_rate, self.client_capacity))
+        return charges
+
+    def _take_tokens(self, client_key, tokens):
+        try:
+            wait = self.store.take(self._charges(client_key, tokens), time.time())
+        except Exception:
+            # Fail open: a broken shared store must not take the chatbot down with it
+            logger.exception("Admission store failed; admitting without a rate check:")
+            self._record("store_error")
+            return
+        if wait > 0:
+            self._record("rate_limited")
+            raise AdmissionRejected(429, wait, "Token rate limit exceeded.")
+
+    def _settle(self, client_key, tokens):
+        """Refunds (or, if negative, charges) the difference between estimated and actual tokens."""
+        try:
+            now = time.time()
+            for key, _, rate, capacity in self._charges(client_key, tokens):
+                self.store.refund(key, tokens, rate, capacity, now)
+        except Exception:
+            logger.exception("Could not settle admission tokens:")
+
+    # --- Concurrency slots ---
+    def _free_slots(self):
+        return int(self._limit) - self._in_use
+
+    def _estimated_wait(self, ahead):
+        """Seconds until a request with `ahead` waiters in front of it gets a slot."""
+        if self._free_slots() > ahead:
+            return 0.0
+        return (ahead + 1) * self._service_seconds / max(1, int(self._limit))
+
+    def _acquire_slot(self, priority, deadline):
+        start = time.monotonic()
+        with self._cond:
+            if not self._waiters and self._free_slots() > 0:
+                self._in_use += 1
+                return 0.0
+            queue_cap = self.max_queue if priority <= PRIORITY_INTERACTIVE else self.max_queue // 2
+            if len(self._waiters) >= queue_cap:
+                self._record("queue_full")
+                raise AdmissionRejected(503, self._estimated_wait(len(self._waiters)), "Server is busy.")
+            ahead = sum(1 for waiter in self._waiters if waiter[0] <= priority)
+            expected_wait = self._estimated_wait(ahead)
+            if deadline is not None and start + expected_wait + self._service_seconds > deadline:
+                self._record("deadline")
+                raise AdmissionRejected(503, expected_wait, "Server is busy; the request would time out.")
+
+            waiter = [priority, next(self._arrivals)]
+            heapq.heappush(self._waiters, waiter)
+            ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+            try:
+                while True:
+                    if self._waiters[0] is waiter and self._free_slots() > 0:
+                        heapq.heappop(self._waiters)
+                        self._in_use += 1
+                        self._cond.notify_all() # the next waiter may fit too
+                        return time.monotonic() - start
+                    timeout = None
+                    if deadline is not None:
+                        # Give up once the call could no longer finish before the deadline
+                        timeout = deadline - self._service_seconds - time.monotonic()
+                        if timeout <= 0:
+                            self._waiters.remove(waiter)
+                            heapq.heapify(self._waiters)
+                            self._cond.notify_all()
+                            self._record("deadline")
+                            raise AdmissionRejected(503, self._estimated_wait(len(self._waiters)),
+                                                    "Server is busy; the request would time out.")
+                    self._cond.wait(timeout)
+            finally:
+                ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+
+    def _release_slot(self, service_seconds, overloaded):
+        with self._cond:
+            self._in_use -= 1
+            if overloaded:
+                self._limit = max(1.0, self._limit / 2)
+                logger.warning("Upstream overloaded; Gemini concurrency limit lowered to %d.", int(self._limit))
+            else:
+                self._limit = min(float(self.max_concurrency), self._limit + 1 / self._limit)
+                self._service_seconds += 0.2 * (service_seconds - self._service_seconds)
+            ADMISSION_CONCURRENCY_LIMIT.set(int(self._limit))
+            self._cond.notify_all()
+
+    def _record(self, outcome):
+        with self._cond:
+            self._outcomes[outcome] += 1
+        ADMISSION_DECISIONS.labels(outcome).inc()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._outcomes, in_flight=self._in_use, queued=len(self._waiters),
+                        concurrency_limit=int(self._limit), avg_service_seconds=round(self._service_seconds, 3))
+
+
+def create_admission_controller(backend="memory", path=None, **options):
+    return AdmissionController(create_bucket_store(backend, path), **options)
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Punctuation and repeated whitespace don't change what is being asked
+_NON_WORD_RE = re.compile(r"[^\w\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(question):
+    """Lowercases the question and strips punctuation/extra whitespace."""
+    question = _NON_WORD_RE.sub(" ", question.lower())
+    return _WHITESPACE_RE.sub(" ", question).strip()
+
+
+def history_fingerprint(history):
+    """Stable hash of the chat turns that precede the question ('' for no history)."""
+    if not history:
+        return ""
+    turns = [(message.get('type'), message.get('text')) for message in history]
+    return hashlib.sha1(json.dumps(turns).encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    Bounded LRU cache with TTL eviction for generated answers.
+    Keys combine the normalized question, a hash of the history and the
+    market-data snapshot version, so price answers expire with the data.
+    """
+
+    def __init__(self, maxsize=512, ttl=3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # cachetools caches are not thread-safe; Flask serves requests on threads
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(question, history, data_version):
+        return (normalize_question(question), history_fingerprint(history), data_version)
+
+    def get(self, key):
+        with self._lock:
+            answer = self._cache.get(key)
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def put(self, key, answer):
+        with self._lock:
+            self._cache[key] = answer
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "size": len(self._cache),
+                "maxsize": self._cache.maxsize,
+                "ttl_seconds": self._cache.ttl,
+            }
+
+    def prewarm(self, questions, answer_fn):
+        """
+        Fills the cache for each question with empty history.
+        answer_fn(question) must return (key, answer) or None to skip.
+        """
+        warmed = 0
+        for question in questions:
+            try:
+                result = answer_fn(question)
+            except Exception:
+                logger.exception("Failed to pre-warm answer cache for question: %s", question)
+                continue
+            if result:
+                key, answer = result
+                self.put(key, answer)
+                warmed += 1
+        logger.info("Pre-warmed answer cache with %d/%d questions.", warmed, len(questions))
+        return warmed
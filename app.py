@@ -1,59 +1,66 @@
+import time
+_import_started = time.perf_counter() # for the startup report on /readyz
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-import requests
-import time
+import datetime
+import json
 import logging
-import re # Import regex for potentially more robust keyword matching
-
-# --- Configure Logging ---
-# Get the root logger
+import re
+import threading
+
+import context_cache
+import log_pipeline
+import market_data
+import metrics
+import traffic_capture
+from admission import PRIORITY_BATCH, PRIORITY_INTERACTIVE, AdmissionRejected, create_admission_controller, is_overload_error
+from answer_cache import AnswerCache, history_fingerprint
+from batch_runner import ndjson_lines, run_batch
+from config import Config
+from history_compaction import HistoryCompactor, TokenEstimator
+from intent_router import ROUTE_METRICS, ROUTE_OFF_TOPIC, create_intent_router, off_topic_refusal, render_metrics_answer
+from link_matcher import LinkMatcher
+from llm_backends import LLMRequest, create_llm_router
+from retrieval import DEFAULT_INDEX_PATH, open_knowledge_base
+from sessions import LiveChatRegistry, create_session_store, new_conversation_id
+from static_assets import DEFAULT_STATIC_ROOT, StaticAsset, StaticBundle, available_encodings, compress, negotiate_encoding
+
+# --- Configure Logging (queued writer thread, request IDs and sampling, see log_pipeline.py) ---
+load_dotenv()
+# Minimum level to log: INFO for general operation, DEBUG for detailed troubleshooting
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text") # "text" or "json" (one object per line)
+# Write logs from a background thread instead of inside the request
+LOG_QUEUE_ENABLED = os.getenv("LOG_QUEUE_ENABLED", "true").lower() in ("1", "true", "yes")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000")) # records beyond this are dropped, not waited for
+# Fraction of requests whose high-volume INFO lines are kept, per sample key: "question" (the user's question)
+# and "request" (per-request progress lines); e.g. "question=0.1,request=0.01". Unlisted keys keep everything
+LOG_SAMPLE_RATES = log_pipeline.parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))
+# Skip the per-record caller lookup for the whole process; only safe if no handler prints file, line or function
+LOG_SKIP_CALLER_INFO = os.getenv("LOG_SKIP_CALLER_INFO", "false").lower() in ("1", "true", "yes")
+log_pipeline.configure_logging(LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_ENABLED, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES,
+                               skip_caller_info=LOG_SKIP_CALLER_INFO)
+# The root logger
 logger = logging.getLogger()
-# Set the minimum level to log (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-logger.setLevel(logging.INFO) # Use INFO for general operation, DEBUG for detailed troubleshooting
-
-# Create a handler to output logs to the console (stderr by default)
-handler = logging.StreamHandler()
-# Define the log message format
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-
-# Add the handler to the logger (prevent duplicate handlers if hot-reloading)
-if not logger.handlers:
-    logger.addHandler(handler)
 
 
 # --- Configuration & Initialization ---
-load_dotenv()
 API_KEY = os.getenv("GOOGLE_API_KEY")
 GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-1.0-pro")
+# Optional override of the Gemini REST endpoint (e.g. a local fake for load tests)
+GEMINI_API_BASE_URL = os.getenv("GEMINI_API_BASE_URL")
+# Set by gunicorn.conf.py with preload: the master builds everything once (warm_up) and starts no
+# threads; each forked worker starts its background tasks in post_fork
+PRELOAD_WARMUP = os.getenv("PRELOAD_WARMUP", "false").lower() in ("1", "true", "yes")
+# Seconds before retrying a failed Gemini SDK setup
+MODEL_INIT_RETRY_SECONDS = float(os.getenv("MODEL_INIT_RETRY_SECONDS", "30"))
 
 if not API_KEY:
-    # Use logging.critical for errors that prevent the app from starting
+    # Use logging.critical for errors that prevent the app from serving answers (it still starts: /readyz reports it)
     logger.critical("Error: GOOGLE_API_KEY not found.")
     logger.critical("Please make sure you have a .env file with GOOGLE_API_KEY=YOUR_API_KEY")
-    exit()
-
-try:
-    genai.configure(api_key=API_KEY)
-    logger.info("Gemini API configured successfully.")
-except Exception as e:
-    # Use logging.exception to log the error including the traceback
-    logger.exception("Error configuring Gemini API:")
-    exit()
-
-# --- Model Setup ---
-model = None # Initialize model as None
-try:
-    logger.info(f"Attempting to use model: {GEMINI_MODEL_NAME}")
-    model = genai.GenerativeModel(GEMINI_MODEL_NAME)
-    logger.info("Gemini model loaded successfully.")
-except Exception as e:
-    logger.exception(f"Error creating or testing Gemini model '{GEMINI_MODEL_NAME}':")
-    logger.critical("Please check your GEMINI_MODEL_NAME in the .env file and ensure it's valid for generateContent.")
-
 
 # --- System Prompt: Define the Chatbot's Persona and Scope ---
 # *** MODIFIED PROMPT STARTS HERE ***
@@ -66,6 +73,7 @@ You are provided with RECENT Bitcoin data under "--- RECENT BITCOIN DATA ---".
 - When responding to questions about CURRENT price, market cap, or 24h volume, ALWAYS use the provided data EXACTLY.
 - Begin answers about current metrics by referencing the data, e.g., "According to the recent data provided, the current price is...".
 - If the data block indicates an ERROR or a value is N/A, state "I could not fetch real-time data for that at this moment" before giving any general information based on your training. Do NOT use outdated general knowledge for CURRENT figures.
+- For recent price movements (24h or 7d change, lows and highs), use the change lines in the data block. If they are missing or marked partial, say so instead of using training data.
 
 Answer user questions accurately and concisely. Aim for clarity and avoid unnecessary jargon; explain technical terms (like hashrate, UTXO, difficulty) when first used or requested. Use Markdown formatting (bold, lists) for readability when appropriate.
 
@@ -79,97 +87,279 @@ Maintain a helpful, informative, and neutral tone. Do not express opinions or en
 # *** MODIFIED PROMPT ENDS HERE ***
 
 
-# --- Caching Configuration (Keep it) ---
-CACHE_DURATION_SECONDS = 300
-cached_data = None
-last_fetch_time = 0
-
-# --- Helper to fetch real-time data (Keep it) ---
-def get_bitcoin_data():
-    global cached_data, last_fetch_time
-    current_time = time.time()
-    if cached_data and (current_time - last_fetch_time) < CACHE_DURATION_SECONDS:
-        logger.debug("Using cached data for CoinGecko.")
-        return cached_data['formatted_string'], None
-
-    logger.info("Fetching fresh data from CoinGecko...")
-    api_url = "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd&include_market_cap=true&include_24hr_vol=true&include_last_updated_at=true"
+# --- Model Setup ---
+# The system prompt is a real system instruction, converted once here instead
+# of being re-sent as a fake first chat turn on every request.
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() in ("1", "true", "yes")
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+
+def keep_context_cache_alive(cached_prefix):
+    """Extends the cached prefix's TTL at half-life for as long as the process runs."""
+    while True:
+        time.sleep(GEMINI_CONTEXT_CACHE_TTL_SECONDS / 2)
+        try:
+            cached_prefix.update(ttl=datetime.timedelta(seconds=GEMINI_CONTEXT_CACHE_TTL_SECONDS))
+        except Exception:
+            logger.exception("Failed to extend the Gemini context cache TTL:")
 
+def create_context_cached_model(genai, model_name=GEMINI_MODEL_NAME):
+    """
+    Stores the static prefix (system instruction) with Gemini context caching
+    and returns a model bound to it, or None where caching is unavailable
+    (unsupported model, prefix below the minimum cacheable token count, ...).
+    """
+    from google.generativeai import caching
     try:
-        response = requests.get(api_url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-
-        if 'bitcoin' in data and 'usd' in data['bitcoin']:
-            btc_data = data['bitcoin']
-            price = btc_data.get('usd')
-            market_cap = btc_data.get('usd_market_cap')
-            volume_24h = btc_data.get('usd_24h_vol')
-            last_updated_unix = btc_data.get('last_updated_at')
-
-            last_updated_readable = "N/A"
-            if last_updated_unix:
-                 try:
-                    last_updated_readable = time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(last_updated_unix))
-                 except Exception:
-                     logger.warning("Failed to format last updated timestamp.")
-                     pass
-
-            formatted_data_string = "--- RECENT BITCOIN DATA ---\n"
-            formatted_data_string += f"Current Price (USD): ${price:,.2f}\n" if price is not None else "Current Price (USD): N/A\n"
-            formatted_data_string += f"Market Cap (USD): ${market_cap:,.2f}\n" if market_cap is not None else "Market Cap (USD): N/A\n"
-            formatted_data_string += f"24h Volume (USD): ${volume_24h:,.2f}\n" if volume_24h is not None else "24h Volume (USD): N/A\n"
-            formatted_data_string += f"Last Updated (UTC): {last_updated_readable}\n"
-            formatted_data_string += "--------------------------\n\n"
-
-            cached_data = {
-                'formatted_string': formatted_data_string,
-                'raw_data': data
-            }
-            last_fetch_time = current_time
-            logger.info("Successfully fetched and cached new CoinGecko data.")
-            return formatted_data_string, None
-
+        # One cache per host, shared by the workers (context_cache.py), not one billed cache per worker
+        cached_prefix = context_cache.get_or_create(caching, model_name, SYSTEM_PROMPT, GEMINI_CONTEXT_CACHE_TTL_SECONDS)
+    except Exception:
+        logger.exception("Gemini context caching unavailable, sending the system instruction per request:")
+        return None
+    threading.Thread(target=keep_context_cache_alive, args=(cached_prefix,), name="context-cache-ttl", daemon=True).start()
+    logger.info("Cached static prompt prefix as %s.", cached_prefix.name)
+    return genai.GenerativeModel.from_cached_content(cached_prefix)
+
+_genai_sdk = None # google.generativeai once configured
+
+def configure_gemini_sdk():
+    """Imports and configures the Gemini SDK once per process (no network calls). Returns the module, or None on failure."""
+    global _genai_sdk
+    if _genai_sdk is not None or not API_KEY:
+        return _genai_sdk
+    try:
+        import google.generativeai as genai # deferred: importing the SDK takes most of a second
+        if GEMINI_API_BASE_URL:
+            genai.configure(api_key=API_KEY, transport="rest", client_options={"api_endpoint": GEMINI_API_BASE_URL})
         else:
-            fetch_error = "Could not parse Bitcoin data from CoinGecko API response."
-            logger.error(fetch_error)
-            if cached_data:
-                 logger.warning("Falling back to stale cached data after parsing error.")
-                 return cached_data['formatted_string'], "Using stale data due to parsing error."
-            return "Could not fetch real-time data due to an API response format issue.", fetch_error
-
-    except requests.exceptions.RequestException as e:
-        logger.exception("Error fetching Bitcoin data from CoinGecko:")
-        fetch_error = f"Request Error: {e}"
-        if cached_data:
-            logger.warning("Falling back to stale cached data after fetch error.")
-            return cached_data['formatted_string'], "Using stale data due to fetch error."
-        return "Could not fetch real-time data due to an API error.", fetch_error
+            genai.configure(api_key=API_KEY)
+        logger.info("Gemini API configured successfully.")
+    except Exception as e:
+        # Use logging.exception to log the error including the traceback
+        logger.exception("Error configuring Gemini API:")
+        return None
+    _genai_sdk = genai
+    return genai
+
+def create_model(model_name=GEMINI_MODEL_NAME):
+    """Configures the Gemini SDK and builds the model. Returns None on failure."""
+    genai = configure_gemini_sdk()
+    if genai is None:
+        return None
 
+    try:
+        logger.info("Attempting to use model: %s", model_name)
+        model = create_context_cached_model(genai, model_name) if GEMINI_CONTEXT_CACHE else None
+        if model is None:
+            model = genai.GenerativeModel(model_name, system_instruction=SYSTEM_PROMPT)
+        logger.info("Gemini model loaded successfully.")
+        return model
     except Exception as e:
-        logger.exception("An unexpected error occurred fetching Bitcoin data:")
-        fetch_error = f"Unexpected Error: {e}"
-        if cached_data:
-             logger.warning("Falling back to stale cached data after unexpected error.")
-             return cached_data['formatted_string'], "Using stale data due to unexpected error."
-        return "Could not fetch real-time data due to an unexpected error.", fetch_error
+        logger.exception("Error creating or testing Gemini model '%s':", model_name)
+        logger.critical("Please check your GEMINI_MODEL_NAME in the .env file and ensure it's valid for generateContent.")
+        return None
+
+_model = None
+_model_lock = threading.Lock()
+_model_retry_at = 0.0
+
+def get_model():
+    """The Gemini model, built on first use (or by warm_up); None while it cannot be built."""
+    global _model, _model_retry_at
+    if _model is not None:
+        return _model
+    with _model_lock:
+        if _model is None and time.monotonic() >= _model_retry_at:
+            with metrics.startup_step("gemini_model"):
+                _model = create_model()
+            if _model is None:
+                _model_retry_at = time.monotonic() + MODEL_INIT_RETRY_SECONDS
+    return _model
+
+def gemini_model(model_name):
+    """Model factory for the 'gemini' LLM backend: the shared model, or a separately built fallback model."""
+    return get_model() if model_name == GEMINI_MODEL_NAME else create_model(model_name)
+
+# --- LLM Backend Configuration (timeouts, hedging, circuit breaking and failover, see llm_backends.py) ---
+# Ordered "kind[:model][@timeout_seconds]" list, the first being the primary. Kinds: gemini (GEMINI_MODEL_NAME
+# unless a model is given), genai, openai, fake. E.g. "gemini@20,openai:gpt-4o-mini@15"
+LLM_BACKENDS = os.getenv("LLM_BACKENDS", "gemini")
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60")) # for backends without their own @timeout
+# Send a copy to the next backend once a call is slower than this percentile of its recent latencies
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DELAY_SECONDS", "5")) # until a backend has enough samples
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1")) # at most this fraction of calls is hedged
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") # any OpenAI-compatible server
+
+
+# --- Answer Cache Configuration ---
+# Answers are keyed on the normalized question, the history and the data snapshot version
+ANSWER_CACHE_MAXSIZE = int(os.getenv("ANSWER_CACHE_MAXSIZE", "512"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# Only FAQ-style questions with empty or trivial history are worth caching
+ANSWER_CACHE_MAX_HISTORY_TURNS = int(os.getenv("ANSWER_CACHE_MAX_HISTORY_TURNS", "2"))
+ANSWER_CACHE_PREWARM = os.getenv("ANSWER_CACHE_PREWARM", "false").lower() in ("1", "true", "yes")
+answer_cache = AnswerCache(maxsize=ANSWER_CACHE_MAXSIZE, ttl=ANSWER_CACHE_TTL_SECONDS)
+
+# --- Conversation Session Configuration ---
+# Clients that omit 'history' get a conversation_id and send only new messages
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory") # "memory" or "sqlite"
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH") # SQLite file shared by all workers
+SESSION_MAX_CONVERSATIONS = int(os.getenv("SESSION_MAX_CONVERSATIONS", "10000"))
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+LIVE_CHAT_MAX_SESSIONS = int(os.getenv("LIVE_CHAT_MAX_SESSIONS", "1000"))
+session_store = create_session_store(
+    SESSION_STORE_BACKEND, path=SESSION_STORE_PATH,
+    maxsize=SESSION_MAX_CONVERSATIONS, ttl=SESSION_TTL_SECONDS,
+)
+live_chats = LiveChatRegistry(maxsize=LIVE_CHAT_MAX_SESSIONS)
+
+# --- History Compaction Configuration ---
+# Estimated tokens of prior turns allowed per request before older turns are summarized
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+HISTORY_KEEP_RECENT_TURNS = int(os.getenv("HISTORY_KEEP_RECENT_TURNS", "6"))
+HISTORY_SUMMARIZER = os.getenv("HISTORY_SUMMARIZER", "gemini") # "gemini" or "extractive"
+# Fit the local token estimator against Gemini's count_tokens once at startup
+HISTORY_CALIBRATE_TOKENS = os.getenv("HISTORY_CALIBRATE_TOKENS", "false").lower() in ("1", "true", "yes")
+
+# --- Batch Configuration (/ask/batch) ---
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "5000"))
+BATCH_DEFAULT_CONCURRENCY = int(os.getenv("BATCH_DEFAULT_CONCURRENCY", "8"))
+# Upper bound on Gemini calls in flight across all batches in this process
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "4"))
+BATCH_BACKOFF_SECONDS = float(os.getenv("BATCH_BACKOFF_SECONDS", "1.0"))
+BATCH_MAX_BACKOFF_SECONDS = float(os.getenv("BATCH_MAX_BACKOFF_SECONDS", "30"))
+batch_upstream_slots = threading.BoundedSemaphore(BATCH_MAX_CONCURRENCY)
+
+
+# --- Retrieval Configuration (curated knowledge base, see retrieval.py) ---
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "true").lower() in ("1", "true", "yes")
+RETRIEVAL_INDEX_PATH = os.getenv("RETRIEVAL_INDEX_PATH", DEFAULT_INDEX_PATH)
+RETRIEVAL_ANSWER_THRESHOLD = float(os.getenv("RETRIEVAL_ANSWER_THRESHOLD", "0.8"))
+RETRIEVAL_CONTEXT_THRESHOLD = float(os.getenv("RETRIEVAL_CONTEXT_THRESHOLD", "0.5"))
+# A direct answer also needs this BM25 score and this many distinct matched terms
+RETRIEVAL_MIN_ANSWER_SCORE = float(os.getenv("RETRIEVAL_MIN_ANSWER_SCORE", "4.0"))
+RETRIEVAL_MIN_ANSWER_TERMS = int(os.getenv("RETRIEVAL_MIN_ANSWER_TERMS", "2"))
+with metrics.startup_step("knowledge_base"):
+    knowledge_base = open_knowledge_base(
+        RETRIEVAL_INDEX_PATH,
+        answer_threshold=RETRIEVAL_ANSWER_THRESHOLD,
+        context_threshold=RETRIEVAL_CONTEXT_THRESHOLD,
+        min_answer_score=RETRIEVAL_MIN_ANSWER_SCORE,
+        min_answer_terms=RETRIEVAL_MIN_ANSWER_TERMS,
+    ) if RETRIEVAL_ENABLED else None
+# --- Intent Router Configuration (local answers for current-metric and off-topic questions) ---
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+INTENT_OFF_TOPIC_THRESHOLD = float(os.getenv("INTENT_OFF_TOPIC_THRESHOLD", "0.85"))
+with metrics.startup_step("intent_router"):
+    intent_router = create_intent_router(off_topic_threshold=INTENT_OFF_TOPIC_THRESHOLD) if INTENT_ROUTER_ENABLED else None
+
+# --- Admission Control Configuration (token buckets and load shedding in front of Gemini, see admission.py) ---
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_STORE_BACKEND = os.getenv("ADMISSION_STORE_BACKEND", "memory") # "memory" or "sqlite" (shared by all workers)
+ADMISSION_STORE_PATH = os.getenv("ADMISSION_STORE_PATH")
+# Estimated tokens (prompt + expected answer) each client may spend per minute, and its burst allowance
+ADMISSION_CLIENT_TOKENS_PER_MINUTE = int(os.getenv("ADMISSION_CLIENT_TOKENS_PER_MINUTE", "20000"))
+ADMISSION_CLIENT_BURST_TOKENS = int(os.getenv("ADMISSION_CLIENT_BURST_TOKENS", "40000"))
+# Keep these under the Gemini project quota so we shed load before Gemini starts returning 429s
+ADMISSION_GLOBAL_TOKENS_PER_MINUTE = int(os.getenv("ADMISSION_GLOBAL_TOKENS_PER_MINUTE", "1000000"))
+ADMISSION_GLOBAL_BURST_TOKENS = int(os.getenv("ADMISSION_GLOBAL_BURST_TOKENS", "1000000"))
+# Gemini calls in flight per worker (the adaptive limit never exceeds this) and requests allowed to wait
+ADMISSION_MAX_CONCURRENT_CALLS = int(os.getenv("ADMISSION_MAX_CONCURRENT_CALLS", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+# Interactive requests that could not get an answer within this many seconds are shed right away
+ADMISSION_DEADLINE_SECONDS = float(os.getenv("ADMISSION_DEADLINE_SECONDS", "30"))
+ADMISSION_EXPECTED_OUTPUT_TOKENS = int(os.getenv("ADMISSION_EXPECTED_OUTPUT_TOKENS", "500"))
+# Only behind a proxy that sets X-Forwarded-For; otherwise clients could pick their own bucket
+ADMISSION_TRUST_FORWARDED_FOR = os.getenv("ADMISSION_TRUST_FORWARDED_FOR", "false").lower() in ("1", "true", "yes")
+admission_controller = create_admission_controller(
+    ADMISSION_STORE_BACKEND,
+    ADMISSION_STORE_PATH,
+    client_tokens_per_minute=ADMISSION_CLIENT_TOKENS_PER_MINUTE,
+    client_burst_tokens=ADMISSION_CLIENT_BURST_TOKENS,
+    global_tokens_per_minute=ADMISSION_GLOBAL_TOKENS_PER_MINUTE,
+    global_burst_tokens=ADMISSION_GLOBAL_BURST_TOKENS,
+    max_concurrency=ADMISSION_MAX_CONCURRENT_CALLS,
+    max_queue=ADMISSION_MAX_QUEUE,
+) if ADMISSION_ENABLED else None
+
+# --- Metrics Configuration (Prometheus /metrics and Server-Timing headers, see metrics.py) ---
+# Server-Timing reveals per-stage timings to clients; turn it off if that is unwanted
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() in ("1", "true", "yes")
+HTTP_REQUESTS = metrics.counter(
+    "bitcoin_chatbot_http_requests_total", "HTTP requests by route and status code.", ["route", "status"])
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "bitcoin_chatbot_http_request_duration_seconds", "HTTP request latency, including streamed bodies.", ["route"])
+HTTP_IN_FLIGHT = metrics.gauge(
+    "bitcoin_chatbot_http_requests_in_flight", "HTTP requests currently being served.", ["route"])
+ANSWERS = metrics.histogram(
+    "bitcoin_chatbot_answer_chars", "Answer length in characters by source (local, cache, gemini, error).", ["source"],
+    buckets=metrics.SIZE_BUCKETS)
+PROMPT_CHARS = metrics.histogram(
+    "bitcoin_chatbot_prompt_chars", "Length of the prompt sent to Gemini, in characters.", buckets=metrics.SIZE_BUCKETS)
+
+# --- Traffic Capture Configuration (opt-in log of /ask requests for offline replay, see traffic_capture.py) ---
+# Empty disables capture; with several workers put "{pid}" in the path (one file per process)
+TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "")
+TRAFFIC_CAPTURE_MAX_BYTES = int(os.getenv("TRAFFIC_CAPTURE_MAX_BYTES", str(50 * 1024 * 1024)))
+TRAFFIC_CAPTURE_BACKUPS = int(os.getenv("TRAFFIC_CAPTURE_BACKUPS", "5"))
+# Endpoint -> the route name recorded in the capture
+CAPTURED_ENDPOINTS = {'ask_bitcoin_api': "ask", 'ask_bitcoin_stream_api': "stream"}
+capture_log = traffic_capture.create_capture_log(
+    TRAFFIC_CAPTURE_PATH, max_bytes=TRAFFIC_CAPTURE_MAX_BYTES, backup_count=TRAFFIC_CAPTURE_BACKUPS)
+
+# --- Static Serving Configuration (the built frontend and /tour, precompressed once, see static_assets.py) ---
+STATIC_SERVING_ENABLED = os.getenv("STATIC_SERVING_ENABLED", "true").lower() in ("1", "true", "yes")
+STATIC_ROOT = os.getenv("STATIC_ROOT", DEFAULT_STATIC_ROOT)
+# JSON responses at least this big are gzip/brotli-compressed per request (0 disables)
+JSON_COMPRESSION_MIN_BYTES = int(os.getenv("JSON_COMPRESSION_MIN_BYTES", "1024"))
+TOUR_CACHE_CONTROL = os.getenv("TOUR_CACHE_CONTROL", "public, max-age=300")
+with metrics.startup_step("static_bundle"):
+    static_bundle = StaticBundle(STATIC_ROOT) if STATIC_SERVING_ENABLED and os.path.isdir(STATIC_ROOT) else None
+
+# Questions about live numbers need the market data, never a static passage
+LIVE_DATA_QUESTION_RE = re.compile(r"\b(price|prices|worth|cost|market cap|volume|today|now|current|currently|latest)\b")
+
+
+# --- Real-time data: served from the shared snapshot kept fresh by market_data's refresher ---
+get_bitcoin_data = market_data.get_bitcoin_data
+get_bitcoin_data_version = market_data.get_data_version
+get_raw_bitcoin_data = market_data.get_raw_bitcoin_data
 
 
 # --- Helper to format history for Gemini API (Keep it) ---
 def format_history_for_gemini(history):
+    # SYSTEM_PROMPT is the model's system instruction (see Model Setup), so only chat turns go here
     gemini_history = []
-    # The first turn should be the system prompt
-    gemini_history.append({'role': 'user', 'parts': [{'text': SYSTEM_PROMPT}]})
-    # The AI's expected initial response after the system prompt
-    gemini_history.append({'role': 'model', 'parts': [{'text': 'Okay, I am ready to answer questions about Bitcoin and use the provided real-time data.'}]}) # This should generally align with the prompt's capabilities
 
-    # Add previous chat turns
+    # Add previous chat turns (a plain copy; the history stage is timed around compaction in compact_for_request)
     for message in history:
         role = 'user' if message['type'] == 'user' else 'model'
         gemini_history.append({'role': role, 'parts': [{'text': message['text']}]})
 
     return gemini_history
 
+# --- LLM router: every model call of the Flask app goes through it ---
+llm = create_llm_router(
+    LLM_BACKENDS,
+    SYSTEM_PROMPT,
+    backend_options={
+        "gemini": {"model_name": GEMINI_MODEL_NAME, "model_factory": gemini_model, "format_history": format_history_for_gemini},
+        "genai": {"api_key": API_KEY, "base_url": GEMINI_API_BASE_URL},
+        "openai": {"api_key": Config.OPENAI_KEY, "base_url": OPENAI_BASE_URL},
+    },
+    default_timeout_seconds=LLM_TIMEOUT_SECONDS,
+    hedge=LLM_HEDGE_ENABLED,
+    hedge_percentile=LLM_HEDGE_PERCENTILE,
+    hedge_delay_seconds=LLM_HEDGE_DELAY_SECONDS,
+    max_hedge_ratio=LLM_HEDGE_MAX_RATIO,
+    breaker_failures=LLM_BREAKER_FAILURES,
+    breaker_reset_seconds=LLM_BREAKER_RESET_SECONDS,
+)
+
 # --- Define Introductory Tour Content (Keep it) ---
 INTRO_TOUR_MESSAGES = [
     "Welcome to the Bitcoin Introduction Tour!",
@@ -184,6 +374,20 @@ INTRO_TOUR_MESSAGES = [
     "That concludes the brief tour! Feel free to ask me specific questions about any of these topics or anything else related to Bitcoin. Just type your question below.",
 ]
 
+# Serialized and compressed once; /tour only picks an encoding and checks the ETag
+TOUR_ASSET = StaticAsset.from_json({"tour": INTRO_TOUR_MESSAGES}, cache_control=TOUR_CACHE_CONTROL)
+
+# --- Follow-up questions for the tour topics (used to pre-warm the answer cache) ---
+INTRO_TOUR_TOPIC_QUESTIONS = [
+    "What is Bitcoin?",
+    "Who is Satoshi Nakamoto?",
+    "What is the blockchain?",
+    "What is Bitcoin mining?",
+    "Why is the Bitcoin supply limited to 21 million coins?",
+    "What is a Bitcoin wallet?",
+    "Why is Bitcoin so volatile?",
+]
+
 # --- Curated Resource Links (Keep it) ---
 RESOURCE_LINKS = {
     r'\b(what is bitcoin|intro to bitcoin|bitcoin explained)\b': [
@@ -219,6 +423,9 @@ RESOURCE_LINKS = {
     # Add more keywords and relevant links here!
 }
 
+# --- Keyword matcher compiled once at startup (single pass over the text) ---
+RESOURCE_LINK_MATCHER = LinkMatcher(RESOURCE_LINKS)
+
 # --- Helper to find relevant links (Keep it) ---
 def find_relevant_links(text_to_analyze, links_dict):
     """
@@ -228,142 +435,780 @@ def find_relevant_links(text_to_analyze, links_dict):
     found_links = set()
     lower_text = text_to_analyze.lower()
 
-    for pattern, links in links_dict.items():
-        if re.search(pattern, lower_text):
-            logger.debug(f"Matched pattern '{pattern}' in text.")
-            for link_info in links:
-                found_links.add((link_info['text'], link_info['url']))
+    # Reuse the precompiled matcher for the curated table; build one for any other dict
+    matcher = RESOURCE_LINK_MATCHER if links_dict is RESOURCE_LINKS else LinkMatcher(links_dict)
+    for pattern in matcher.find_topics(lower_text):
+        logger.debug("Matched pattern '%s' in text.", pattern)
+        for link_info in links_dict[pattern]:
+            found_links.add((link_info['text'], link_info['url']))
 
     return list(found_links)
 
+# --- Helper to build the "Related Resources" block appended to answers ---
+def format_links_section(bot_response):
+    """
+    Returns the Markdown "Related Resources" section for a bot response,
+    or an empty string when no curated links match.
+    """
+    # Analyze the *final* bot response text for keywords
+    with metrics.stage("links"):
+        relevant_links = find_relevant_links(bot_response, RESOURCE_LINKS)
+    traffic_capture.note(l=len(relevant_links))
+    # Optional: Also analyze the user question
+    # relevant_links.extend(find_relevant_links(user_question, RESOURCE_LINKS))
+    # relevant_links = list(set(relevant_links)) # Deduplicate if combining
+
+    if not relevant_links:
+        return ""
+
+    logger.info("Found %d relevant links.", len(relevant_links), extra={"sample": "request"})
+    # Format links in Markdown list
+    links_section = "\n\n**Related Resources:**\n"
+    # Sort links alphabetically by text for consistency (optional)
+    relevant_links.sort(key=lambda x: x[0])
+    for text, url in relevant_links:
+        links_section += f"- [{text}]({url})\n"
+    return links_section
+
+# --- Helper to prepend the real-time data block to the user's question ---
+# (the block itself is built by market_data, which the CLI shares)
+build_data_block = market_data.build_data_block
+
+def build_prompt_with_data(user_question, data_block=None, reference_notes=""):
+    """Builds the prompt sent to Gemini; batches pass the data block they fetched once."""
+    if data_block is None:
+        data_block = build_data_block()
+    prompt_with_data = f"{data_block}{reference_notes}User Question: {user_question}\n\nAnswer:"
+    logger.debug("Full prompt sent to Gemini:\n---\n%s\n---", prompt_with_data)
+    return prompt_with_data
+
+# --- Helper to consult the curated knowledge base before Gemini ---
+def consult_knowledge_base(user_question, chat_history):
+    """
+    Returns (direct_answer or None, reference_notes). Only opening questions
+    about static topics are answered directly; follow-ups depend on the
+    conversation and live-data questions on the market data.
+    """
+    if knowledge_base is None:
+        return None, ""
+    allow_direct = not chat_history and not LIVE_DATA_QUESTION_RE.search(user_question.lower())
+    with metrics.stage("retrieval"):
+        return knowledge_base.lookup(user_question, allow_direct=allow_direct)
+
+# --- Helper to answer locally (intent router, then knowledge base) before Gemini ---
+def answer_locally(user_question, chat_history):
+    """
+    Returns (direct_answer or None, reference_notes). Current-metric
+    questions are answered from the cached market data and clearly off-topic
+    ones get the scope refusal; otherwise the knowledge base is consulted.
+    """
+    if intent_router is not None:
+        with metrics.stage("route"):
+            route = intent_router.classify(user_question, has_history=bool(chat_history))
+        if route.name == ROUTE_OFF_TOPIC:
+            traffic_capture.note(rn=route.name)
+            return off_topic_refusal(route.topic), ""
+        if route.name == ROUTE_METRICS:
+            btc_data, fetch_error = get_raw_bitcoin_data()
+            answer = render_metrics_answer(route.metrics, btc_data) if btc_data and not fetch_error else None
+            if answer is not None:
+                traffic_capture.note(rn=route.name)
+                return answer, ""
+            # Stale or missing data: the model explains that per SYSTEM_PROMPT
+            intent_router.stats.record("metrics_unavailable")
+    return consult_knowledge_base(user_question, chat_history)
+
+# --- Helper to summarize folded history turns with Gemini ---
+def summarize_history_with_gemini(previous_summary, turns):
+    transcript = "\n".join(f"{'User' if turn['type'] == 'user' else 'Assistant'}: {turn['text']}" for turn in turns)
+    prompt = (
+        "Condense this Bitcoin chatbot conversation into at most 8 short bullet points. "
+        "Keep the topics asked about, facts already given and any user preferences. "
+        "Drop greetings and repetition.\n\n"
+    )
+    if previous_summary:
+        prompt += f"Existing summary of even earlier turns:\n{previous_summary}\n\n"
+    prompt += f"New turns to fold in:\n{transcript}\n\nUpdated summary:"
+    response = llm.generate(LLMRequest(prompt))
+    record_llm_usage(response, prompt)
+    if not response.ok:
+        raise ValueError(response.text)
+    return response.text
+
+# --- History compactor (token budget + rolling summary) ---
+history_compactor = HistoryCompactor(
+    budget_tokens=HISTORY_TOKEN_BUDGET,
+    keep_recent_turns=HISTORY_KEEP_RECENT_TURNS,
+    summarize_fn=summarize_history_with_gemini if HISTORY_SUMMARIZER == "gemini" else None,
+    estimator=TokenEstimator(),
+)
+
+def calibrate_token_estimator():
+    try:
+        history_compactor.estimator.calibrate(INTRO_TOUR_MESSAGES, lambda text: get_model().count_tokens(text).total_tokens)
+    except Exception:
+        logger.exception("Token estimator calibration failed, keeping the default ratio:")
+
+# --- Helpers to reuse a conversation's live Gemini ChatSession ---
+def open_chat(conversation_id, turn_count):
+    """Returns the conversation's live ChatSession if it is in sync, else None (the backend starts one from the history)."""
+    chat = live_chats.checkout(conversation_id, turn_count) if conversation_id else None
+    if chat is not None:
+        logger.debug("Reusing live chat session for conversation %s.", conversation_id)
+    return chat
+
+def compact_for_request(chat_history, prompt_with_data, conversation_id=None):
+    """Applies the history token budget and records before/after token stats. Returns (model_history, compacted)."""
+    with metrics.stage("history"):
+        model_history, compacted = history_compactor.compact(chat_history, conversation_id)
+
+    estimator = history_compactor.estimator
+    fixed_tokens = estimator.count(SYSTEM_PROMPT) + estimator.count(prompt_with_data)
+    tokens_before = fixed_tokens + estimator.count_turns(chat_history)
+    tokens_after = fixed_tokens + estimator.count_turns(model_history) if compacted else tokens_before
+    history_compactor.stats.record(tokens_before, tokens_after, compacted)
+    if compacted:
+        logger.info("Compacted history from ~%d to ~%d tokens (%d -> %d turns).", tokens_before, tokens_after, len(chat_history), len(model_history))
+    return model_history, compacted
+
+def prepare_llm_request(chat_history, prompt_with_data, conversation_id=None):
+    """
+    Compacts the history to the token budget and attaches the live chat, if
+    any. Returns (LLMRequest, reusable); a chat built from a compacted
+    history is not kept alive, since it no longer mirrors the stored turns.
+    """
+    model_history, compacted = compact_for_request(chat_history, prompt_with_data, conversation_id)
+    chat = open_chat(None if compacted else conversation_id, len(chat_history))
+    return LLMRequest(prompt_with_data, model_history, chat), not compacted
+
+def keep_chat_alive(conversation_id, chat, user_question, turn_count):
+    """Parks the ChatSession after a successful turn so the next turn can continue it."""
+    # Store the raw question rather than the data-laden prompt, matching a rebuilt history
+    chat.history = chat.history[:-2] + [{'role': 'user', 'parts': [{'text': user_question}]}, chat.history[-1]]
+    live_chats.checkin(conversation_id, chat, turn_count + 2)
+
+# --- Helpers to record answer and model usage metrics ---
+def record_llm_usage(response, prompt):
+    """For LLMResponses; per-backend token counts are recorded by llm_backends."""
+    PROMPT_CHARS.observe(len(prompt))
+    # A turn may take several calls (e.g. a history summary first), so the capture sums them
+    traffic_capture.note(be=response.backend)
+    traffic_capture.add(pt=response.prompt_tokens, ot=response.output_tokens)
+
+def record_answer(source, answer):
+    ANSWERS.labels(source).observe(len(answer))
+
+# --- Helpers for admission control in front of Gemini ---
+def client_key():
+    """The per-client bucket key: the caller's address (first X-Forwarded-For hop if trusted)."""
+    if ADMISSION_TRUST_FORWARDED_FOR and request.headers.get('X-Forwarded-For'):
+        return request.headers['X-Forwarded-For'].split(',')[0].strip()
+    return request.remote_addr or "unknown"
+
+def estimate_request_tokens(chat_history, prompt_with_data):
+    """Tokens one turn is expected to cost; history beyond the budget gets compacted, so it is capped."""
+    estimator = history_compactor.estimator
+    history_tokens = min(estimator.count_turns(chat_history), HISTORY_TOKEN_BUDGET)
+    return estimator.count(SYSTEM_PROMPT) + estimator.count(prompt_with_data) + history_tokens + ADMISSION_EXPECTED_OUTPUT_TOKENS
+
+def admit_gemini_call(chat_history, prompt_with_data, client=None, priority=PRIORITY_INTERACTIVE):
+    """
+    Waits for a Gemini call slot. Returns a Ticket (None with admission
+    control off) or raises AdmissionRejected. Interactive calls get the
+    configured deadline; batch calls may wait as long as it takes.
+    """
+    if admission_controller is None:
+        return None
+    timeout = ADMISSION_DEADLINE_SECONDS if priority == PRIORITY_INTERACTIVE else None
+    with metrics.stage("admission"):
+        return admission_controller.admit(client, estimate_request_tokens(chat_history, prompt_with_data),
+                                          priority=priority, timeout=timeout)
+
+def finish_gemini_call(ticket, response=None, error=None):
+    """Frees the slot and settles the bucket against the backend's reported token usage."""
+    if ticket is None:
+        return
+    tokens_used = (response.total_tokens or None) if response is not None else None
+    ticket.release(tokens_used=tokens_used, overloaded=is_overload_error(error))
+
+def rejection_response(rejection):
+    logger.warning("Request not admitted (%d): %s", rejection.status, rejection.reason)
+    traffic_capture.note(src="rejected")
+    response = jsonify({"error": f"{rejection.reason} Please try again in {rejection.retry_after} seconds."})
+    response.status_code = rejection.status
+    response.headers['Retry-After'] = str(rejection.retry_after)
+    return response
+
+# --- Helper to call Gemini for one chat turn ---
+def generate_bot_response(chat_history, prompt_with_data, conversation_id=None, user_question=None,
+                          client=None, priority=PRIORITY_INTERACTIVE):
+    """
+    Sends the prompt on top of the given chat history.
+    Returns (bot_response, ok); ok is False for blocked responses and errors,
+    which must not be cached. Raises AdmissionRejected if the call is shed.
+    """
+    ticket = admit_gemini_call(chat_history, prompt_with_data, client, priority)
+    response = error = None
+    started = time.perf_counter()
+    try:
+        llm_request, reusable = prepare_llm_request(chat_history, prompt_with_data, conversation_id)
+        response = llm.generate(llm_request)
+        logger.info("LLM call to %s successful.", response.backend, extra={"sample": "request"})
+        record_llm_usage(response, prompt_with_data)
+
+        if response.ok:
+             bot_response = response.text
+             logger.info("Successfully generated bot response.", extra={"sample": "request"})
+             logger.debug("Bot Response: %s", bot_response)
+             # Only a Gemini chat carries the conversation forward; otherwise the next turn rebuilds it
+             if conversation_id and reusable and response.chat is not None:
+                 keep_chat_alive(conversation_id, response.chat, user_question, len(chat_history))
+             return bot_response, True
+        return response.text, False
+
+    except Exception as e:
+        error = e
+        logger.exception("An error occurred during the LLM call:")
+        return f"An internal error occurred while contacting the AI: {e}", False
+    finally:
+        traffic_capture.note(lm=round((time.perf_counter() - started) * 1000, 2))
+        finish_gemini_call(ticket, response, error)
+
+# --- Helper to record a captured request's question (see traffic_capture.py) ---
+def capture_question(user_question, chat_history):
+    if capture_log is not None:
+        traffic_capture.note(q=user_question, h=len(chat_history), hf=history_fingerprint(chat_history)[:16],
+                             v=get_bitcoin_data_version())
+
+# --- Helper to compute the answer-cache key (None if the turn is not cacheable) ---
+def answer_cache_key(user_question, chat_history):
+    if len(chat_history) > ANSWER_CACHE_MAX_HISTORY_TURNS:
+        return None
+    return AnswerCache.make_key(user_question, chat_history, get_bitcoin_data_version())
+
+# --- Helper to fill the answer cache with the intro tour topics ---
+def prewarm_answer_cache():
+    def answer_fn(question):
+        prompt_with_data = build_prompt_with_data(question)
+        bot_response, ok = generate_bot_response([], prompt_with_data, priority=PRIORITY_BATCH)
+        return (answer_cache_key(question, []), bot_response) if ok else None
+
+    return answer_cache.prewarm(INTRO_TOUR_TOPIC_QUESTIONS, answer_fn)
+
+# --- Helper to validate the JSON body shared by /ask and /ask/stream ---
+def ask_payload_error(data):
+    """Returns the error message for an invalid body, otherwise None (shared with the ASGI server)."""
+    if not data or 'question' not in data:
+        logger.warning("Invalid request: Missing 'question' in JSON body.")
+        return "Invalid request. Please provide 'question' and either 'history' or 'conversation_id' in the JSON body."
+    conversation_id = data.get('conversation_id')
+    if conversation_id is not None and (not isinstance(conversation_id, str) or not 0 < len(conversation_id) <= 64):
+        logger.warning("Invalid request: Malformed 'conversation_id'.")
+        return "Invalid request. 'conversation_id' must be a non-empty string of at most 64 characters."
+    return None
+
+def validate_ask_payload(data):
+    """Returns an error response tuple for an invalid body, otherwise None."""
+    error_message = ask_payload_error(data)
+    if error_message:
+        return jsonify({"error": error_message}), 400
+    return None
+
+# --- Helper to resolve the chat history for a request ---
+def resolve_conversation(data):
+    """
+    Returns (conversation_id, chat_history). Requests that carry 'history'
+    are stateless (conversation_id is None); otherwise the history comes
+    from the session store and a new conversation is started if needed.
+    """
+    if 'history' in data:
+        return None, data['history']
+    conversation_id = data.get('conversation_id') or new_conversation_id()
+    chat_history = session_store.load(conversation_id)
+    if chat_history is None:
+        logger.info("Starting conversation %s.", conversation_id, extra={"sample": "request"})
+        chat_history = []
+    return conversation_id, chat_history
+
+# --- Helper to append a finished turn to the conversation ---
+def record_conversation_turn(conversation_id, user_question, bot_response):
+    if conversation_id:
+        session_store.append(conversation_id, [
+            {'type': 'user', 'text': user_question},
+            {'type': 'bot', 'text': bot_response},
+        ])
+
+# --- Helpers for /ask/batch ---
+def batch_over_client_budget(questions, data_block):
+    """
+    The error message for a batch whose estimated tokens exceed the per-client
+    bucket's capacity, otherwise None. Every LLM call of a batch is charged to
+    the caller's bucket, so such a batch could never finish.
+    """
+    if admission_controller is None or not questions:
+        return None
+    estimates = [estimate_request_tokens([], build_prompt_with_data(question, data_block)) for question in questions]
+    capacity = admission_controller.client_capacity
+    if sum(estimates) <= capacity:
+        return None
+    max_questions = max(1, int(capacity // (sum(estimates) / len(estimates))))
+    return (f"This batch needs about {sum(estimates)} tokens, more than the per-client limit of {capacity}."
+            f" Send at most about {max_questions} questions per batch.")
+
+def batch_payload_error(data):
+    """Returns the error message for an invalid /ask/batch body, otherwise None."""
+    questions = data.get('questions') if isinstance(data, dict) else None
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) for q in questions):
+        return "Invalid request. Please provide 'questions' as a non-empty list of strings."
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return f"Invalid request. At most {BATCH_MAX_QUESTIONS} questions per batch."
+    concurrency = data.get('concurrency', BATCH_DEFAULT_CONCURRENCY)
+    if not isinstance(concurrency, int) or isinstance(concurrency, bool) or not 1 <= concurrency <= BATCH_MAX_CONCURRENCY:
+        return f"Invalid request. 'concurrency' must be an integer between 1 and {BATCH_MAX_CONCURRENCY}."
+    return None
+
+def answer_batch_question(user_question, data_block, data_version, client):
+    """
+    One history-less batch answer: returns (answer_with_links, ok). LLM
+    errors propagate so batch_runner can retry them. client is the caller's
+    bucket key, read before the streamed body starts (see client_key).
+    """
+    if not user_question.strip():
+        return "Please enter a question.", False
+    direct_answer, reference_notes = answer_locally(user_question, [])
+    if direct_answer is not None:
+        record_answer("local", direct_answer)
+        return direct_answer + format_links_section(direct_answer), True
+    cache_key = AnswerCache.make_key(user_question, [], data_version)
+    bot_response = answer_cache.get(cache_key)
+    if bot_response is None:
+        prompt_with_data = build_prompt_with_data(user_question, data_block, reference_notes)
+        ticket = admit_gemini_call([], prompt_with_data, client, priority=PRIORITY_BATCH)
+        response = error = None
+        try:
+            response = llm.generate(LLMRequest(prompt_with_data))
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            finish_gemini_call(ticket, response, error)
+        record_llm_usage(response, prompt_with_data)
+        if not response.ok:
+            return response.text, False
+        bot_response = response.text
+        answer_cache.put(cache_key, bot_response)
+        record_answer("gemini", bot_response)
+    else:
+        record_answer("cache", bot_response)
+    return bot_response + format_links_section(bot_response), True
+
+# --- Helpers for prebuilt and compressed responses ---
+def asset_response(asset):
+    """Serves a StaticAsset for this request's Accept-Encoding and If-None-Match."""
+    status, headers, body = asset.respond(request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+    response = Response(body, status=status, headers=headers)
+    if status == 304:
+        # Werkzeug would otherwise add a text/html Content-Type to the empty 304
+        response.headers.pop('Content-Type', None)
+    return response
+
+def compress_json_response(response):
+    """Compresses a JSON body of at least JSON_COMPRESSION_MIN_BYTES if the client accepts it."""
+    if (not JSON_COMPRESSION_MIN_BYTES or response.mimetype != 'application/json' or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.status_code < 200 or response.status_code == 304):
+        return response
+    body = response.get_data()
+    if len(body) < JSON_COMPRESSION_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'), available_encodings())
+    if encoding:
+        with metrics.stage("compress"):
+            response.set_data(compress(body, encoding, fast=True))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+# --- Helper to format one Server-Sent Event ---
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
 # --- Flask App Setup ---
 app = Flask(__name__)
 CORS(app) # Enable CORS for all routes
 
-# --- Limiter Initialization (if you added it, keep it) ---
-# from flask_limiter import Limiter
-# from flask_limiter.util import get_remote_address
-# limiter = Limiter(
-#     get_remote_address,
-#     app=app,
-#     default_limits=["200 per day", "50 per hour"],
-#     storage_uri="memory://"
-# )
+# --- Rate limiting: token buckets and load shedding sit in front of each Gemini call (see admit_gemini_call) ---
+
+
+# --- Request IDs: stamped on every log record of the request and echoed back as X-Request-ID ---
+@app.before_request
+def assign_request_id():
+    g.request_id = log_pipeline.set_request_id(log_pipeline.clean_request_id(request.headers.get('X-Request-ID')))
+
+@app.after_request
+def add_request_id(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+# --- Request metrics: in-flight gauge, latency histogram and the Server-Timing header ---
+@app.before_request
+def start_request_metrics():
+    g.request_timings = metrics.start_request()
+    g.metrics_route = request.url_rule.rule if request.url_rule else "unmatched"
+    if capture_log is not None and request.endpoint in CAPTURED_ENDPOINTS:
+        capture_log.begin(CAPTURED_ENDPOINTS[request.endpoint])
+    HTTP_IN_FLIGHT.labels(g.metrics_route).inc()
+
+@app.after_request
+def add_server_timing(response):
+    HTTP_REQUESTS.labels(g.get('metrics_route', "unmatched"), str(response.status_code)).inc()
+    traffic_capture.note(s=response.status_code)
+    # Streamed bodies are produced after the headers go out, so they carry only the setup stages
+    timings = g.get('request_timings')
+    if SERVER_TIMING_ENABLED and timings is not None:
+        response.headers['Server-Timing'] = timings.server_timing_header()
+    return response
+
+# after_request hooks run in reverse order, so this runs before add_server_timing and its time shows up there
+@app.after_request
+def compress_json(response):
+    return compress_json_response(response)
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    timings = g.pop('request_timings', None)
+    if timings is not None:
+        route = g.get('metrics_route', "unmatched")
+        HTTP_REQUEST_SECONDS.labels(route).observe(timings.elapsed())
+        HTTP_IN_FLIGHT.labels(route).dec()
+    if capture_log is not None:
+        capture_log.finish(timings)
+    metrics.end_request()
 
 
 # --- API Endpoints ---
 
 # Endpoint for handling user chat questions
 @app.route('/ask', methods=['POST'])
-# Apply rate limit if you added the feature
-# @limiter.limit("10/minute")
 def ask_bitcoin_api():
-    """Handles POST requests with JSON data for standard chat questions."""
-    if model is None:
-         logger.error("Gemini model not initialized.")
+    """
+    Handles POST requests with JSON data for standard chat questions.
+    Send either the full 'history' (stateless) or only the new 'question'
+    plus the 'conversation_id' returned by a previous answer.
+    """
+    if not llm.ready():
+         logger.error("No LLM backend available.")
          return jsonify({"answer": "The chatbot backend is not fully initialized. Please try again later or contact the administrator."}), 503
 
-    logger.info("Received /ask request.")
+    logger.info("Received /ask request.", extra={"sample": "request"})
     try:
         data = request.get_json()
 
-        if not data or 'question' not in data or 'history' not in data:
-            logger.warning("Invalid request: Missing 'question' or 'history' in JSON body.")
-            return jsonify({"error": "Invalid request. Please provide 'question' and 'history' in the JSON body."}), 400
+        invalid_response = validate_ask_payload(data)
+        if invalid_response:
+            return invalid_response
 
         user_question = data['question']
-        chat_history_frontend = data['history']
 
         if not user_question:
              logger.info("Received empty user question.")
              return jsonify({"answer": "Please enter a question."})
 
-        logger.info(f"User Question: {user_question}")
-        logger.debug(f"Chat History received ({len(chat_history_frontend)} turns): {chat_history_frontend}")
+        conversation_id, chat_history_frontend = resolve_conversation(data)
+
+        logger.info("User Question: %s", user_question, extra={"sample": "question"})
+        logger.debug("Chat History received (%d turns): %s", len(chat_history_frontend), chat_history_frontend)
+        capture_question(user_question, chat_history_frontend)
+
+        # --- Fetch Real-time Data (uses cache internally) & Prepare Prompt ---
+        direct_answer, reference_notes = answer_locally(user_question, chat_history_frontend)
+        prompt_with_data = build_prompt_with_data(user_question, reference_notes=reference_notes)
 
-        # --- Fetch Real-time Data (uses cache internally) ---
-        realtime_data_string, fetch_error = get_bitcoin_data()
+        # --- Generate Content (knowledge base, then answer cache, then Gemini) ---
+        cache_key = answer_cache_key(user_question, chat_history_frontend)
+        bot_response = direct_answer
+        if bot_response is None and cache_key:
+            bot_response = answer_cache.get(cache_key)
 
-        # --- Prepare Prompt for Gemini ---
-        data_block_for_prompt = "--- RECENT BITCOIN DATA ---\n"
-        if fetch_error:
-             data_block_for_prompt += f"Data Fetch Status: ERROR - {fetch_error}\n"
-             logger.warning(f"Data fetch error included in prompt: {fetch_error}")
+        if bot_response is not None:
+            logger.info("Answered locally without Gemini." if direct_answer is not None else "Answer cache hit.",
+                        extra={"sample": "request"})
+            record_answer("local" if direct_answer is not None else "cache", bot_response)
+            traffic_capture.note(src="local" if direct_answer is not None else "cache")
+            record_conversation_turn(conversation_id, user_question, bot_response)
         else:
-             data_block_for_prompt += realtime_data_string.replace("--- RECENT BITCOIN DATA ---\n", "")
+            bot_response, ok = generate_bot_response(chat_history_frontend, prompt_with_data, conversation_id, user_question,
+                                                     client=client_key())
+            record_answer("gemini" if ok else "error", bot_response)
+            traffic_capture.note(src="llm" if ok else "error")
+            if ok:
+                record_conversation_turn(conversation_id, user_question, bot_response)
+                if cache_key:
+                    answer_cache.put(cache_key, bot_response)
 
-        data_block_for_prompt += "--------------------------\n\n"
+        # --- Find and Append Relevant Links ---
+        bot_response += format_links_section(bot_response)
+        traffic_capture.note(n=len(bot_response))
 
-        prompt_with_data = f"{data_block_for_prompt}User Question: {user_question}\n\nAnswer:"
-        logger.debug(f"Full prompt sent to Gemini:\n---\n{prompt_with_data}\n---")
+        # Return the AI's chat response with optional links as JSON
+        payload = {"answer": bot_response}
+        if conversation_id:
+            payload["conversation_id"] = conversation_id
+        with metrics.stage("serialize"):
+            return jsonify(payload)
+
+    except AdmissionRejected as rejection:
+        return rejection_response(rejection)
+    except Exception as e:
+        logger.exception("An unexpected error occurred in the /ask route handler:")
+        return jsonify({"error": "An unexpected internal server error occurred."}), 500
 
-        # --- Generate Content ---
-        bot_response = "Sorry, I couldn't process your request."
 
-        try:
-            gemini_history = format_history_for_gemini(chat_history_frontend)
-            chat = model.start_chat(history=gemini_history)
-            response = chat.send_message(prompt_with_data)
-            logger.info("Gemini send_message call successful.")
-
-            if response.parts:
-                 bot_response = response.text.strip()
-                 logger.info("Successfully generated bot response.")
-                 logger.debug(f"Bot Response: {bot_response}")
-            else:
-                 block_reason = response.prompt_feedback.block_reason if response.prompt_feedback else "Unknown"
-                 finish_reason = response.candidates[0].finish_reason if response.candidates else "N/A"
-                 bot_response = f"Response blocked or incomplete. Reason: {block_reason}. Finish: {finish_reason}. Please try rephrasing."
-                 logger.warning(f"API response incomplete or blocked. Prompt Feedback: {response.prompt_feedback}, Candidates: {response.candidates}")
+# Streaming variant of /ask: forwards Gemini chunks as Server-Sent Events
+@app.route('/ask/stream', methods=['POST'])
+def ask_bitcoin_stream_api():
+    """
+    Same request body as /ask, but answers with a text/event-stream.
+    Events: 'chunk' ({"text": ...}) as Gemini produces output, 'links'
+    ({"text": ...}) with the Related Resources block, then 'done'
+    ({"answer": ...}, plus 'conversation_id' in session mode) carrying the
+    full answer. Failures emit 'error'.
+    """
+    if not llm.ready():
+         logger.error("No LLM backend available.")
+         return jsonify({"answer": "The chatbot backend is not fully initialized. Please try again later or contact the administrator."}), 503
 
-        except Exception as e:
-            logger.exception("An error occurred during Gemini send_message:")
-            bot_response = f"An internal error occurred while contacting the AI: {e}"
+    logger.info("Received /ask/stream request.", extra={"sample": "request"})
+    try:
+        data = request.get_json()
 
-        # --- Find and Append Relevant Links ---
-        # Analyze the *final* bot response text for keywords
-        relevant_links = find_relevant_links(bot_response, RESOURCE_LINKS)
-        # Optional: Also analyze the user question
-        # relevant_links.extend(find_relevant_links(user_question, RESOURCE_LINKS))
-        # relevant_links = list(set(relevant_links)) # Deduplicate if combining
-
-        if relevant_links:
-             logger.info(f"Found {len(relevant_links)} relevant links.")
-             # Format links in Markdown list
-             links_section = "\n\n**Related Resources:**\n"
-             # Sort links alphabetically by text for consistency (optional)
-             relevant_links.sort(key=lambda x: x[0])
-             for text, url in relevant_links:
-                 links_section += f"- [{text}]({url})\n"
-             bot_response += links_section # Append to the bot's response
+        invalid_response = validate_ask_payload(data)
+        if invalid_response:
+            return invalid_response
 
-        # Return the AI's chat response with optional links as JSON
-        return jsonify({"answer": bot_response})
+        user_question = data['question']
+
+        if not user_question:
+             logger.info("Received empty user question.")
+             return jsonify({"answer": "Please enter a question."})
 
+        conversation_id, chat_history_frontend = resolve_conversation(data)
+
+        logger.info("User Question (stream): %s", user_question, extra={"sample": "question"})
+        capture_question(user_question, chat_history_frontend)
+        direct_answer, reference_notes = answer_locally(user_question, chat_history_frontend)
+        prompt_with_data = build_prompt_with_data(user_question, reference_notes=reference_notes)
+        cache_key = answer_cache_key(user_question, chat_history_frontend)
+        cached_response = direct_answer
+        if cached_response is None and cache_key:
+            cached_response = answer_cache.get(cache_key)
+        # Admit before the 200 goes out, so a shed request still gets a proper 429/503
+        ticket = None
+        if cached_response is None:
+            ticket = admit_gemini_call(chat_history_frontend, prompt_with_data, client_key())
+    except AdmissionRejected as rejection:
+        return rejection_response(rejection)
     except Exception as e:
-        logger.exception("An unexpected error occurred in the /ask route handler:")
+        logger.exception("An unexpected error occurred in the /ask/stream route handler:")
         return jsonify({"error": "An unexpected internal server error occurred."}), 500
 
+    def done_event(answer):
+        payload = {'answer': answer}
+        if conversation_id:
+            payload['conversation_id'] = conversation_id
+        return sse_event('done', payload)
+
+    def generate_events():
+        if cached_response is not None:
+            logger.info("Answered locally without Gemini." if direct_answer is not None else "Answer cache hit.",
+                        extra={"sample": "request"})
+            record_answer("local" if direct_answer is not None else "cache", cached_response)
+            traffic_capture.note(src="local" if direct_answer is not None else "cache")
+            record_conversation_turn(conversation_id, user_question, cached_response)
+            yield sse_event('chunk', {'text': cached_response})
+            links_section = format_links_section(cached_response)
+            traffic_capture.note(n=len(cached_response) + len(links_section))
+            yield sse_event('links', {'text': links_section})
+            yield done_event(cached_response + links_section)
+            return
+
+        bot_response = ""
+        stream = response = error = None
+        call_started = time.perf_counter()
+        try:
+            llm_request, reusable = prepare_llm_request(chat_history_frontend, prompt_with_data, conversation_id)
+            started = time.perf_counter()
+            stream = llm.stream(llm_request)
+            for text in stream:
+                if not bot_response:
+                    metrics.record_stage("gemini_first_chunk", time.perf_counter() - started)
+                bot_response += text
+                yield sse_event('chunk', {'text': text})
+            response = stream.response
+            record_llm_usage(response, prompt_with_data)
+
+            if response.ok:
+                bot_response = response.text
+                record_answer("gemini", bot_response)
+                logger.info("Successfully streamed bot response from %s.", response.backend, extra={"sample": "request"})
+                record_conversation_turn(conversation_id, user_question, bot_response)
+                if conversation_id and reusable and response.chat is not None:
+                    keep_chat_alive(conversation_id, response.chat, user_question, len(chat_history_frontend))
+                if cache_key:
+                    answer_cache.put(cache_key, bot_response)
+            else:
+                bot_response = response.text
+                yield sse_event('chunk', {'text': bot_response})
+
+        except Exception as e:
+            error = e
+            logger.exception("An error occurred during the streaming LLM call:")
+            error_text = f"An internal error occurred while contacting the AI: {e}"
+            yield sse_event('error', {'text': error_text})
+            bot_response += error_text
+        finally:
+            # Also runs if the client disconnects mid-stream and the generator is closed
+            if stream is not None:
+                stream.close()
+            traffic_capture.note(src="llm" if response is not None and response.ok else "error",
+                                 lm=round((time.perf_counter() - call_started) * 1000, 2))
+            finish_gemini_call(ticket, response, error)
+
+        # --- Related Resources go out as the final event ---
+        links_section = format_links_section(bot_response)
+        traffic_capture.note(n=len(bot_response) + len(links_section))
+        yield sse_event('links', {'text': links_section})
+        yield done_event(bot_response + links_section)
+
+    # The body is produced after this request's teardown, so its capture record is finished there
+    captured = traffic_capture.detach()
+    timings = metrics.current_request()
+
+    def captured_events():
+        traffic_capture.attach(captured)
+        metrics.resume_request(timings)
+        try:
+            yield from generate_events()
+        finally:
+            traffic_capture.note(s=200)
+            capture_log.finish(timings)
+            metrics.end_request()
+
+    streamed = Response(
+        stream_with_context(captured_events() if captured is not None else generate_events()),
+        mimetype='text/event-stream',
+        # Disable proxy buffering (nginx/Render) so chunks reach the client immediately
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    if ticket is not None:
+        # Frees the slot even if the client leaves before the generator starts (release is idempotent)
+        streamed.call_on_close(ticket.release)
+    return streamed
+
+
+# Batch variant of /ask for regression runs and cache pre-warming
+@app.route('/ask/batch', methods=['POST'])
+def ask_bitcoin_batch_api():
+    """
+    Answers many independent (history-less) questions in one request.
+    Body: {"questions": [...], "concurrency": optional int}. Responds with
+    NDJSON, one line per question as it finishes ({"index", "question",
+    "answer", "ok", "attempts", "elapsed_ms"}), then a {"summary": ...} line.
+    """
+    if not llm.ready():
+         logger.error("No LLM backend available.")
+         return jsonify({"answer": "The chatbot backend is not fully initialized. Please try again later or contact the administrator."}), 503
+
+    data = request.get_json(silent=True)
+    error_message = batch_payload_error(data)
+    if error_message:
+        logger.warning("Invalid /ask/batch request: %s", error_message)
+        return jsonify({"error": error_message}), 400
+
+    questions = data['questions']
+    concurrency = data.get('concurrency', BATCH_DEFAULT_CONCURRENCY)
+    logger.info("Received /ask/batch request: %d questions, concurrency %d.", len(questions), concurrency)
+
+    # One market-data read and one bucket for the whole batch; the workers answering it run outside this request
+    data_block, data_version, client = build_data_block(), get_bitcoin_data_version(), client_key()
+    error_message = batch_over_client_budget(questions, data_block)
+    if error_message:
+        logger.warning("Rejected /ask/batch request: %s", error_message)
+        return jsonify({"error": error_message}), 413
+    results = run_batch(
+        questions,
+        lambda question: answer_batch_question(question, data_block, data_version, client),
+        concurrency=concurrency,
+        limiter=batch_upstream_slots,
+        max_retries=BATCH_MAX_RETRIES,
+        backoff_seconds=BATCH_BACKOFF_SECONDS,
+        max_backoff_seconds=BATCH_MAX_BACKOFF_SECONDS,
+    )
+    return Response(
+        stream_with_context(ndjson_lines(results)),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
 
 # Endpoint for getting the introductory tour messages (Keep it separate)
 @app.route('/tour', methods=['GET'])
-# Apply a rate limit if you added the feature
-# @limiter.limit("5 per hour")
 def get_intro_tour():
     """Returns the list of introductory tour messages."""
-    logger.info("Received /tour request.")
+    logger.info("Received /tour request.", extra={"sample": "request"})
     try:
-        return jsonify({"tour": INTRO_TOUR_MESSAGES}) # Return list under 'tour' key
+        return asset_response(TOUR_ASSET) # {"tour": [...]}, pre-serialized at startup
     except Exception as e:
         logger.exception("An unexpected error occurred in the /tour route handler:")
         return jsonify({"error": "An unexpected internal server error occurred while fetching tour data."}), 500
 
 
-# --- Handle Rate Limit Exceeded (if you added it) ---
-# @app.errorhandler(429)
-# def ratelimit_handler(e):
-#     logger.warning(f"Rate limit exceeded for client {get_remote_address()}: {e.description}")
-#     return jsonify({"error": f"Too many requests. Please try again later."}), 429
+# The built frontend (static/index.html and its hashed bundles), if static serving is on
+@app.route('/', defaults={'filename': ''}, methods=['GET'])
+@app.route('/<path:filename>', methods=['GET'])
+def get_static_asset(filename):
+    """Serves a precompressed frontend file; hashed bundles are cached as immutable."""
+    asset = static_bundle.get(filename) if static_bundle else None
+    if asset is None:
+        return jsonify({"error": "Not found."}), 404
+    return asset_response(asset)
+
+
+# Endpoint for runtime statistics (cache hit/miss counters, compaction token totals)
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """Returns runtime statistics for the answer cache, history compaction, retrieval, routing and admission."""
+    return jsonify({
+        "answer_cache": answer_cache.stats(),
+        "history_compaction": history_compactor.stats.as_dict(),
+        "retrieval": knowledge_base.stats.as_dict() if knowledge_base else None,
+        "intent_router": intent_router.stats.as_dict() if intent_router else None,
+        "admission": admission_controller.stats() if admission_controller else None,
+        "llm": llm.stats(),
+    })
+
+
+# Endpoint for Prometheus scraping (this worker's counters, gauges and histograms)
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Returns all metrics in the Prometheus text exposition format."""
+    return Response(metrics.render(), content_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+
+# Liveness: the process is up and serving requests; never touches Gemini or CoinGecko
+@app.route('/healthz', methods=['GET'])
+def get_health():
+    return jsonify({"status": "ok"})
+
+
+# Readiness: whether this worker can answer questions, plus how long startup took
+@app.route('/readyz', methods=['GET'])
+def get_readiness():
+    """Returns 200 once an LLM backend is available, else 503; both with the checks and startup timings."""
+    ready, checks = readiness()
+    startup_ms = {step: round(seconds * 1000, 1) for step, seconds in metrics.startup_timings.items()}
+    return jsonify({"ready": ready, "checks": checks, "startup_ms": startup_ms}), 200 if ready else 503
+
 
 # --- Handle Generic Internal Server Error ---
 @app.errorhandler(500)
@@ -372,6 +1217,60 @@ def internal_error(error):
     return jsonify({"error": "An unexpected internal server error occurred."}), 500
 
 
+# --- Startup: background tasks per process, and the optional pre-fork warm-up ---
+def start_background_tasks():
+    """
+    Starts this process's threads: the market-data refresher and, if
+    enabled, answer-cache pre-warming and token calibration. Runs at import,
+    or in each forked worker (gunicorn.conf.py post_fork) under preload.
+    """
+    market_data.ensure_refresher_started()
+    if PRELOAD_WARMUP and GEMINI_CONTEXT_CACHE and API_KEY:
+        # warm_up left the context-cached model to the workers (see there); build it now rather than on the first request
+        threading.Thread(target=llm.ready, name="gemini-warm-up", daemon=True).start()
+    if ANSWER_CACHE_PREWARM and API_KEY:
+        threading.Thread(target=prewarm_answer_cache, name="answer-cache-prewarm", daemon=True).start()
+    if HISTORY_CALIBRATE_TOKENS and API_KEY:
+        threading.Thread(target=calibrate_token_estimator, name="token-calibration", daemon=True).start()
+
+def warm_up():
+    """
+    Builds the LLM backends' models and fills the market-data snapshot now
+    instead of on the first request. gunicorn.conf.py calls it in the master before
+    forking, so every worker starts with both. With GEMINI_CONTEXT_CACHE the
+    model needs a network call (CachedContent.create) and a keep-alive
+    thread, which do not belong in the master: only the SDK is imported
+    here, and each worker builds the model in start_background_tasks.
+    """
+    with metrics.startup_step("market_data"):
+        market_data.refresh_if_due()
+    if GEMINI_CONTEXT_CACHE:
+        with metrics.startup_step("gemini_sdk"):
+            configure_gemini_sdk()
+    else:
+        llm.ready()
+    logger.info("Warm-up done: %s", format_startup_report())
+
+def format_startup_report():
+    return ", ".join(f"{step} {seconds * 1000:.0f}ms" for step, seconds in metrics.startup_timings.items())
+
+def readiness():
+    """Returns (ready, checks): ready once an LLM backend can take calls (this builds the Gemini model if needed)."""
+    market_data_version = get_bitcoin_data_version()
+    checks = {
+        "llm": "ok" if llm.ready() else "unavailable",
+        # Not required: without data the answers say so (see SYSTEM_PROMPT)
+        "market_data": "ok" if market_data_version else "loading",
+    }
+    return checks["llm"] == "ok", checks
+
+
+metrics.record_startup_step("import_total", time.perf_counter() - _import_started)
+logger.info("App imported: %s", format_startup_report())
+if not PRELOAD_WARMUP:
+    start_background_tasks()
+
+
 # --- Run the Flask App ---
 if __name__ == '__main__':
     # In production (like Render), a WSGI server like Gunicorn runs the app,
@@ -0,0 +1,491 @@
+"""
+Asyncio (ASGI) serving mode for the chatbot.
+
+Serves the same /ask, /ask/stream and /tour contract (and the static
+frontend) as the Flask app in app.py, with CoinGecko refreshed by
+httpx.AsyncClient. Answers take the same path as in app.py: the intent
+router and knowledge base (answer_locally), the answer cache, then
+admission control (admit_gemini_call) and the LLM router with its circuit
+breakers, hedging and failover (app.llm). Those are blocking, so LLM turns
+run on a dedicated thread pool (ASGI_LLM_THREADS) sized for every admitted
+call plus the admission queue; the event loop stays free for the rest.
+Run it with:
+
+    uvicorn asgi_app:app --workers 2
+    gunicorn asgi_app:app -k uvicorn.workers.UvicornWorker
+
+Each /ask has a per-request timeout (ASK_TIMEOUT_SECONDS). When the client
+disconnects the request stops waiting; an LLM call already running
+finishes on its thread and frees its admission slot, and a stream stops at
+its next chunk.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+import log_pipeline
+import market_data
+import metrics
+from admission import AdmissionRejected
+
+# Claim the refresher slot before importing app.py: this process refreshes
+# market data from an asyncio task, not from the refresher thread.
+market_data.claim_refresher()
+
+import app as flask_app # Shared prompt, cache, session and link helpers
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+ASK_TIMEOUT_SECONDS = float(os.getenv("ASK_TIMEOUT_SECONDS", "60"))
+# Threads for blocking LLM turns: every admitted call plus every request waiting in the admission queue
+ASGI_LLM_THREADS = int(os.getenv(
+    "ASGI_LLM_THREADS", str(flask_app.ADMISSION_MAX_CONCURRENT_CALLS + flask_app.ADMISSION_MAX_QUEUE)))
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(1024 * 1024)))
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-headers", b"*"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+]
+
+llm_calls = ThreadPoolExecutor(max_workers=ASGI_LLM_THREADS, thread_name_prefix="asgi-llm")
+
+
+async def run_blocking(fn, *args):
+    """Runs fn(*args) on the LLM thread pool, in a copy of this context (request ID, Server-Timing stages)."""
+    call = functools.partial(contextvars.copy_context().run, fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(llm_calls, call)
+
+
+http_client = None # httpx.AsyncClient, created in lifespan startup
+METRIC_ROUTES = {"/ask", "/ask/stream", "/tour", "/metrics", "/healthz", "/readyz"}
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+# --- Small ASGI helpers ---
+def server_timing_headers():
+    timings = metrics.current_request()
+    if not flask_app.SERVER_TIMING_ENABLED or timings is None:
+        return ()
+    return [(b"server-timing", timings.server_timing_header().encode())]
+
+
+def client_key(scope, request_headers):
+    """Same per-client bucket key as app.client_key."""
+    forwarded_for = request_headers.get(b"x-forwarded-for", b"").decode("latin-1")
+    if flask_app.ADMISSION_TRUST_FORWARDED_FOR and forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    return scope["client"][0] if scope.get("client") else "unknown"
+
+
+async def send_json(send, status, payload, extra_headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+                   + CORS_HEADERS + list(extra_headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_rejection(send, rejection):
+    """Same response as app.rejection_response."""
+    logger.warning("Request not admitted (%d): %s", rejection.status, rejection.reason)
+    await send_json(send, rejection.status,
+                    {"error": f"{rejection.reason} Please try again in {rejection.retry_after} seconds."},
+                    [(b"retry-after", str(rejection.retry_after).encode())])
+
+
+async def read_json_body(receive):
+    """Reads the request body; returns the decoded JSON, or None if it is missing/invalid/too large."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(b"".join(chunks) or b"null")
+    except ValueError:
+        return None
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_until_disconnect(coro, receive, timeout):
+    """
+    Runs coro, cancelling it if the client disconnects or the timeout passes.
+    Raises ClientDisconnected or asyncio.TimeoutError accordingly.
+    """
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        done, _ = await asyncio.wait({task, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            return task.result()
+        if watcher in done:
+            raise ClientDisconnected()
+        raise asyncio.TimeoutError()
+    finally:
+        for pending in (task, watcher):
+            if not pending.done():
+                pending.cancel()
+        # Let a cancelled handler unwind before the caller sends anything, so no send is interrupted halfway
+        await asyncio.gather(task, watcher, return_exceptions=True)
+
+
+# --- LLM turns (blocking calls on the LLM thread pool) ---
+def pump_stream(stream, loop, events, stop):
+    """
+    Runs on the LLM thread pool: forwards an LLMStream's chunks to the event
+    loop as ('chunk', text)... then ('done', LLMResponse) or ('error', exc).
+    Stops at the next chunk once stop is set, and always closes the stream.
+    """
+    try:
+        for text in stream:
+            if stop.is_set():
+                return
+            loop.call_soon_threadsafe(events.put_nowait, ("chunk", text))
+        loop.call_soon_threadsafe(events.put_nowait, ("done", stream.response))
+    except Exception as e:
+        loop.call_soon_threadsafe(events.put_nowait, ("error", e))
+    finally:
+        stream.close()
+
+
+async def answer_question(data, client):
+    """Shared /ask pipeline. Returns (conversation_id, bot_response) without links; raises AdmissionRejected if shed."""
+    user_question = data['question']
+    # The session store is SQLite: keep its calls off the event loop
+    conversation_id, chat_history = await asyncio.to_thread(flask_app.resolve_conversation, data)
+    direct_answer, reference_notes = flask_app.answer_locally(user_question, chat_history)
+    prompt_with_data = flask_app.build_prompt_with_data(user_question, reference_notes=reference_notes)
+
+    cache_key = flask_app.answer_cache_key(user_question, chat_history)
+    bot_response = direct_answer
+    if bot_response is None and cache_key:
+        bot_response = flask_app.answer_cache.get(cache_key)
+    if bot_response is not None:
+        logger.info("Answered locally without Gemini." if direct_answer is not None else "Answer cache hit.")
+        flask_app.record_answer("local" if direct_answer is not None else "cache", bot_response)
+        await asyncio.to_thread(flask_app.record_conversation_turn, conversation_id, user_question, bot_response)
+        return conversation_id, bot_response
+
+    bot_response, ok = await run_blocking(flask_app.generate_bot_response, chat_history, prompt_with_data,
+                                          conversation_id, user_question, client)
+    flask_app.record_answer("gemini" if ok else "error", bot_response)
+    if ok:
+        await asyncio.to_thread(flask_app.record_conversation_turn, conversation_id, user_question, bot_response)
+        if cache_key:
+            flask_app.answer_cache.put(cache_key, bot_response)
+    return conversation_id, bot_response
+
+
+# --- Endpoints ---
+async def backend_unavailable(send):
+    """Sends app.py's 503 if no LLM backend can take calls (the first check may build the Gemini model)."""
+    if await run_blocking(flask_app.llm.ready):
+        return False
+    logger.error("No LLM backend available.")
+    await send_json(send, 503, {"answer": "The chatbot backend is not fully initialized. Please try again later or contact the administrator."})
+    return True
+
+
+async def handle_ask(receive, send, client):
+    if await backend_unavailable(send):
+        return
+
+    data = await read_json_body(receive)
+    error_message = flask_app.ask_payload_error(data)
+    if error_message:
+        await send_json(send, 400, {"error": error_message})
+        return
+    if not data['question']:
+        await send_json(send, 200, {"answer": "Please enter a question."})
+        return
+
+    logger.info("User Question (async): %s", data['question'], extra={"sample": "question"})
+    try:
+        conversation_id, bot_response = await run_until_disconnect(answer_question(data, client), receive, ASK_TIMEOUT_SECONDS)
+    except AdmissionRejected as rejection:
+        await send_rejection(send, rejection)
+        return
+    except ClientDisconnected:
+        logger.info("Client disconnected; stopped waiting for in-flight /ask.")
+        return
+    except asyncio.TimeoutError:
+        logger.warning("/ask exceeded %ss timeout.", ASK_TIMEOUT_SECONDS)
+        await send_json(send, 504, {"error": "The AI took too long to respond. Please try again."})
+        return
+
+    bot_response += flask_app.format_links_section(bot_response)
+    payload = {"answer": bot_response}
+    if conversation_id:
+        payload["conversation_id"] = conversation_id
+    await send_json(send, 200, payload, server_timing_headers())
+
+
+async def handle_ask_stream(receive, send, client):
+    if await backend_unavailable(send):
+        return
+
+    data = await read_json_body(receive)
+    error_message = flask_app.ask_payload_error(data)
+    if error_message:
+        await send_json(send, 400, {"error": error_message})
+        return
+    if not data['question']:
+        await send_json(send, 200, {"answer": "Please enter a question."})
+        return
+
+    user_question = data['question']
+    conversation_id, chat_history = await asyncio.to_thread(flask_app.resolve_conversation, data)
+    direct_answer, reference_notes = flask_app.answer_locally(user_question, chat_history)
+    prompt_with_data = flask_app.build_prompt_with_data(user_question, reference_notes=reference_notes)
+    cache_key = flask_app.answer_cache_key(user_question, chat_history)
+    cached_response = direct_answer
+    if cached_response is None and cache_key:
+        cached_response = flask_app.answer_cache.get(cache_key)
+    # Admit before the 200 goes out, so a shed request still gets a proper 429/503
+    ticket = None
+    if cached_response is None:
+        try:
+            ticket = await run_blocking(flask_app.admit_gemini_call, chat_history, prompt_with_data, client)
+        except AdmissionRejected as rejection:
+            await send_rejection(send, rejection)
+            return
+    response_started = False
+
+    async def stream_events():
+        nonlocal response_started
+        llm_request = reusable = None
+        if cached_response is None:
+            # Compaction may call the (blocking) summarizer, so keep it off the event loop
+            llm_request, reusable = await run_blocking(
+                flask_app.prepare_llm_request, chat_history, prompt_with_data, conversation_id)
+        response_started = True
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no")] + CORS_HEADERS,
+        })
+
+        async def emit(event, payload):
+            await send({"type": "http.response.body", "body": flask_app.sse_event(event, payload).encode(), "more_body": True})
+
+        bot_response = ""
+        if cached_response is not None:
+            logger.info("Answered locally without Gemini." if direct_answer is not None else "Answer cache hit.")
+            bot_response = cached_response
+            flask_app.record_answer("local" if direct_answer is not None else "cache", bot_response)
+            await asyncio.to_thread(flask_app.record_conversation_turn, conversation_id, user_question, bot_response)
+            await emit('chunk', {'text': bot_response})
+        else:
+            events, stop = asyncio.Queue(), threading.Event()
+            response = error = None
+            try:
+                started = time.perf_counter()
+                llm_calls.submit(contextvars.copy_context().run, pump_stream, flask_app.llm.stream(llm_request),
+                                 asyncio.get_running_loop(), events, stop)
+                while True:
+                    kind, payload = await events.get()
+                    if kind == "chunk":
+                        if not bot_response:
+                            metrics.record_stage("gemini_first_chunk", time.perf_counter() - started)
+                        bot_response += payload
+                        await emit('chunk', {'text': payload})
+                        continue
+                    if kind == "error":
+                        raise payload
+                    response = payload
+                    break
+                flask_app.record_llm_usage(response, prompt_with_data)
+                if response.ok:
+                    bot_response = response.text
+                    flask_app.record_answer("gemini", bot_response)
+                    logger.info("Successfully streamed bot response from %s.", response.backend)
+                    await asyncio.to_thread(flask_app.record_conversation_turn, conversation_id, user_question, bot_response)
+                    if conversation_id and reusable and response.chat is not None:
+                        flask_app.keep_chat_alive(conversation_id, response.chat, user_question, len(chat_history))
+                    if cache_key:
+                        flask_app.answer_cache.put(cache_key, bot_response)
+                else:
+                    bot_response = response.text
+                    await emit('chunk', {'text': bot_response})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+                logger.exception("An error occurred during the streaming LLM call:")
+                error_text = f"An internal error occurred while contacting the AI: {e}"
+                await emit('error', {'text': error_text})
+                bot_response += error_text
+            finally:
+                # Also runs on disconnect or timeout: the pump stops at its next chunk
+                stop.set()
+                flask_app.finish_gemini_call(ticket, response, error)
+
+        links_section = flask_app.format_links_section(bot_response)
+        await emit('links', {'text': links_section})
+        done = {'answer': bot_response + links_section}
+        if conversation_id:
+            done['conversation_id'] = conversation_id
+        await send({"type": "http.response.body", "body": flask_app.sse_event('done', done).encode()})
+
+    try:
+        await run_until_disconnect(stream_events(), receive, ASK_TIMEOUT_SECONDS)
+    except ClientDisconnected:
+        logger.info("Client disconnected; cancelled in-flight /ask/stream.")
+    except asyncio.TimeoutError:
+        logger.warning("/ask/stream exceeded %ss timeout.", ASK_TIMEOUT_SECONDS)
+        if not response_started:
+            await send_json(send, 504, {"error": "The AI took too long to respond. Please try again."})
+        else:
+            # The 200 is out and the stream task has unwound: end the body without a 'done' event
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        if ticket is not None:
+            # Frees the slot even if the stream never started (release is idempotent)
+            ticket.release()
+
+
+async def send_asset(send, asset, request_headers, extra_headers=(), head=False):
+    """Sends a prebuilt StaticAsset (see static_assets.py), honouring Accept-Encoding and If-None-Match."""
+    status, headers, body = asset.respond(request_headers.get(b"accept-encoding", b"").decode("latin-1"),
+                                          request_headers.get(b"if-none-match", b"").decode("latin-1"))
+    headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+    if status != 304:
+        headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers + CORS_HEADERS + list(extra_headers)})
+    # HEAD gets the same headers (Content-Length included) and no body
+    await send({"type": "http.response.body", "body": b"" if head else body})
+
+
+async def handle_tour(send, request_headers):
+    await send_asset(send, flask_app.TOUR_ASSET, request_headers, server_timing_headers())
+
+
+async def handle_metrics(send):
+    body = metrics.render().encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", metrics.PROMETHEUS_CONTENT_TYPE.encode()), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def handle_readiness(send):
+    """Same body as app.py's /readyz; the LLM check runs on the LLM thread pool, as it may build the model."""
+    ready, checks = await run_blocking(flask_app.readiness)
+    startup_ms = {step: round(seconds * 1000, 1) for step, seconds in metrics.startup_timings.items()}
+    await send_json(send, 200 if ready else 503, {"ready": ready, "checks": checks, "startup_ms": startup_ms})
+
+
+async def handle_lifespan(receive, send):
+    global http_client
+    refresher = None
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # One pooled client per worker; keep-alive connections to CoinGecko are reused
+            http_client = httpx.AsyncClient()
+            refresher = asyncio.ensure_future(market_data.run_async_refresher(http_client))
+            # Build the LLM backends' models in the background; /tour and /healthz are served meanwhile
+            llm_warm_up = asyncio.ensure_future(run_blocking(flask_app.llm.ready)) # keep a reference until it finishes
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if refresher:
+                refresher.cancel()
+            if http_client:
+                await http_client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+# --- ASGI entry point ---
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await handle_lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    # Same series as the Flask hooks in app.py; unknown paths share one label
+    route = path if path in METRIC_ROUTES else "unmatched"
+    response_status = []
+    request_headers = dict(scope["headers"])
+    # Each request runs in its own task, so the ID stays with this request's log records
+    request_id = log_pipeline.set_request_id(
+        log_pipeline.clean_request_id(request_headers.get(b"x-request-id", b"").decode("latin-1")))
+
+    async def send_and_record_status(message):
+        if message["type"] == "http.response.start":
+            response_status.append(message["status"])
+            message = dict(message, headers=list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())])
+        await send(message)
+
+    timings = metrics.start_request()
+    in_flight = flask_app.HTTP_IN_FLIGHT.labels(route)
+    in_flight.inc()
+    try:
+        await dispatch(path, method, request_headers, client_key(scope, request_headers), receive, send_and_record_status)
+    finally:
+        in_flight.dec()
+        flask_app.HTTP_REQUEST_SECONDS.labels(route).observe(timings.elapsed())
+        # 499: the client went away before a response started
+        flask_app.HTTP_REQUESTS.labels(route, str(response_status[0] if response_status else 499)).inc()
+        metrics.end_request()
+
+
+async def dispatch(path, method, request_headers, client, receive, send):
+    try:
+        if method == "OPTIONS":
+            await send({"type": "http.response.start", "status": 204, "headers": CORS_HEADERS})
+            await send({"type": "http.response.body", "body": b""})
+        elif path == "/ask" and method == "POST":
+            await handle_ask(receive, send, client)
+        elif path == "/ask/stream" and method == "POST":
+            await handle_ask_stream(receive, send, client)
+        elif path == "/tour" and method == "GET":
+            await handle_tour(send, request_headers)
+        elif path == "/metrics" and method == "GET":
+            await handle_metrics(send)
+        elif path == "/healthz" and method == "GET":
+            await send_json(send, 200, {"status": "ok"})
+        elif path == "/readyz" and method == "GET":
+            await handle_readiness(send)
+        elif method in ("GET", "HEAD") and flask_app.static_bundle and flask_app.static_bundle.get(path):
+            await send_asset(send, flask_app.static_bundle.get(path), request_headers, head=method == "HEAD")
+        else:
+            await send_json(send, 404, {"error": "Not found."})
+    except ClientDisconnected:
+        logger.info("Client disconnected before the request body was read.")
+    except Exception:
+        logger.exception("An unexpected error occurred in the ASGI handler:")
+        await send_json(send, 500, {"error": "An unexpected internal server error occurred."})
@@ -0,0 +1,113 @@
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from admission import AdmissionRejected, is_overload_error
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError: # The Gemini SDK is optional (OpenAI-only or fake backends)
+    google_exceptions = None
+
+logger = logging.getLogger(__name__)
+
+# Upstream failures worth another attempt: quota (429), overload/5xx and timeouts
+GOOGLE_RETRYABLE_EXCEPTIONS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+) if google_exceptions is not None else ()
+RETRYABLE_EXCEPTIONS = GOOGLE_RETRYABLE_EXCEPTIONS + (
+    ConnectionError,
+    TimeoutError,
+    AdmissionRejected, # shed by local admission control; wait at least its Retry-After
+)
+
+
+def is_retryable(error):
+    return isinstance(error, RETRYABLE_EXCEPTIONS) or is_overload_error(error)
+
+
+def backoff_delay(attempt, base_seconds, max_seconds):
+    """Exponential backoff with full jitter, so parallel retries don't hit the quota in lockstep."""
+    return random.uniform(0, min(max_seconds, base_seconds * 2 ** attempt))
+
+
+def answer_with_retries(answer_fn, question, max_retries=4, backoff_seconds=1.0, max_backoff_seconds=30.0,
+                        limiter=None):
+    """
+    Calls answer_fn(question) -> (answer, ok), retrying retryable exceptions.
+    limiter (e.g. a semaphore shared by all batches) is held only during the
+    call, never while backing off. Returns a result dict.
+    """
+    attempts = 0
+    start = time.perf_counter()
+    while True:
+        attempts += 1
+        try:
+            if limiter is not None:
+                with limiter:
+                    answer, ok = answer_fn(question)
+            else:
+                answer, ok = answer_fn(question)
+            break
+        except Exception as e:
+            if attempts > max_retries or not is_retryable(e):
+                logger.exception("Batch question failed after %d attempt(s):", attempts)
+                answer, ok = f"An internal error occurred while contacting the AI: {e}", False
+                break
+            delay = max(backoff_delay(attempts - 1, backoff_seconds, max_backoff_seconds), getattr(e, 'retry_after', 0))
+            logger.warning("Retryable error on attempt %d (%s); retrying in %.1fs.", attempts, e, delay)
+            time.sleep(delay)
+    return {
+        "answer": answer,
+        "ok": ok,
+        "attempts": attempts,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+def run_batch(questions, answer_fn, concurrency=8, limiter=None, **retry_options):
+    """
+    Answers the questions with at most `concurrency` calls in flight and
+    yields one result dict per question ('index', 'question', 'answer', 'ok',
+    'attempts', 'elapsed_ms') in completion order. Closing the generator
+    (e.g. the client went away) cancels the questions not started yet.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch")
+    try:
+        futures = {
+            executor.submit(answer_with_retries, answer_fn, question, limiter=limiter, **retry_options): index
+            for index, question in enumerate(questions)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            yield {"index": index, "question": questions[index], **future.result()}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def ndjson_lines(results):
+    """Serializes run_batch results as NDJSON, followed by a final {"summary": ...} line."""
+    start = time.perf_counter()
+    total = succeeded = retries = 0
+    try:
+        for result in results:
+            total += 1
+            succeeded += int(result["ok"])
+            retries += result["attempts"] - 1
+            yield json.dumps(result) + "\n"
+    finally:
+        # Propagate an early close (client disconnect) to run_batch
+        results.close()
+    yield json.dumps({"summary": {
+        "total": total,
+        "ok": succeeded,
+        "failed": total - succeeded,
+        "retries": retries,
+        "elapsed_seconds": round(time.perf_counter() - start, 2),
+    }}) + "\n"
@@ -0,0 +1,79 @@
+"""
+Microbenchmark: per-pattern re.search loop vs the single-pass LinkMatcher.
+
+Run from the repository root:
+    python -m benchmarks.bench_link_matcher [--text-chars 20000] [--repeat 20]
+"""
+import argparse
+import random
+import re
+import string
+import time
+
+from link_matcher import LinkMatcher
+
+PATTERN_COUNTS = (10, 1_000, 10_000)
+
+
+def legacy_find_topics(lower_text, links_dict):
+    """The original find_relevant_links loop: one re.search per pattern."""
+    return {pattern for pattern in links_dict if re.search(pattern, lower_text)}
+
+
+def make_links_dict(count, rng):
+    """Synthetic curated table: 'bip N', glossary-style words and two-word phrases."""
+    links_dict = {}
+    for i in range(count):
+        word = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+        alternatives = [word, f"bip {i}", f"{word} {rng.choice(['network', 'wallet', 'fees'])}"]
+        links_dict[r"\b(" + "|".join(alternatives) + r")\b"] = [{"text": word, "url": f"https://example.org/{i}"}]
+    return links_dict
+
+
+def make_response(links_dict, chars, rng):
+    """A long bot-style response that mentions a handful of the keywords."""
+    keywords = [keyword for pattern in links_dict for keyword in pattern[3:-3].split("|")]
+    filler = "the bitcoin network relies on proof of work and a public ledger of transactions".split()
+    words = []
+    while sum(len(w) + 1 for w in words) < chars:
+        words.append(rng.choice(keywords) if rng.random() < 0.02 else rng.choice(filler))
+    return " ".join(words).lower()
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--text-chars", type=int, default=20_000, help="length of the analyzed response")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per case (best is reported)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'patterns':>9} {'build ms':>9} {'loop ms':>9} {'matcher ms':>11} {'speedup':>8} {'topics':>7}")
+    for count in PATTERN_COUNTS:
+        links_dict = make_links_dict(count, rng)
+        text = make_response(links_dict, args.text_chars, rng)
+
+        start = time.perf_counter()
+        matcher = LinkMatcher(links_dict)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        expected = legacy_find_topics(text, links_dict)
+        assert matcher.find_topics(text) == expected, "matcher disagrees with the re.search loop"
+
+        # The legacy loop leans on re's internal pattern cache (512 entries); past that it recompiles
+        loop_ms = best_of(lambda: legacy_find_topics(text, links_dict), min(args.repeat, 3 if count > 1000 else args.repeat)) * 1000
+        matcher_ms = best_of(lambda: matcher.find_topics(text), args.repeat) * 1000
+        print(f"{count:>9} {build_ms:>9.1f} {loop_ms:>9.2f} {matcher_ms:>11.2f} {loop_ms / matcher_ms:>7.1f}x {len(expected):>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Microbenchmark: logging cost per /ask request, as seen by the request thread.
+
+Replays the log calls one /ask makes (question, history and prompt debug
+lines, links, LLM result) against a log file, for:
+  * legacy: eager f-strings and a synchronous root StreamHandler (the old setup);
+  * the log_pipeline variants: lazy %-formatting, synchronous or queued, text
+    or JSON, with and without sampling, and with the caller lookup skipped.
+
+Reports the request thread's median and p99 time per request, and for the
+queued variants how long the writer thread needed afterwards to drain the
+queue (the work that moved off the request path, not work saved).
+
+Requests are --gap-ms apart, standing in for the time a real request spends
+waiting on Gemini; the writer thread runs then. With --gap-ms 0 the loop
+never releases the GIL, and the writer's batches show up in the p99.
+
+Run from the repository root:
+    python -m benchmarks.bench_logging [--requests 2000] [--history-turns 0 20 100] [--level INFO] [--gap-ms 1]
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import log_pipeline
+
+TURN_TEXT = ("Bitcoin's difficulty adjustment retargets every 2016 blocks so that blocks keep arriving "
+             "roughly every ten minutes, whatever the total hash rate. ") * 3
+
+
+def legacy_request(logger, question, history, prompt, answer):
+    """The log calls of the old ask_bitcoin_api/generate_bot_response, f-strings included."""
+    logger.info("Received /ask request.")
+    logger.info(f"User Question: {question}")
+    logger.debug(f"Chat History received ({len(history)} turns): {history}")
+    logger.debug(f"Full prompt sent to Gemini:\n---\n{prompt}\n---")
+    logger.info("Gemini send_message call successful.")
+    logger.info("Successfully generated bot response.")
+    logger.debug(f"Bot Response: {answer}")
+    logger.info(f"Found {3} relevant links.")
+
+
+def pipeline_request(logger, question, history, prompt, answer):
+    """The same calls as app.py makes them now: lazy arguments and sample tags."""
+    log_pipeline.set_request_id()
+    logger.info("Received /ask request.", extra={"sample": "request"})
+    logger.info("User Question: %s", question, extra={"sample": "question"})
+    logger.debug("Chat History received (%d turns): %s", len(history), history)
+    logger.debug("Full prompt sent to Gemini:\n---\n%s\n---", prompt)
+    logger.info("LLM call to %s successful.", "gemini", extra={"sample": "request"})
+    logger.info("Successfully generated bot response.", extra={"sample": "request"})
+    logger.debug("Bot Response: %s", answer)
+    logger.info("Found %d relevant links.", 3, extra={"sample": "request"})
+
+
+def configure_legacy(level, stream):
+    """The previous app.py setup: one StreamHandler on the root logger, written in the calling thread."""
+    log_pipeline.stop_logging()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(level)
+    log_pipeline._set_caller_info(True) # after a skip_caller_info variant
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root.addHandler(handler)
+
+
+VARIANTS = [
+    ("legacy f-strings, sync", legacy_request, configure_legacy),
+    ("lazy, sync text", pipeline_request,
+     lambda level, stream: log_pipeline.configure_logging(level, "text", use_queue=False, stream=stream)),
+    ("lazy, queued text", pipeline_request,
+     lambda level, stream: log_pipeline.configure_logging(level, "text", stream=stream)),
+    ("lazy, queued JSON", pipeline_request,
+     lambda level, stream: log_pipeline.configure_logging(level, "json", stream=stream)),
+    ("lazy, queued JSON, 10% sampled", pipeline_request,
+     lambda level, stream: log_pipeline.configure_logging(
+         level, "json", stream=stream, sample_rates={"question": 0.1, "request": 0.1})),
+    ("lazy, queued JSON, no caller info", pipeline_request,
+     lambda level, stream: log_pipeline.configure_logging(level, "json", stream=stream, skip_caller_info=True)),
+]
+
+
+def run_variant(request_fn, configure, level, requests, history_turns, log_path, gap_seconds):
+    history = [{'type': 'user' if i % 2 == 0 else 'bot', 'text': TURN_TEXT} for i in range(history_turns)]
+    question = "How does the difficulty adjustment keep block times stable?"
+    prompt = "--- RECENT BITCOIN DATA ---\nPrice: $67,000\n---\n\nUser Question: " + question
+    answer = TURN_TEXT * 2
+    logger = logging.getLogger()
+    with open(log_path, "w", encoding="utf-8") as stream:
+        configure(level, stream)
+        timings = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            request_fn(logger, question, history, prompt, answer)
+            timings.append(time.perf_counter() - start)
+            if gap_seconds:
+                time.sleep(gap_seconds)
+        drain_start = time.perf_counter()
+        log_pipeline.stop_logging()
+        drain_ms = (time.perf_counter() - drain_start) * 1000
+    timings.sort()
+    return statistics.median(timings) * 1e6, timings[int(len(timings) * 0.99)] * 1e6, drain_ms, os.path.getsize(log_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--history-turns", type=int, nargs="+", default=[0, 20, 100])
+    parser.add_argument("--level", default="INFO", choices=("DEBUG", "INFO", "WARNING"))
+    parser.add_argument("--gap-ms", type=float, default=1.0, help="idle time between requests")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_path = os.path.join(tmp_dir, "bench.log")
+        print(f"{args.requests} requests per case {args.gap_ms:g} ms apart, level {args.level}; request-thread time per request")
+        print(f"{'turns':>5}  {'variant':<34} {'median us':>10} {'p99 us':>9} {'drain ms':>9} {'log KB':>8}")
+        for turns in args.history_turns:
+            for name, request_fn, configure in VARIANTS:
+                median_us, p99_us, drain_ms, size = run_variant(request_fn, configure, args.level, args.requests, turns, log_path,
+                                                               args.gap_ms / 1000)
+                drain = f"{drain_ms:9.1f}" if "queued" in name else f"{'-':>9}"
+                print(f"{turns:>5}  {name:<34} {median_us:10.1f} {p99_us:9.1f} {drain} {size / 1024:8.0f}")
+    configure_legacy(logging.WARNING, None)
+
+
+if __name__ == "__main__":
+    main()
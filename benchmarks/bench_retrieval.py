@@ -0,0 +1,103 @@
+"""
+Benchmark: build time, index size and query latency of the BM25 retrieval
+index (retrieval.py) on a synthetic corpus.
+
+Passages are drawn from a Zipf-like vocabulary with the curated Bitcoin
+passages mixed in, so common terms have long postings lists like they
+would in real text. Query latency covers tokenizing, hashing and scoring
+(KnowledgeBase.lookup, including the exact-question check).
+
+Run from the repository root:
+    python -m benchmarks.bench_retrieval [--passages 100000] [--queries 2000]
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from retrieval import BM25Index, DEFAULT_CORPUS_PATH, KnowledgeBase, build_index, load_corpus
+
+
+def make_vocabulary(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choices(letters, k=rng.randint(3, 10))) for _ in range(size)]
+
+
+def make_passages(count, vocabulary, curated, rng):
+    # Zipf-like weights: a few very common words, a long tail of rare ones
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    passages = list(curated)
+    for i in range(count - len(passages)):
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(30, 90))
+        passages.append({"id": f"synthetic-{i}", "title": " ".join(words[:3]), "text": " ".join(words)})
+    return passages
+
+
+def make_queries(count, vocabulary, curated, rng):
+    queries = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.2:
+            queries.append(rng.choice(curated)["question"])
+        elif roll < 0.6:
+            queries.append("what is " + " ".join(rng.choices(vocabulary[:2000], k=rng.randint(1, 3))))
+        else:
+            queries.append(" ".join(rng.choices(vocabulary, k=rng.randint(2, 8))))
+    return queries
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--passages", type=int, default=100_000)
+    parser.add_argument("--vocabulary", type=int, default=50_000, help="distinct synthetic words")
+    parser.add_argument("--queries", type=int, default=2_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    curated = load_corpus(DEFAULT_CORPUS_PATH)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    passages = make_passages(args.passages, vocabulary, curated, rng)
+    queries = make_queries(args.queries, vocabulary, curated, rng)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.idx")
+        start = time.perf_counter()
+        build_index(passages, path)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = BM25Index(path)
+        open_ms = (time.perf_counter() - start) * 1000
+        knowledge_base = KnowledgeBase(index)
+
+        for query in queries[:50]: # warm up page cache and numpy
+            knowledge_base.lookup(query)
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            knowledge_base.lookup(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+
+        num_postings = len(index.doc_ids)
+        print(f"passages:      {index.num_docs}")
+        print(f"index size:    {os.path.getsize(path) / 1e6:.1f} MB ({index.num_buckets} buckets, {num_postings} postings)")
+        print(f"build:         {build_seconds:.1f} s")
+        print(f"open (mmap):   {open_ms:.2f} ms")
+        print(f"query ms:      mean {statistics.mean(latencies):.3f}  p50 {percentile(latencies, 0.5):.3f}  "
+              f"p95 {percentile(latencies, 0.95):.3f}  p99 {percentile(latencies, 0.99):.3f}")
+        print(f"routing:       {knowledge_base.stats.as_dict()}")
+        del knowledge_base
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
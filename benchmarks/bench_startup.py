@@ -0,0 +1,135 @@
+"""
+Benchmark: cold start of the Flask app.
+
+Reports two things:
+  * an import-time breakdown of `import app` (python -X importtime), as the
+    slowest top-level imports plus the app's own startup steps;
+  * time from process start to the first 200 from GET /tour, GET /readyz
+    (Gemini model built) and the first answered POST /ask, over --runs cold
+    starts of the chosen server. Gemini and CoinGecko are the local fakes
+    from benchmarks/fake_servers.py, so nothing leaves the machine.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup [--server dev|gunicorn|gunicorn-preload] [--runs 5] [--top 15]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.load_test import REPO_ROOT, free_port, stop_process
+
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+STARTUP_REPORT_RE = re.compile(r"App imported: (.*)")
+
+
+def app_env(gemini_url, coingecko_url, tmp_dir):
+    return dict(os.environ,
+                GOOGLE_API_KEY="startup-bench-key",
+                GEMINI_API_BASE_URL=gemini_url,
+                COINGECKO_API_BASE_URL=f"{coingecko_url}/api/v3",
+                MARKET_DATA_SNAPSHOT_PATH=os.path.join(tmp_dir, "market_data.snapshot"),
+                GEMINI_CONTEXT_CACHE="0",
+                PYTHONUNBUFFERED="1")
+
+
+def import_breakdown(env, top):
+    """Returns ([(module, cumulative ms)] of the slowest top-level imports, the app's startup report line)."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=REPO_ROOT, env=env,
+                            capture_output=True, text=True, timeout=120)
+    modules, children = [], []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        # A module is listed after everything it imported, one level deeper
+        depth, module, cumulative_ms = len(match.group(3)), match.group(4), int(match.group(2)) / 1000
+        if depth == 3:
+            children.append((module, cumulative_ms))
+        elif depth == 1:
+            if module == "app":
+                modules = children + [("app (total)", cumulative_ms)]
+            children = []
+    report = STARTUP_REPORT_RE.search(result.stderr)
+    return sorted(modules, key=lambda item: -item[1])[:top], report.group(1) if report else "n/a"
+
+
+def server_command(server, port):
+    if server == "dev":
+        return [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port),
+                "--with-threads", "--no-reload", "--no-debugger"]
+    return [sys.executable, "-m", "gunicorn", "-w", "2", "--threads", "4", "-b", f"127.0.0.1:{port}", "app:app"]
+
+
+def time_until(client, method, url, started, process, timeout=60, **kwargs):
+    """Polls until url answers 200; returns ms since started."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode} during startup")
+        try:
+            if client.request(method, url, timeout=5, **kwargs).status_code == 200:
+                return (time.perf_counter() - started) * 1000
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"{url} did not answer 200 within {timeout}s")
+
+
+def cold_start(server, env):
+    port = free_port()
+    if server == "gunicorn-preload":
+        env = dict(env, PRELOAD_WARMUP="true")
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryFile() as log, httpx.Client() as client:
+        started = time.perf_counter()
+        process = subprocess.Popen(server_command(server, port), cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            tour_ms = time_until(client, "GET", f"{base_url}/tour", started, process)
+            ready_ms = time_until(client, "GET", f"{base_url}/readyz", started, process)
+            ask_ms = time_until(client, "POST", f"{base_url}/ask", started, process,
+                                json={"question": f"How do fee markets evolve after halving {port}?", "history": []})
+        finally:
+            stop_process(process)
+    return {"tour": tour_ms, "readyz": ready_ms, "first_ask": ask_ms}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("dev", "gunicorn", "gunicorn-preload"), default="dev")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest top-level imports to list")
+    args = parser.parse_args()
+
+    gemini_port, coingecko_port = free_port(), free_port()
+    fakes = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_servers", "--gemini-port", str(gemini_port),
+                              "--coingecko-port", str(coingecko_port), "--gemini-latency", "0.05", "--gemini-jitter", "0"],
+                             cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            env = app_env(f"http://127.0.0.1:{gemini_port}", f"http://127.0.0.1:{coingecko_port}", tmp_dir)
+            modules, report = import_breakdown(env, args.top)
+            print("Slowest imports of app.py (cumulative ms):")
+            for module, ms in modules:
+                print(f"  {module:<40} {ms:8.1f}")
+            print(f"App startup steps: {report}\n")
+
+            runs = [cold_start(args.server, env) for _ in range(args.runs)]
+    finally:
+        stop_process(fakes)
+
+    print(f"Cold start ({args.server}, {args.runs} runs), ms from process start:")
+    print(f"  {'first 200 from':<16} {'median':>8} {'min':>8} {'max':>8}")
+    for key in ("tour", "readyz", "first_ask"):
+        values = [run[key] for run in runs]
+        print(f"  {key:<16} {statistics.median(values):8.0f} {min(values):8.0f} {max(values):8.0f}")
+
+
+if __name__ == "__main__":
+    main()
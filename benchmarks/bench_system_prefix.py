@@ -0,0 +1,123 @@
+"""
+Benchmark: sending the static system prompt as leading chat turns (the old
+format_history_for_gemini) vs as a system instruction vs as cached content.
+
+Gemini is replaced by a local fake client that records every request and
+sleeps for a simulated prefill time per uncached input token, so the runs
+are offline and repeatable. Reported per chat turn: client-side time to
+build and serialize the request, request payload size, estimated input
+tokens the server has to process and the simulated end-to-end latency.
+
+Run from the repository root:
+    python -m benchmarks.bench_system_prefix [--turns 6] [--requests 200] [--prefill-us-per-token 20]
+"""
+import argparse
+import os
+import time
+
+import google.generativeai as genai
+from google.generativeai import protos
+
+# app.py needs a key at import; the fake client below never uses it
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+import market_data
+
+# Keep app.py from starting the market-data refresher thread
+market_data.claim_refresher()
+
+import app as flask_app
+from history_compaction import TokenEstimator
+
+LEGACY_PRIMER = "Okay, I am ready to answer questions about Bitcoin and use the provided real-time data."
+FAKE_CACHE_NAME = "cachedContents/benchmark-system-prompt"
+
+
+class FakeGenerativeClient:
+    """Stands in for the generative service client: records requests, returns a canned answer."""
+
+    def __init__(self, estimator, prefill_seconds_per_token):
+        self.estimator = estimator
+        self.prefill_seconds_per_token = prefill_seconds_per_token
+        self.requests = []
+        self.prefill_seconds = 0.0
+
+    def uncached_tokens(self, request):
+        texts = [part.text for content in request.contents for part in content.parts]
+        if not request.cached_content:
+            texts += [part.text for part in request.system_instruction.parts]
+        return sum(self.estimator.count(text) for text in texts)
+
+    def generate_content(self, request, **kwargs):
+        self.requests.append(request)
+        prefill = self.uncached_tokens(request) * self.prefill_seconds_per_token
+        self.prefill_seconds += prefill
+        time.sleep(prefill)
+        return protos.GenerateContentResponse(candidates=[{
+            "content": {"role": "model", "parts": [{"text": "Bitcoin is a decentralized digital currency."}]},
+            "finish_reason": "STOP",
+        }])
+
+
+def legacy_history(chat_history):
+    """The history as app.py used to build it: the system prompt as the first turn pair."""
+    return [
+        {'role': 'user', 'parts': [{'text': flask_app.SYSTEM_PROMPT}]},
+        {'role': 'model', 'parts': [{'text': LEGACY_PRIMER}]},
+    ] + flask_app.format_history_for_gemini(chat_history)
+
+
+def make_models():
+    """(label, model, history builder) per strategy."""
+    cached = genai.GenerativeModel(flask_app.GEMINI_MODEL_NAME)
+    cached._cached_content = FAKE_CACHE_NAME
+    return [
+        ("prefix turns", genai.GenerativeModel(flask_app.GEMINI_MODEL_NAME), legacy_history),
+        ("system instruction", genai.GenerativeModel(flask_app.GEMINI_MODEL_NAME, system_instruction=flask_app.SYSTEM_PROMPT),
+         flask_app.format_history_for_gemini),
+        ("context cache", cached, flask_app.format_history_for_gemini),
+    ]
+
+
+def make_chat_history(turns):
+    history = []
+    for i in range(turns):
+        history.append({'type': 'user', 'text': f"Question {i}: how does the Bitcoin halving affect miner revenue?"})
+        history.append({'type': 'bot', 'text': "The halving cuts the block subsidy in half roughly every four years. " * 3})
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=6, help="earlier question/answer pairs in the conversation")
+    parser.add_argument("--requests", type=int, default=200, help="chat turns sent per strategy")
+    parser.add_argument("--prefill-us-per-token", type=float, default=20.0,
+                        help="simulated server time per uncached input token (microseconds)")
+    args = parser.parse_args()
+
+    estimator = TokenEstimator()
+    chat_history = make_chat_history(args.turns)
+    prompt = "Real-time Bitcoin data: price $65,000.\n\nUser question: What is the current market cap?"
+
+    print(f"{'strategy':>19} {'client us':>10} {'bytes':>7} {'input tok':>10} {'uncached tok':>13} {'latency ms':>11}")
+    for label, model, build_history in make_models():
+        fake = FakeGenerativeClient(estimator, args.prefill_us_per_token / 1e6)
+        model._client = fake
+
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            chat = model.start_chat(history=build_history(chat_history))
+            chat.send_message(prompt)
+        elapsed = time.perf_counter() - start
+        client_seconds = elapsed - fake.prefill_seconds
+
+        request = fake.requests[-1]
+        uncached = fake.uncached_tokens(request)
+        prefix_tokens = estimator.count(flask_app.SYSTEM_PROMPT)
+        input_tokens = uncached + (prefix_tokens if request.cached_content else 0)
+        print(f"{label:>19} {client_seconds / args.requests * 1e6:>10.1f} {request._pb.ByteSize():>7} "
+              f"{input_tokens:>10} {uncached:>13} {elapsed / args.requests * 1000:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
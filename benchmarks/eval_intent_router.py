@@ -0,0 +1,90 @@
+"""
+Routing accuracy and latency of the intent router (intent_router.py) on the
+labelled set in benchmarks/intent_eval.jsonl. The eval questions are kept
+apart from the model's training file (knowledge/intent_training.jsonl).
+
+Labels are 'llm', 'off_topic' or 'metrics:<metric>[,<metric>...]'. Besides
+accuracy the report separates the two kinds of mistakes: a local answer for
+a question that needed the LLM (a wrong answer for the user) versus an LLM
+call for a question that could have been answered locally (only a missed
+saving).
+
+Run from the repository root:
+    python -m benchmarks.eval_intent_router [--repeat 200]
+"""
+import argparse
+import json
+import os
+import time
+from collections import Counter
+
+from intent_router import ROUTE_LLM, ROUTE_METRICS, create_intent_router
+
+EVAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_eval.jsonl")
+
+
+def route_label(route):
+    if route.name == ROUTE_METRICS:
+        return f"{ROUTE_METRICS}:{','.join(sorted(route.metrics))}"
+    return route.name
+
+
+def route_family(label):
+    return label.split(":")[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="timed passes over the eval set")
+    args = parser.parse_args()
+
+    with open(EVAL_PATH, encoding="utf-8") as eval_file:
+        rows = [json.loads(line) for line in eval_file if line.strip()]
+    router = create_intent_router()
+
+    confusion = Counter()
+    mistakes = []
+    for row in rows:
+        predicted = route_label(router.classify(row["question"]))
+        family, _, metrics = row["route"].partition(":")
+        expected = f"{family}:{','.join(sorted(metrics.split(',')))}" if metrics else family
+        confusion[(route_family(expected), route_family(predicted))] += 1
+        if predicted != expected:
+            mistakes.append((row["question"], expected, predicted))
+
+    correct = len(rows) - len(mistakes)
+    wrong_local = sum(1 for _, expected, predicted in mistakes if route_family(predicted) != ROUTE_LLM)
+    missed_local = len(mistakes) - wrong_local
+    print(f"accuracy:            {correct}/{len(rows)} ({correct / len(rows):.1%})")
+    print(f"wrong local answers: {wrong_local}")
+    print(f"missed local routes: {missed_local}")
+
+    families = sorted({family for pair in confusion for family in pair})
+    print("\nconfusion (rows = expected, columns = predicted):")
+    print(f"{'':>10} " + " ".join(f"{family:>10}" for family in families))
+    for expected in families:
+        print(f"{expected:>10} " + " ".join(f"{confusion[(expected, predicted)]:>10}" for predicted in families))
+    for family in families:
+        true_positive = confusion[(family, family)]
+        predicted_total = sum(confusion[(expected, family)] for expected in families)
+        expected_total = sum(confusion[(family, predicted)] for predicted in families)
+        print(f"{family:>10}: precision {true_positive / (predicted_total or 1):.2f}  recall {true_positive / (expected_total or 1):.2f}")
+
+    if mistakes:
+        print("\nmisrouted:")
+        for question, expected, predicted in mistakes:
+            print(f"  {question!r}: expected {expected}, got {predicted}")
+
+    latencies = []
+    for _ in range(args.repeat):
+        for row in rows:
+            start = time.perf_counter()
+            router.classify(row["question"])
+            latencies.append((time.perf_counter() - start) * 1e6)
+    latencies.sort()
+    print(f"\nclassify latency (us): p50 {latencies[len(latencies) // 2]:.1f}  "
+          f"p99 {latencies[int(len(latencies) * 0.99)]:.1f}  max {latencies[-1]:.1f}")
+
+
+if __name__ == "__main__":
+    main()
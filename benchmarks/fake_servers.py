@@ -0,0 +1,253 @@
+"""
+Local stand-ins for the Gemini REST API and CoinGecko's simple/price
+endpoint, so /ask can be load-tested without spending API quota.
+
+    python -m benchmarks.fake_servers [--gemini-port 8701] [--coingecko-port 8702]
+        [--gemini-latency 0.8] [--gemini-jitter 0.2] [--gemini-error-rate 0.01] [--gemini-error-status 503]
+        [--stream-chunks 6] [--chunk-interval 0.05] [--coingecko-latency 0.1] [--coingecko-error-rate 0]
+
+Point the app at them with GEMINI_API_BASE_URL=http://127.0.0.1:8701 and
+COINGECKO_API_BASE_URL=http://127.0.0.1:8702/api/v3.
+
+Gemini: models/*:generateContent, models/*:streamGenerateContent (a JSON
+array, or Server-Sent Events with ?alt=sse as google-genai requests) and
+models/*:countTokens. Latency is time to first byte; streamed chunks then
+follow every --chunk-interval seconds. CoinGecko: simple/price for any ids
+and vs_currencies, and coins/*/market_chart (hourly points for 'days'). Both servers answer GET /__stats with
+their counters as JSON, and POST /__reset zeroes them.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import parse_qs
+
+import uvicorn
+
+ANSWER_TEXT = (
+    "Bitcoin mining secures the network through proof of work. Miners bundle transactions into blocks, "
+    "compete to find a valid block hash, and earn the block subsidy plus fees. The difficulty adjusts "
+    "every 2016 blocks so that a block is found roughly every ten minutes."
+)
+
+
+class UpstreamStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.service_seconds_total = 0.0
+        self.by_kind = {} # e.g. 'generateContent' -> [calls, service seconds]
+        self.started_at = time.time()
+
+    def record(self, kind, seconds):
+        self.service_seconds_total += seconds
+        calls_and_seconds = self.by_kind.setdefault(kind, [0, 0.0])
+        calls_and_seconds[0] += 1
+        calls_and_seconds[1] += seconds
+
+    def as_dict(self):
+        completed = self.requests - self.in_flight
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "mean_service_ms": round(self.service_seconds_total / (completed or 1) * 1000, 2),
+            "by_kind": {kind: {"requests": calls, "mean_service_ms": round(seconds / calls * 1000, 2)}
+                        for kind, (calls, seconds) in sorted(self.by_kind.items())},
+            "since_seconds": round(time.time() - self.started_at, 2),
+        }
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def make_upstream_app(stats, handler):
+    """Wraps a request handler with the shared /__stats, /__reset and accounting."""
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                await send({"type": message["type"] + ".complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+        path = scope["path"]
+        if path == "/__stats":
+            await send_json(send, 200, stats.as_dict())
+            return
+        if path == "/__reset":
+            stats.reset()
+            await send_json(send, 200, {"reset": True})
+            return
+
+        stats.requests += 1
+        stats.in_flight += 1
+        stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+        start = time.perf_counter()
+        try:
+            await handler(scope, receive, send)
+        finally:
+            stats.in_flight -= 1
+            stats.record(path.rpartition(":")[2] if ":" in path else path, time.perf_counter() - start)
+
+    return app
+
+
+def make_gemini_app(args, stats):
+    rng = random.Random(args.seed)
+
+    def chunk_payload(text, final, prompt_tokens):
+        payload = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}]}
+        if final:
+            payload["candidates"][0]["finishReason"] = "STOP"
+            payload["usageMetadata"] = {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": len(ANSWER_TEXT) // 4,
+                "totalTokenCount": prompt_tokens + len(ANSWER_TEXT) // 4,
+            }
+        return payload
+
+    def split_answer(count):
+        words = ANSWER_TEXT.split(" ")
+        size = max(1, -(-len(words) // count))
+        return [" ".join(words[i:i + size]) + (" " if i + size < len(words) else "") for i in range(0, len(words), size)]
+
+    async def handler(scope, receive, send):
+        body = await read_body(receive)
+        path = scope["path"]
+        prompt_tokens = len(body) // 4
+        await asyncio.sleep(max(0.0, args.gemini_latency + rng.uniform(-args.gemini_jitter, args.gemini_jitter)))
+
+        if path.endswith(":countTokens"):
+            await send_json(send, 200, {"totalTokens": prompt_tokens})
+            return
+        if not (path.endswith(":generateContent") or path.endswith(":streamGenerateContent")):
+            await send_json(send, 404, {"error": {"code": 404, "message": f"Unknown path {path}", "status": "NOT_FOUND"}})
+            return
+        if rng.random() < args.gemini_error_rate:
+            stats.errors += 1
+            status_name = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE"}.get(args.gemini_error_status, "UNKNOWN")
+            await send_json(send, args.gemini_error_status,
+                            {"error": {"code": args.gemini_error_status, "message": "Injected failure", "status": status_name}})
+            return
+
+        if path.endswith(":generateContent"):
+            await send_json(send, 200, chunk_payload(ANSWER_TEXT, True, prompt_tokens))
+            return
+
+        sse = b"alt=sse" in scope.get("query_string", b"")
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream" if sse else b"application/json")]})
+        pieces = split_answer(args.stream_chunks)
+        for i, piece in enumerate(pieces):
+            if i:
+                await asyncio.sleep(args.chunk_interval)
+            encoded = json.dumps(chunk_payload(piece, i == len(pieces) - 1, prompt_tokens))
+            if sse:
+                data = f"data: {encoded}\r\n\r\n"
+            else:
+                data = ("[" if i == 0 else ",\r\n") + encoded + ("]" if i == len(pieces) - 1 else "")
+            await send({"type": "http.response.body", "body": data.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    return make_upstream_app(stats, handler)
+
+
+def make_coingecko_app(args, stats):
+    rng = random.Random(args.seed + 1)
+    state = {"price": 65_000.0}
+    # Rough fixed rates, so extra vs_currencies get plausible prices
+    usd_rates = {"usd": 1.0, "eur": 0.92, "gbp": 0.79, "jpy": 150.0, "btc": 1 / 65_000}
+    asset_scale = {"bitcoin": 1.0, "ethereum": 0.05}
+
+    async def handler(scope, receive, send):
+        await read_body(receive)
+        await asyncio.sleep(max(0.0, args.coingecko_latency))
+        path = scope["path"]
+        query = {key: values[0] for key, values in parse_qs(scope.get("query_string", b"").decode()).items()}
+        if rng.random() < args.coingecko_error_rate:
+            stats.errors += 1
+            await send_json(send, 429, {"status": {"error_code": 429, "error_message": "Injected rate limit"}})
+            return
+
+        if path.endswith("/simple/price"):
+            state["price"] *= 1 + rng.uniform(-0.002, 0.002)
+            payload = {}
+            for asset in query.get("ids", "bitcoin").split(","):
+                usd_price = state["price"] * asset_scale.get(asset, 0.001)
+                prices = {"last_updated_at": int(time.time())}
+                for currency in query.get("vs_currencies", "usd").split(","):
+                    price = usd_price * usd_rates.get(currency, 1.0)
+                    prices.update({currency: round(price, 2), f"{currency}_market_cap": round(price * 19_800_000, 2),
+                                   f"{currency}_24h_vol": round(price * 480_000, 2)})
+                payload[asset] = prices
+            await send_json(send, 200, payload)
+        elif path.endswith("/market_chart") and "/coins/" in path:
+            asset = path.split("/coins/")[1].split("/")[0]
+            days = float(query.get("days", "1"))
+            now_ms = int(time.time() * 1000)
+            price = state["price"] * asset_scale.get(asset, 0.001) * usd_rates.get(query.get("vs_currency", "usd"), 1.0)
+            points = []
+            for hour in range(int(days * 24), 0, -1):
+                price *= 1 + rng.uniform(-0.004, 0.004)
+                points.append([now_ms - hour * 3_600_000, round(price, 2)])
+            await send_json(send, 200, {"prices": points, "market_caps": [], "total_volumes": []})
+        else:
+            await send_json(send, 404, {"error": "not found"})
+
+    return make_upstream_app(stats, handler)
+
+
+def add_arguments(parser):
+    """Options shared with load_test.py, which starts this module as a subprocess."""
+    parser.add_argument("--gemini-latency", type=float, default=0.8, help="seconds to first byte")
+    parser.add_argument("--gemini-jitter", type=float, default=0.2, help="+/- uniform jitter in seconds")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="fraction of calls that fail")
+    parser.add_argument("--gemini-error-status", type=int, default=503, choices=(429, 500, 503))
+    parser.add_argument("--stream-chunks", type=int, default=6, help="chunks per streamed answer")
+    parser.add_argument("--chunk-interval", type=float, default=0.05, help="seconds between streamed chunks")
+    parser.add_argument("--coingecko-latency", type=float, default=0.1)
+    parser.add_argument("--coingecko-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+
+
+async def serve(args):
+    servers = [
+        uvicorn.Server(uvicorn.Config(make_gemini_app(args, UpstreamStats()), host="127.0.0.1",
+                                      port=args.gemini_port, log_level="warning", backlog=4096)),
+        uvicorn.Server(uvicorn.Config(make_coingecko_app(args, UpstreamStats()), host="127.0.0.1",
+                                      port=args.coingecko_port, log_level="warning")),
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gemini-port", type=int, default=8701)
+    parser.add_argument("--coingecko-port", type=int, default=8702)
+    add_arguments(parser)
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+Load test: /ask, /ask/stream and /tour against the Flask app, with Gemini
+and CoinGecko replaced by the local fakes in benchmarks/fake_servers.py.
+
+The harness starts the fakes and the app as subprocesses, warms up, then
+runs a closed loop of --concurrency clients for --duration seconds (or
+--requests requests) over the weighted --mix of endpoints. Questions are
+unique unless --repeat-questions is given, so the answer cache and the
+local routes do not hide the Gemini path.
+
+Run from the repository root:
+    python -m benchmarks.load_test [--server dev|gunicorn|uvicorn] [--workers 4] [--threads 8]
+        [--concurrency 32] [--duration 30] [--mix ask=8,tour=1,ask_stream=1] [--output results.json]
+        [--baseline previous.json] [--gemini-latency 0.8 ...see fake_servers.py]
+
+The JSON report has, per endpoint, the status counts, throughput and
+latency percentiles (total and time to first byte, in ms), any stages the
+app reports in Server-Timing headers, and the upstream calls and service
+times the fakes saw. 'app_overhead_ms' is the mean /ask latency minus the
+generateContent time it waited for, i.e. what app.py itself costs per
+request.
+With --baseline, the relative change of each headline number against an
+earlier report is printed as well.
+Admission control (admission.py) is off unless --admission is given, since
+all simulated clients share one address; with it, 429/503 show up in the
+status counts.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.fake_servers import add_arguments as add_fake_server_arguments
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Open-ended questions that neither the intent router nor the knowledge base answers locally
+QUESTION_TEMPLATES = [
+    "How does the difficulty adjustment react when a large share of miners switches off?",
+    "What trade-offs did the Taproot upgrade make for privacy and script flexibility?",
+    "How do Lightning channel liquidity constraints affect routing large payments?",
+    "Why does a longer chain of confirmations make a transaction harder to reverse?",
+    "How do transaction fees behave in the mempool when blocks are consistently full?",
+    "What happens to miner revenue over several halvings if fees stay flat?",
+]
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("ask", "ask_stream", "tour"):
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r} (use ask, ask_stream, tour)")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def app_command(args, port):
+    if args.server == "dev":
+        return [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port),
+                "--with-threads", "--no-reload", "--no-debugger"]
+    if args.server == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "--threads", str(args.threads),
+                "-b", f"127.0.0.1:{port}", "--timeout", "120", "app:app"]
+    return [sys.executable, "-m", "uvicorn", "asgi_app:app", "--port", str(port),
+            "--workers", str(args.workers), "--log-level", "warning"]
+
+
+def start_process(command, env, log_path):
+    log_file = open(log_path, "wb")
+    return subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT), log_file
+
+
+def stop_process(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+async def wait_until_ready(client, url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[2]} exited with status {process.returncode} during startup")
+        try:
+            if (await client.get(url, timeout=2)).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def parse_server_timing(header):
+    """'stage;dur=12.3, other;desc="x";dur=4' -> {'stage': 12.3, 'other': 4.0}"""
+    stages = {}
+    for entry in header.split(","):
+        name, *params = [piece.strip() for piece in entry.split(";")]
+        for param in params:
+            key, _, value = param.partition("=")
+            if name and key == "dur":
+                try:
+                    stages[name] = float(value)
+                except ValueError:
+                    pass
+    return stages
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, endpoint, status, total_ms, ttfb_ms, stages):
+        self.samples.setdefault(endpoint, []).append((status, total_ms, ttfb_ms, stages))
+
+
+async def send_one(client, base_url, endpoint, question):
+    if endpoint == "tour":
+        method, url, body = "GET", f"{base_url}/tour", None
+    else:
+        path = "/ask/stream" if endpoint == "ask_stream" else "/ask"
+        method, url, body = "POST", f"{base_url}{path}", {"question": question, "history": []}
+    start = time.perf_counter()
+    ttfb = None
+    async with client.stream(method, url, json=body) as response:
+        async for chunk in response.aiter_raw():
+            if ttfb is None and chunk:
+                ttfb = time.perf_counter() - start
+        total = time.perf_counter() - start
+        stages = parse_server_timing(response.headers.get("server-timing", ""))
+        return response.status_code, total * 1000, (ttfb if ttfb is not None else total) * 1000, stages
+
+
+async def client_loop(client, base_url, endpoints, weights, questions, stop_at, budget, recorder, rng):
+    while time.monotonic() < stop_at and (budget is None or budget["left"] > 0):
+        if budget is not None:
+            budget["left"] -= 1
+        endpoint = rng.choices(endpoints, weights)[0]
+        try:
+            status, total_ms, ttfb_ms, stages = await send_one(client, base_url, endpoint, next(questions))
+        except httpx.HTTPError as e:
+            status, total_ms, ttfb_ms, stages = type(e).__name__, 0.0, 0.0, {}
+        recorder.add(endpoint, status, total_ms, ttfb_ms, stages)
+
+
+def question_stream(repeat):
+    counter = 0
+    while True:
+        template = QUESTION_TEMPLATES[counter % len(QUESTION_TEMPLATES)]
+        yield template if repeat else f"{template} (load test {counter})"
+        counter += 1
+
+
+def summarize(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    summary = {f"p{round(p * 100)}": round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 2) for p in PERCENTILES}
+    summary.update(mean=round(statistics.mean(ordered), 2), max=round(ordered[-1], 2))
+    return summary
+
+
+def build_report(recorder, elapsed, upstream, args):
+    endpoints = {}
+    for endpoint, samples in sorted(recorder.samples.items()):
+        statuses = {}
+        for status, *_ in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        ok = [sample for sample in samples if sample[0] == 200]
+        stage_names = sorted({name for *_, stages in ok for name in stages})
+        endpoints[endpoint] = {
+            "requests": len(samples),
+            "errors": len(samples) - len(ok),
+            "status": statuses,
+            "throughput_rps": round(len(ok) / elapsed, 2),
+            "latency_ms": summarize([total for _, total, _, _ in ok]),
+            "ttfb_ms": summarize([ttfb for _, _, ttfb, _ in ok]),
+            "server_timing_ms": {name: summarize([stages[name] for *_, stages in ok if name in stages]) for name in stage_names},
+        }
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "duration_seconds": round(elapsed, 2),
+        "total": {
+            "requests": sum(e["requests"] for e in endpoints.values()),
+            "errors": sum(e["errors"] for e in endpoints.values()),
+            "throughput_rps": round(sum(e["throughput_rps"] for e in endpoints.values()), 2),
+        },
+        "endpoints": endpoints,
+        "upstream": upstream,
+    }
+    generate = upstream.get("gemini", {}).get("by_kind", {}).get("generateContent", {})
+    if endpoints.get("ask", {}).get("latency_ms") and generate:
+        calls_per_ask = generate["requests"] / endpoints["ask"]["requests"]
+        report["gemini_calls_per_ask"] = round(calls_per_ask, 3)
+        report["app_overhead_ms"] = round(endpoints["ask"]["latency_ms"]["mean"] - generate["mean_service_ms"] * calls_per_ask, 2)
+    return report
+
+
+def headline_numbers(report):
+    numbers = {"total.throughput_rps": report["total"]["throughput_rps"]}
+    for endpoint, stats in report["endpoints"].items():
+        for key, value in stats["latency_ms"].items():
+            numbers[f"{endpoint}.latency_ms.{key}"] = value
+        numbers[f"{endpoint}.throughput_rps"] = stats["throughput_rps"]
+    if "app_overhead_ms" in report:
+        numbers["app_overhead_ms"] = report["app_overhead_ms"]
+    return numbers
+
+
+def print_comparison(report, baseline):
+    current, previous = headline_numbers(report), headline_numbers(baseline)
+    print(f"{'metric':<32} {'baseline':>12} {'current':>12} {'change':>9}", file=sys.stderr)
+    for name in sorted(current.keys() & previous.keys()):
+        before, after = previous[name], current[name]
+        change = f"{(after - before) / before:+.1%}" if before else "n/a"
+        print(f"{name:<32} {before:>12.2f} {after:>12.2f} {change:>9}", file=sys.stderr)
+
+
+async def run(args):
+    gemini_port, coingecko_port, app_port = free_port(), free_port(), free_port()
+    gemini_url = f"http://127.0.0.1:{gemini_port}"
+    coingecko_url = f"http://127.0.0.1:{coingecko_port}"
+    base_url = f"http://127.0.0.1:{app_port}"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fake_command = [sys.executable, "-m", "benchmarks.fake_servers",
+                        "--gemini-port", str(gemini_port), "--coingecko-port", str(coingecko_port)]
+        for name in ("gemini_latency", "gemini_jitter", "gemini_error_rate", "gemini_error_status",
+                     "stream_chunks", "chunk_interval", "coingecko_latency", "coingecko_error_rate", "seed"):
+            fake_command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+        env = dict(os.environ,
+                   GOOGLE_API_KEY="load-test-key",
+                   GEMINI_API_BASE_URL=gemini_url,
+                   COINGECKO_API_BASE_URL=f"{coingecko_url}/api/v3",
+                   MARKET_DATA_SNAPSHOT_PATH=os.path.join(tmp_dir, "market_data.snapshot"),
+                   GEMINI_CONTEXT_CACHE="0",
+                   # Every simulated client shares 127.0.0.1, i.e. one per-client bucket
+                   ADMISSION_ENABLED="1" if args.admission else "0",
+                   PYTHONUNBUFFERED="1")
+        fakes, fakes_log = start_process(fake_command, env, os.path.join(tmp_dir, "fakes.log"))
+        app_process, app_log = start_process(app_command(args, app_port), env, os.path.join(tmp_dir, "app.log"))
+        limits = httpx.Limits(max_connections=args.concurrency + 4, max_keepalive_connections=args.concurrency + 4)
+        try:
+            async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+                await wait_until_ready(client, f"{gemini_url}/__stats", fakes)
+                await wait_until_ready(client, f"{base_url}/tour", app_process)
+
+                rng = random.Random(args.seed)
+                endpoints, weights = list(args.mix), list(args.mix.values())
+                questions = question_stream(args.repeat_questions)
+                # Warm-up: the first requests pay for the market-data fetch and connection setup
+                await asyncio.gather(*(client_loop(client, base_url, endpoints, weights, questions,
+                                                   time.monotonic() + args.warmup, None, Recorder(), rng)
+                                       for _ in range(args.concurrency)))
+                for url in (gemini_url, coingecko_url):
+                    await client.post(f"{url}/__reset")
+
+                recorder = Recorder()
+                budget = {"left": args.requests} if args.requests else None
+                stop_at = time.monotonic() + (args.duration if not args.requests else 1e9)
+                start = time.perf_counter()
+                await asyncio.gather(*(client_loop(client, base_url, endpoints, weights, questions,
+                                                   stop_at, budget, recorder, random.Random(args.seed + i))
+                                       for i in range(args.concurrency)))
+                elapsed = time.perf_counter() - start
+                upstream = {name: (await client.get(f"{url}/__stats")).json()
+                            for name, url in (("gemini", gemini_url), ("coingecko", coingecko_url))}
+        finally:
+            stop_process(app_process)
+            stop_process(fakes)
+            app_log.close()
+            fakes_log.close()
+            if args.keep_logs:
+                for name in ("app.log", "fakes.log"):
+                    with open(os.path.join(tmp_dir, name), "rb") as log_file:
+                        sys.stderr.buffer.write(log_file.read()[-20000:])
+    return build_report(recorder, elapsed, upstream, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("dev", "gunicorn", "uvicorn"), default="dev")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn/uvicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients (closed loop)")
+    parser.add_argument("--duration", type=float, default=20, help="seconds to measure")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests instead")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds of unrecorded load first")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("ask=8,tour=1,ask_stream=1"),
+                        help="endpoint weights, e.g. ask=8,tour=1,ask_stream=1")
+    parser.add_argument("--repeat-questions", action="store_true", help="reuse questions (measures the answer cache)")
+    parser.add_argument("--timeout", type=float, default=120, help="client timeout per request")
+    parser.add_argument("--admission", action="store_true",
+                        help="keep admission control on (set ADMISSION_* in the environment to tune it)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    parser.add_argument("--keep-logs", action="store_true", help="print the tail of the app and fake logs")
+    add_fake_server_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            print_comparison(report, json.load(baseline_file))
+
+
+if __name__ == "__main__":
+    main()
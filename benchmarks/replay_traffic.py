@@ -0,0 +1,307 @@
+"""
+What-if replay of captured /ask traffic (see traffic_capture.py) through
+candidate answer-cache policies and intent-router thresholds, before
+changing them in app.py.
+
+Records are streamed, and several captures (one per worker) are merged by
+start time, so memory is bounded by the simulated caches, not by the size
+of the capture. Each candidate is reported against what the capture
+recorded: how often it avoids the LLM, LLM calls and tokens, and the
+projected latency:
+  * a request the candidate answers without the LLM takes its recorded
+    time minus its LLM call and admission wait;
+  * one that needs the LLM but was answered without it in the capture is
+    charged the running mean LLM call time, admission wait and tokens.
+
+Cache policies are "lru:<size>" or "ttl:<size>:<seconds>" (TTLs run on the
+captured timestamps). Keys are built as in answer_cache: the question under
+one of KEY_NORMALIZATIONS, the history fingerprint and, unless
+--ignore-data-version, the market-data version. As in the app, only turns
+with at most --max-history-turns of history are cached, and local answers
+never reach the cache.
+
+Router candidates retrain the intent router with another off-topic
+threshold and reclassify every question; metric routes are assumed to find
+market data.
+
+Run from the repository root:
+    python -m benchmarks.replay_traffic CAPTURE [CAPTURE ...] [--policies ttl:512:3600 lru:4096]
+        [--keys exact normalized bag] [--max-history-turns 2] [--router-thresholds 0.75 0.85 0.95]
+"""
+import argparse
+import heapq
+import math
+import sys
+import time
+from collections import Counter, OrderedDict
+
+from answer_cache import normalize_question
+from intent_router import ROUTE_METRICS, ROUTE_OFF_TOPIC, create_intent_router
+from traffic_capture import iter_records
+
+LLM_SOURCES = ("llm", "error")
+STOPWORDS = frozenset("a an and are about can do does how i in is it me of on please tell the to what whats why you".split())
+ROUTER_MEMO_SIZE = 100_000
+
+
+def bag_of_words(question):
+    """Normalized, unordered and without filler words: 'What is a UTXO?' == 'utxo what is'."""
+    return " ".join(sorted(set(normalize_question(question).split()) - STOPWORDS))
+
+
+KEY_NORMALIZATIONS = {
+    "exact": str.strip,
+    "normalized": normalize_question,
+    "bag": bag_of_words,
+}
+
+
+class LatencyHistogram:
+    """Log-spaced buckets about 2% wide, so percentiles take constant memory."""
+
+    BASE_MS = 0.01
+    GROWTH = 1.02
+
+    def __init__(self):
+        self.counts = Counter()
+        self.total = 0
+        self.sum_ms = 0.0
+
+    @classmethod
+    def bucket(cls, ms):
+        return int(math.log(max(ms, cls.BASE_MS) / cls.BASE_MS, cls.GROWTH))
+
+    def add(self, bucket, ms):
+        self.counts[bucket] += 1
+        self.total += 1
+        self.sum_ms += ms
+
+    def percentile(self, fraction):
+        if not self.total:
+            return 0.0
+        rank = fraction * self.total
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return self.BASE_MS * self.GROWTH ** (index + 0.5)
+        return 0.0
+
+    def mean(self):
+        return self.sum_ms / self.total if self.total else 0.0
+
+
+def outcome(ms, llm_call, tokens):
+    """What one request costs under a candidate: (latency bucket, ms, LLM calls, tokens)."""
+    return LatencyHistogram.bucket(ms), ms, llm_call, tokens
+
+
+class Projection:
+    """Running totals of one candidate (or of the capture itself)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.avoided = 0 # answered without the LLM by the candidate's own mechanism
+        self.llm_calls = 0
+        self.tokens = 0
+        self.latency = LatencyHistogram()
+
+    def record(self, cost):
+        bucket, ms, llm_call, tokens = cost
+        self.requests += 1
+        self.llm_calls += llm_call
+        self.tokens += tokens
+        self.latency.add(bucket, ms)
+
+
+class SimulatedCache:
+    """
+    LRU with an optional TTL on the replay clock. Like the app's TTLCache,
+    except that a full cache evicts the least recently used entry even if an
+    expired one is further back; expired entries go when they are looked up.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.expires = OrderedDict()
+
+    def lookup(self, key, now):
+        expires = self.expires.get(key)
+        if expires is None:
+            return False
+        if expires <= now:
+            del self.expires[key]
+            return False
+        self.expires.move_to_end(key)
+        return True
+
+    def insert(self, key, now):
+        self.expires[key] = now + self.ttl if self.ttl else math.inf
+        self.expires.move_to_end(key)
+        if len(self.expires) > self.maxsize:
+            self.expires.popitem(last=False)
+
+
+class BoundedMemo(OrderedDict):
+    """LRU-bounded dict for per-question results."""
+
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def put(self, key, value):
+        self[key] = value
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+        return value
+
+
+class Imputation:
+    """Running means of the LLM-answered requests, charged to requests whose LLM cost the capture lacks."""
+
+    def __init__(self):
+        self.count = 0
+        self.llm_ms = 0.0
+        self.tokens = 0.0
+
+    def observe(self, record):
+        self.count += 1
+        self.llm_ms += (record.get("lm", 0.0) + record.get("st", {}).get("admission", 0.0) - self.llm_ms) / self.count
+        self.tokens += (record.get("pt", 0) + record.get("ot", 0) - self.tokens) / self.count
+
+
+class Replay:
+    """Feeds each record to every candidate."""
+
+    def __init__(self, policies, keys, max_history_turns, ignore_data_version, router_thresholds):
+        self.clock = 0.0
+        self.imputed = Imputation()
+        self.captured = Projection("captured")
+        self.captured_cache_hits = 0
+        self.captured_router_local = 0
+        self.max_history_turns = max_history_turns
+        self.ignore_data_version = ignore_data_version
+        self.keys = keys
+        self.caches = [(Projection(f"{policy} {key}"), self._make_cache(policy), key) for policy in policies for key in keys]
+        self.routers = []
+        for threshold in router_thresholds:
+            router = create_intent_router(off_topic_threshold=threshold)
+            if router is None:
+                raise SystemExit("Could not train the intent router.")
+            self.routers.append((Projection(f"off_topic_threshold={threshold:g}"), router, BoundedMemo(ROUTER_MEMO_SIZE)))
+
+    @staticmethod
+    def _make_cache(policy):
+        kind, _, params = policy.partition(":")
+        if kind == "lru":
+            return SimulatedCache(int(params))
+        if kind == "ttl":
+            size, _, ttl = params.partition(":")
+            return SimulatedCache(int(size), float(ttl))
+        raise SystemExit(f"Unknown cache policy {policy!r} (use lru:<size> or ttl:<size>:<seconds>).")
+
+    def feed(self, record):
+        # Captures are ordered by finish time and merged across files, so start times may step back a little
+        now = self.clock = max(self.clock, record["ts"])
+        source = record.get("src")
+        captured_llm = source in LLM_SOURCES
+        ms = record["ms"]
+        # The request's cost when answered by the LLM, and when answered without it
+        if captured_llm:
+            self.imputed.observe(record)
+            with_llm = outcome(ms, 1, record.get("pt", 0) + record.get("ot", 0))
+            without_llm = outcome(max(ms - record.get("lm", 0.0) - record.get("st", {}).get("admission", 0.0), 0.0), 0, 0)
+            as_captured = with_llm
+        else:
+            with_llm = outcome(ms + self.imputed.llm_ms, 1, round(self.imputed.tokens))
+            without_llm = as_captured = outcome(ms, 0, 0)
+        self.captured.record(as_captured)
+        self.captured_cache_hits += source == "cache"
+        self.captured_router_local += "rn" in record
+
+        question = record["q"]
+        if source != "local" and record.get("h", 0) <= self.max_history_turns:
+            context = (record.get("hf", ""), None if self.ignore_data_version else record.get("v"))
+            keys = {key: (KEY_NORMALIZATIONS[key](question), context) for key in self.keys}
+            for projection, cache, key in self.caches:
+                if cache.lookup(keys[key], now):
+                    projection.avoided += 1
+                    projection.record(without_llm)
+                else:
+                    projection.record(with_llm)
+                    if source != "error":
+                        cache.insert(keys[key], now)
+        else:
+            # Not cacheable here: as captured, except that a capture-time cache hit now needs the LLM
+            cost = with_llm if source == "cache" else as_captured
+            for projection, _, _ in self.caches:
+                projection.record(cost)
+
+        has_history = record.get("h", 0) > 0
+        for projection, router, memo in self.routers:
+            local = memo.get((question, has_history))
+            if local is None:
+                route = router.classify(question, has_history=has_history)
+                local = memo.put((question, has_history), route.name in (ROUTE_OFF_TOPIC, ROUTE_METRICS))
+            if local:
+                projection.avoided += 1
+                projection.record(without_llm)
+            elif "rn" in record:
+                # The capture's router answered it; this one sends it on (the cache or knowledge base might still have)
+                projection.record(with_llm)
+            else:
+                projection.record(as_captured)
+
+
+def print_table(title, projections, captured, captured_avoided):
+    print(f"\n{title}")
+    captured.avoided = captured_avoided
+    print(f"{'candidate':<32} {'share':>9} {'LLM calls':>10} {'calls saved':>12} {'tokens saved':>13}"
+          f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+    for projection in [captured] + projections:
+        latency = projection.latency
+        avoided = projection.avoided / projection.requests if projection.requests else 0.0
+        print(f"{projection.name:<32} {avoided:9.1%} {projection.llm_calls:10,d} {captured.llm_calls - projection.llm_calls:12,d}"
+              f" {captured.tokens - projection.tokens:13,d} {latency.percentile(0.5):8.1f} {latency.percentile(0.95):8.1f}"
+              f" {latency.percentile(0.99):8.1f} {latency.mean():8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="capture paths (TRAFFIC_CAPTURE_PATH); rotated .N.gz segments are included")
+    parser.add_argument("--policies", nargs="*", default=["ttl:512:3600", "lru:512", "ttl:4096:3600", "ttl:4096:86400"])
+    parser.add_argument("--keys", nargs="*", default=["exact", "normalized", "bag"], choices=sorted(KEY_NORMALIZATIONS))
+    parser.add_argument("--max-history-turns", type=int, default=2, help="cache only turns with at most this much history")
+    parser.add_argument("--ignore-data-version", action="store_true", help="leave the market-data version out of cache keys")
+    parser.add_argument("--router-thresholds", type=float, nargs="*", default=[0.75, 0.85, 0.95])
+    args = parser.parse_args()
+
+    replay = Replay(args.policies, args.keys, args.max_history_turns, args.ignore_data_version, args.router_thresholds)
+    records = heapq.merge(*(iter_records(path) for path in args.captures), key=lambda record: record.get("ts", 0.0))
+    skipped = 0
+    start = time.perf_counter()
+    for count, record in enumerate(records, 1):
+        # Rejected (shed) requests and ones that failed before their question was read cost no LLM call
+        if "q" not in record or "ms" not in record or record.get("s", 200) != 200:
+            skipped += 1
+        else:
+            replay.feed(record)
+        if count % 1_000_000 == 0:
+            print(f"... {count:,} records", file=sys.stderr)
+
+    print(f"Replayed {replay.captured.requests:,} requests ({skipped:,} skipped: rejected, failed or incomplete)"
+          f" from {len(args.captures)} capture(s) in {time.perf_counter() - start:.1f} s.")
+    print(f"LLM calls without a recorded cost are charged {replay.imputed.llm_ms:.0f} ms and {replay.imputed.tokens:.0f} tokens"
+          f" (means over {replay.imputed.count:,} LLM-answered requests).")
+    if replay.caches:
+        print_table("Answer cache policies (share = cache hits):", [projection for projection, _, _ in replay.caches],
+                    replay.captured, replay.captured_cache_hits)
+    if replay.routers:
+        print_table("Intent router thresholds (share = answered locally by the router):",
+                    [projection for projection, _, _ in replay.routers], replay.captured, replay.captured_router_local)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,82 @@
+import argparse
+import contextlib
+import json
 import os
-import google.generativeai as genai
+import sys
 from dotenv import load_dotenv
 
+import market_data
+from batch_runner import ndjson_lines, run_batch
+from config import Config
+from history_compaction import HistoryCompactor
+from llm_backends import LLMRequest, create_llm_router, parse_backend_specs
+
 # --- Configuration ---
 load_dotenv() # Load environment variables from .env file
 API_KEY = os.getenv("GOOGLE_API_KEY")
+# Choose a model (e.g., 'gemini-2.0-flash-001')
+# See available models: https://ai.google.dev/models/gemini (or run with --list-models)
+MODEL_NAME = 'gemini-2.0-flash-001'
+# Ordered LLM backends with failover and hedging, "kind[:model][@timeout_seconds]" (see llm_backends.py)
+LLM_BACKENDS = os.getenv("LLM_BACKENDS", f"gemini:{MODEL_NAME}")
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+# Conversation history budget for interactive and pipe modes (older turns are folded into a summary)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+HISTORY_KEEP_RECENT_TURNS = int(os.getenv("HISTORY_KEEP_RECENT_TURNS", "6"))
 
-if not API_KEY:
-    print("Error: GOOGLE_API_KEY not found.")
-    print("Please make sure you have a .env file with GOOGLE_API_KEY=YOUR_API_KEY")
-    exit()
+# --- Model Setup (on start-up of a mode, not at import) ---
+llm = None
 
-try:
-    genai.configure(api_key=API_KEY)
-except Exception as e:
-    print(f"Error configuring Gemini API: {e}")
-    exit()
+def configure_gemini():
+    """Imports and configures the Gemini SDK; exits with a message if that is impossible."""
+    if not API_KEY:
+        print("Error: GOOGLE_API_KEY not found.")
+        print("Please make sure you have a .env file with GOOGLE_API_KEY=YOUR_API_KEY")
+        sys.exit(1)
+    import google.generativeai as genai # deferred so --help and argument errors stay instant
+    try:
+        genai.configure(api_key=API_KEY)
+    except Exception as e:
+        print(f"Error configuring Gemini API: {e}")
+        sys.exit(1)
+    return genai
 
-# --- Model Setup ---
-# Choose a model (e.g., 'gemini-2.0-flash-001')
-# See available models: https://ai.google.dev/models/gemini
-try:
-    model = genai.GenerativeModel('gemini-2.0-flash-001')
-except Exception as e:
-    print(f"Error creating Gemini model: {e}")
-    exit()
-# --- Add this code temporarily ---
-print("Listing available models supporting 'generateContent'...")
-supported_models = [
-    m for m in genai.list_models() if 'generateContent' in m.supported_generation_methods
-]
-if not supported_models:
-    print("No models found that support 'generateContent'. Please check your API key and region.")
-else:
-    print("Available models supporting 'generateContent':")
-    for m in supported_models:
-        print(f"- {m.name}")
-print("-" * 20)
-# --- End temporary code ---
+def init_llm():
+    """Builds the LLM router from LLM_BACKENDS; exits with a message if that is impossible."""
+    global llm
+    kinds = {kind for kind, _, _ in parse_backend_specs(LLM_BACKENDS)}
+    if kinds & {"gemini", "genai"} and not API_KEY:
+        print("Error: GOOGLE_API_KEY not found.")
+        print("Please make sure you have a .env file with GOOGLE_API_KEY=YOUR_API_KEY")
+        sys.exit(1)
+    try:
+        llm = create_llm_router(
+            LLM_BACKENDS,
+            system_prompt=SYSTEM_PROMPT,
+            backend_options={
+                "gemini": {"api_key": API_KEY},
+                "genai": {"api_key": API_KEY},
+                "openai": {"api_key": Config.OPENAI_KEY},
+            },
+            default_timeout_seconds=LLM_TIMEOUT_SECONDS,
+        )
+    except ValueError as e:
+        print(f"Error setting up the LLM backends: {e}")
+        sys.exit(1)
+
+def list_models():
+    """Prints the models that support generateContent (one API call)."""
+    genai = configure_gemini()
+    print("Listing available models supporting 'generateContent'...")
+    supported_models = [
+        m for m in genai.list_models() if 'generateContent' in m.supported_generation_methods
+    ]
+    if not supported_models:
+        print("No models found that support 'generateContent'. Please check your API key and region.")
+    else:
+        print("Available models supporting 'generateContent':")
+        for m in supported_models:
+            print(f"- {m.name}")
 # --- System Prompt: Define the Chatbot's Persona and Scope ---
 # This guides the AI to focus on Bitcoin and act knowledgeable.
 SYSTEM_PROMPT = """
@@ -53,56 +92,200 @@ notable figures, significant events, and related technical details (like forks,
 - Do not engage in speculative discussions about the future price unless citing historical data or widely known analyses (and label them as such).
 """
 
-# --- Chat History (Optional but Recommended for Context) ---
-# For a simple single-turn Q&A, we don't strictly need this,
-# but it's good practice for more conversational bots.
-# We will prepend the system prompt to each user query for simplicity here.
-# For multi-turn conversations, use model.start_chat(history=[...])
+# --- Batch Mode ---
+def answer_question(user_input, data_block=""):
+    """Single non-streamed answer for batch mode: returns (answer, ok). API errors propagate for retries."""
+    response = llm.generate(LLMRequest(f"{data_block}User Question: {user_input}\n\nAnswer:"))
+    return response.text, response.ok
 
-print("--- Bitcoin Chatbot Initialized ---")
-print("Ask me anything about Bitcoin! Type 'quit', 'exit', or 'bye' to end.")
+def run_batch_mode(args):
+    """Answers every non-empty line of args.batch ('-' for stdin) and writes NDJSON results."""
+    with (contextlib.nullcontext(sys.stdin) if args.batch == "-" else open(args.batch, encoding="utf-8")) as question_file:
+        questions = [line.strip() for line in question_file if line.strip()]
+    print(f"Answering {len(questions)} questions with concurrency {args.concurrency}...", file=sys.stderr)
 
-# --- Main Chat Loop ---
-while True:
-    user_input = input("\nYou: ").strip()
+    # Fetch the market data once (through the shared snapshot) for the whole batch
+    market_data.claim_refresher()
+    market_data.refresh_if_due()
+    fetch_error = market_data.get_bitcoin_data()[1]
+    if fetch_error:
+        print(f"Market data status: {fetch_error}", file=sys.stderr)
+    # Same block as Conversation and the web app, so batch answers see the same prompt
+    data_block = market_data.build_data_block()
 
-    if not user_input:
-        continue # Ask again if input is empty
+    results = run_batch(
+        questions,
+        lambda question: answer_question(question, data_block),
+        concurrency=args.concurrency,
+        max_retries=args.retries,
+        backoff_seconds=args.backoff,
+    )
+    with (contextlib.nullcontext(sys.stdout) if args.output == "-" else open(args.output, "w", encoding="utf-8")) as output:
+        for line in ndjson_lines(results):
+            output.write(line)
+            output.flush()
+    # The last line is the summary
+    print(line.strip(), file=sys.stderr)
 
-    if user_input.lower() in ['quit', 'exit', 'bye']:
-        print("Chatbot: Goodbye!")
-        break
 
-    # Combine the system prompt with the user's current question
-    # This ensures the model stays focused on its Bitcoin persona for each query.
-    full_prompt = f"{SYSTEM_PROMPT}\n\nUser Question: {user_input}\n\nAnswer:"
+# --- Conversation (interactive and pipe modes) ---
+history_compactor = HistoryCompactor(budget_tokens=HISTORY_TOKEN_BUDGET, keep_recent_turns=HISTORY_KEEP_RECENT_TURNS)
 
-    print("Chatbot: Thinking...")
+class Conversation:
+    """
+    One ongoing chat. The system prompt goes to the backend once, as its
+    system instruction; each turn sends only the market-data block and the
+    question, continuing the live ChatSession (Gemini) or, for backends
+    without one, the stored turns. With history_path, turns are appended to
+    that JSONL file as they happen and loaded from it on start, so a later
+    run resumes the conversation.
+    """
 
-    try:
-        # --- Generate Content ---
-        response = model.generate_content(
-            full_prompt,
-            # Optional: Configure safety settings, temperature, etc.
-            # generation_config=genai.types.GenerationConfig(...)
-            # safety_settings=[...]
-            )
-
-        # --- Display Response ---
-        # Access the text part of the response
-        # Handle cases where the response might be blocked or empty
-        if response.parts:
-             # Clean up potential markdown formatting if not desired
-            bot_response = response.text.strip()
-            print(f"\nChatbot: {bot_response}")
+    def __init__(self, history_path=None):
+        self.history_path = history_path
+        self.turns = []
+        self.chat = None
+        if history_path and os.path.exists(history_path):
+            with open(history_path, encoding="utf-8") as history_file:
+                self.turns = [json.loads(line) for line in history_file if line.strip()]
+
+    def reset(self):
+        self.turns = []
+        self.chat = None
+        if self.history_path:
+            open(self.history_path, "w", encoding="utf-8").close()
+
+    def _append(self, question, answer):
+        new_turns = [{'type': 'user', 'text': question}, {'type': 'bot', 'text': answer}]
+        self.turns.extend(new_turns)
+        if self.history_path:
+            with open(self.history_path, "a", encoding="utf-8") as history_file:
+                for turn in new_turns:
+                    history_file.write(json.dumps(turn, ensure_ascii=False) + "\n")
+
+    def ask(self, question, write):
+        """
+        Streams the answer to question, passing each chunk to write as it
+        arrives; returns the final LLMResponse. A turn is only kept if it
+        completed; on Ctrl-C the stream is closed and KeyboardInterrupt re-raised.
+        """
+        model_history, compacted = history_compactor.compact(self.turns, "cli")
+        if compacted:
+            # The live chat mirrors the full history; start one from the compacted turns instead
+            self.chat = None
+        prompt = f"{market_data.build_data_block()}User Question: {question}\n\nAnswer:"
+        stream = llm.stream(LLMRequest(prompt, model_history, self.chat))
+        # A chat interrupted or failed mid-turn is out of step with the turns; the next one starts afresh
+        self.chat = None
+        try:
+            for text in stream:
+                write(text)
+        except KeyboardInterrupt:
+            stream.close()
+            raise
+        response = stream.response
+        if response.ok:
+            self._append(question, response.text)
+            if response.chat is not None and not compacted:
+                # Store the raw question rather than the data-laden prompt, as app.keep_chat_alive does
+                chat = response.chat
+                chat.history = chat.history[:-2] + [{'role': 'user', 'parts': [{'text': question}]}, chat.history[-1]]
+                self.chat = chat
+        return response
+
+# --- Interactive Mode ---
+def chat_loop(conversation):
+    # Keep the market data fresh in the background, so no turn waits on CoinGecko
+    market_data.ensure_refresher_started()
+    print("--- Bitcoin Chatbot Initialized ---")
+    if conversation.turns:
+        print(f"Resuming conversation from {conversation.history_path} ({len(conversation.turns) // 2} earlier questions).")
+    print("Ask me anything about Bitcoin! Type 'quit', 'exit', or 'bye' to end, '/reset' to start over.")
+
+    # --- Main Chat Loop ---
+    while True:
+        try:
+            user_input = input("\nYou: ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print("\nChatbot: Goodbye!")
+            break
+
+        if not user_input:
+            continue # Ask again if input is empty
+
+        if user_input.lower() in ['quit', 'exit', 'bye']:
+            print("Chatbot: Goodbye!")
+            break
+
+        if user_input.lower() == '/reset':
+            conversation.reset()
+            print("Chatbot: Conversation cleared.")
+            continue
+
+        print("\nChatbot: ", end="", flush=True)
+        try:
+            # --- Generate Content (streamed, so partial output shows up immediately) ---
+            response = conversation.ask(user_input, lambda text: print(text, end="", flush=True))
+            if response.ok:
+                print()
+            else:
+                # The backend's explanation, e.g. a safety block and its finish reason
+                print(f"I couldn't generate a response for that. {response.text}")
+        except KeyboardInterrupt:
+            print("\n(answer interrupted)")
+        except Exception as e:
+            print(f"\nAn error occurred while contacting the AI: {e}")
+
+# --- Pipe Mode ---
+def run_pipe_mode(conversation):
+    """
+    Answers each non-empty stdin line as the next turn of one conversation,
+    streaming the answers to stdout separated by blank lines. Errors go to
+    stderr; returns the exit status (1 if any question went unanswered).
+    """
+    market_data.claim_refresher()
+    failures = 0
+    for line in sys.stdin:
+        question = line.strip()
+        if not question:
+            continue
+        # One refresh check per question; no background thread for a short-lived run
+        market_data.refresh_if_due()
+        try:
+            response = conversation.ask(question, sys.stdout.write)
+        except Exception as e:
+            response = None
+            error = str(e)
         else:
-             # Check prompt_feedback for reasons like safety blocks
-             block_reason = response.prompt_feedback.block_reason if response.prompt_feedback else "Unknown"
-             print(f"\nChatbot: I couldn't generate a response for that. Reason: {block_reason}")
-             if response.candidates and response.candidates[0].finish_reason != 'STOP':
-                print(f"       Finish Reason: {response.candidates[0].finish_reason}")
+            error = None if response.ok else response.text
+        if error:
+            failures += 1
+            print(f"Error answering {question!r}: {error}", file=sys.stderr)
+        sys.stdout.write("\n\n")
+        sys.stdout.flush()
+    return 1 if failures else 0
 
 
-    except Exception as e:
-        print(f"\nChatbot: An error occurred while contacting the Gemini API: {e}")
-        # Consider adding more specific error handling based on Gemini API exceptions
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bitcoin chatbot (interactive by default).")
+    parser.add_argument("--batch", metavar="FILE", help="answer one question per line of FILE ('-' for stdin) and exit")
+    parser.add_argument("--output", default="-", help="NDJSON output file for --batch (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Gemini calls in flight in batch mode")
+    parser.add_argument("--retries", type=int, default=4, help="retries per question on quota/5xx/timeout errors")
+    parser.add_argument("--backoff", type=float, default=1.0, help="initial retry backoff in seconds")
+    parser.add_argument("--pipe", action="store_true", help="answer stdin lines as one conversation, streaming to stdout, and exit")
+    parser.add_argument("--history", metavar="FILE", help="keep the conversation in FILE (JSONL) and resume it if FILE exists")
+    parser.add_argument("--list-models", action="store_true", help="list the models that support generateContent and exit")
+    args = parser.parse_args()
+
+    if args.list_models:
+        list_models()
+    elif args.batch:
+        init_llm()
+        run_batch_mode(args)
+    elif args.pipe:
+        init_llm()
+        sys.exit(run_pipe_mode(Conversation(args.history)))
+    else:
+        init_llm()
+        chat_loop(Conversation(args.history))
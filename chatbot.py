@@ -1,26 +1,40 @@
-from google import genai
 from dotenv import load_dotenv
 import os
 import logging
 
+from config import Config
+from llm_backends import LLMRequest, create_llm_router
+
 # Load environment variables
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
-# Configure Gemini API
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+SYSTEM_PROMPT = (
+    "You are a helpful assistant that specializes in Bitcoin. "
+    "Answer questions clearly and concisely for a general audience."
+)
+
+# Ordered LLM backends with failover and hedging (see llm_backends.py); google-genai by default
+llm = create_llm_router(
+    os.getenv("LLM_BACKENDS", "genai:gemini-2.0-flash"),
+    SYSTEM_PROMPT,
+    backend_options={
+        "genai": {"api_key": os.getenv("GEMINI_API_KEY")},
+        "gemini": {"api_key": os.getenv("GEMINI_API_KEY")},
+        "openai": {"api_key": Config.OPENAI_KEY},
+    },
+    default_timeout_seconds=float(os.getenv("LLM_TIMEOUT_SECONDS", "60")),
+)
 
 
 def get_bot_response(prompt):
     try:
-        response = client.models.generate_content(
-    model="gemini-2.0-flash", 
-    contents="You are a helpful assistant that specializes in Bitcoin. "
-    "Answer questions clearly and concisely for a general audience.\n\n"
-)
-        reply = response.text.strip()
-        logging.info(f"User: {prompt}\nBot: {reply}")
+        response = llm.generate(LLMRequest(prompt))
+        reply = response.text
+        if not response.ok:
+            logging.warning("LLM response from %s blocked or empty: %s", response.backend, reply)
+        logging.info("User: %s\nBot: %s", prompt, reply)
         return reply
     except Exception as e:
-        logging.error("Gemini API error", exc_info=True)
+        logging.error("LLM API error", exc_info=True)
         return "Sorry, I couldn’t get a response right now. Please try again soon."
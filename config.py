@@ -1,4 +1,8 @@
 import os
+from dotenv import load_dotenv
+
+# Read .env here too, so Config works whatever the importer loaded first
+load_dotenv()
 
 class Config:
     OPENAI_KEY = os.getenv("OPENAI_API_KEY")
@@ -0,0 +1,142 @@
+"""
+Gemini context cache for the static prompt prefix, shared by every worker
+on the host.
+
+CachedContent storage is billed per cache, so workers must not each create
+their own. The cache's display name carries a hash of the model and system
+instruction, and its resource name is recorded in a file next to the
+market-data snapshot. Under a file lock the first worker creates the cache
+and the others reuse it by name; a cache with the same display name left by
+an earlier run is reused rather than duplicated.
+
+gunicorn.conf.py deletes the recorded cache in on_exit, after the last
+worker is gone. Under other servers it expires one TTL after the last
+keep-alive (see app.keep_context_cache_alive).
+"""
+import datetime
+import hashlib
+import logging
+import os
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+import market_data
+
+try:
+    import fcntl # POSIX only; without it concurrent workers may each create a cache
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DISPLAY_NAME_PREFIX = "bitcoin-chatbot-system-prompt"
+# Holds the shared cache's resource name; lives next to the snapshot, in the workers' private directory
+RECORD_PATH = os.getenv("GEMINI_CONTEXT_CACHE_RECORD_PATH") or market_data.SNAPSHOT_PATH + ".context_cache"
+_OPEN_FLAGS = getattr(os, "O_NOFOLLOW", 0)
+
+
+def display_name(model_name, system_instruction):
+    digest = hashlib.sha256(f"{model_name}\0{system_instruction}".encode("utf-8")).hexdigest()[:16]
+    return f"{DISPLAY_NAME_PREFIX}-{digest}"
+
+
+@contextmanager
+def _record_lock(record_path):
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(record_path + ".lock", os.O_WRONLY | os.O_CREAT | _OPEN_FLAGS, 0o600)
+    with os.fdopen(fd, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_record(record_path):
+    """The recorded cache name, or None. Ignores a record this user does not own."""
+    try:
+        fd = os.open(record_path, os.O_RDONLY | _OPEN_FLAGS)
+    except FileNotFoundError:
+        return None
+    with os.fdopen(fd) as record:
+        if hasattr(os, "getuid") and os.fstat(record.fileno()).st_uid != os.getuid():
+            logger.warning("Ignoring context cache record %s owned by another user.", record_path)
+            return None
+        return record.read().strip() or None
+
+
+def _write_record(record_path, name):
+    fd = os.open(record_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _OPEN_FLAGS, 0o600)
+    with os.fdopen(fd, "w") as record:
+        record.write(name)
+
+
+def _get(caching, name, wanted):
+    if not name:
+        return None
+    try:
+        cached = caching.CachedContent.get(name)
+    except Exception: # expired or deleted since it was recorded
+        return None
+    return cached if cached.display_name == wanted else None
+
+
+def get_or_create(caching, model_name, system_instruction, ttl_seconds, record_path=RECORD_PATH):
+    """
+    Returns the CachedContent holding this prefix: the one recorded at
+    record_path, else one with the same display name, else a new one.
+    Reused caches get their TTL extended, as they may be close to expiring.
+    """
+    wanted = display_name(model_name, system_instruction)
+    ttl = datetime.timedelta(seconds=ttl_seconds)
+    with _record_lock(record_path):
+        cached = _get(caching, _read_record(record_path), wanted)
+        if cached is None:
+            cached = next((c for c in caching.CachedContent.list(page_size=100) if c.display_name == wanted), None)
+        if cached is None:
+            cached = caching.CachedContent.create(model=model_name, display_name=wanted,
+                                                  system_instruction=system_instruction, ttl=ttl)
+            logger.info("Created Gemini context cache %s.", cached.name)
+        else:
+            cached.update(ttl=ttl)
+            logger.info("Reusing Gemini context cache %s.", cached.name)
+        _write_record(record_path, cached.name)
+    return cached
+
+
+def delete_recorded(caching, record_path=RECORD_PATH):
+    """Deletes the cache recorded at record_path, if any. Only call once no worker uses it."""
+    with _record_lock(record_path):
+        name = _read_record(record_path)
+        if name is None:
+            return
+        try:
+            caching.CachedContent.get(name).delete()
+            logger.info("Deleted Gemini context cache %s.", name)
+        except Exception:
+            logger.exception("Failed to delete Gemini context cache %s:", name)
+        os.remove(record_path)
+
+
+def delete_on_exit(record_path=RECORD_PATH):
+    """
+    delete_recorded for a process that never imported app.py (the gunicorn
+    master): configures the SDK from the same settings as
+    app.configure_gemini_sdk, and only if a cache was recorded.
+    """
+    if not os.path.exists(record_path):
+        return
+    load_dotenv()
+    if not os.getenv("GOOGLE_API_KEY"):
+        return
+    import google.generativeai as genai
+    from google.generativeai import caching
+    if os.getenv("GEMINI_API_BASE_URL"):
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"), transport="rest",
+                        client_options={"api_endpoint": os.getenv("GEMINI_API_BASE_URL")})
+    else:
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    delete_recorded(caching, record_path)
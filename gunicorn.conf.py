@@ -0,0 +1,50 @@
+"""
+Gunicorn settings, picked up automatically from the working directory:
+
+    PRELOAD_WARMUP=true gunicorn -w 4 --threads 8 app:app
+
+With PRELOAD_WARMUP the master imports app.py once, builds the Gemini
+model and fills the market-data snapshot (app.warm_up), then forks; every
+worker starts ready instead of paying for the SDK import and first
+CoinGecko fetch on its first request. The master starts no background
+tasks and makes no LLM calls, so each worker starts its own right after the
+fork (the log writer thread is restarted in each child by log_pipeline's
+at-fork hook); with GEMINI_CONTEXT_CACHE that includes looking up the
+cached prompt prefix (the first worker creates it, the rest reuse it; see
+context_cache.py) and its keep-alive thread. The master deletes that
+cache in on_exit, once every worker is gone.
+Without it, gunicorn behaves as before (each worker imports app.py).
+Either way the master picks the market-data state directory before the
+first fork (on_starting), so every worker maps the same snapshot.
+"""
+import os
+
+preload_app = os.getenv("PRELOAD_WARMUP", "false").lower() in ("1", "true", "yes")
+
+
+def _is_flask_app(server):
+    # asgi_app:app runs its refresher and warm-up from the ASGI lifespan instead
+    return getattr(server.app, "app_uri", "").startswith("app:")
+
+
+def on_starting(server):
+    # Resolves (and exports as MARKET_DATA_DIR) the private directory workers share
+    import market_data # noqa: F401
+
+
+def when_ready(server):
+    if preload_app and _is_flask_app(server):
+        import app
+        app.warm_up()
+
+
+def post_fork(server, worker):
+    if preload_app and _is_flask_app(server):
+        import app
+        app.start_background_tasks()
+
+
+def on_exit(server):
+    # Workers share one Gemini context cache; worker_exit would pull it from under the others
+    import context_cache
+    context_cache.delete_on_exit()
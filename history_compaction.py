@@ -0,0 +1,185 @@
+import hashlib
+import json
+import logging
+import math
+import re
+import threading
+
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+SUMMARY_ACK = "Understood. I will keep that earlier context in mind."
+
+
+# --- Token estimation ---
+class TokenEstimator:
+    """
+    Cheap local token estimate: characters / chars_per_token.
+    calibrate() fits chars_per_token against a real counter (e.g. Gemini's
+    count_tokens) on sample texts, so per-request counting stays local.
+    """
+
+    def __init__(self, chars_per_token=4.0):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text):
+        return math.ceil(len(text) / self.chars_per_token) if text else 0
+
+    def count_turns(self, turns):
+        return sum(self.count(turn['text']) for turn in turns)
+
+    def calibrate(self, samples, count_fn):
+        """Sets chars_per_token from count_fn(text) -> tokens over the samples."""
+        chars = sum(len(sample) for sample in samples)
+        tokens = sum(count_fn(sample) for sample in samples)
+        if chars and tokens:
+            self.chars_per_token = chars / tokens
+            logger.info("Calibrated token estimator: %.2f chars/token.", self.chars_per_token)
+        return self.chars_per_token
+
+
+# --- Extractive summary used when no LLM summarizer is available (or it fails) ---
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+
+def extractive_summary(previous_summary, turns, max_chars=2000, max_chars_per_turn=120):
+    """One line (first sentence) per turn; the oldest lines are dropped beyond max_chars."""
+    lines = previous_summary.split("\n") if previous_summary else []
+    for turn in turns:
+        speaker = "User" if turn['type'] == 'user' else "Assistant"
+        first_sentence = _SENTENCE_END_RE.split(turn['text'].strip(), maxsplit=1)[0]
+        lines.append(f"- {speaker}: {first_sentence[:max_chars_per_turn]}")
+    while len(lines) > 1 and sum(len(line) + 1 for line in lines) > max_chars:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def _fingerprint(turns):
+    return hashlib.sha1(json.dumps([(t['type'], t['text']) for t in turns]).encode("utf-8")).hexdigest()
+
+
+class CompactionStats:
+    """Running totals of estimated tokens sent per request, before and after compaction."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.compacted_requests = 0
+        self.summaries_computed = 0
+        self.tokens_before_total = 0
+        self.tokens_after_total = 0
+        self.last_tokens_before = 0
+        self.last_tokens_after = 0
+
+    def record_summary(self):
+        with self._lock:
+            self.summaries_computed += 1
+
+    def record(self, tokens_before, tokens_after, compacted):
+        with self._lock:
+            self.requests += 1
+            self.compacted_requests += int(compacted)
+            self.tokens_before_total += tokens_before
+            self.tokens_after_total += tokens_after
+            self.last_tokens_before = tokens_before
+            self.last_tokens_after = tokens_after
+
+    def as_dict(self):
+        with self._lock:
+            requests = self.requests or 1
+            return {
+                "requests": self.requests,
+                "compacted_requests": self.compacted_requests,
+                "summaries_computed": self.summaries_computed,
+                "tokens_before_total": self.tokens_before_total,
+                "tokens_after_total": self.tokens_after_total,
+                "avg_tokens_before": round(self.tokens_before_total / requests, 1),
+                "avg_tokens_after": round(self.tokens_after_total / requests, 1),
+                "last_tokens_before": self.last_tokens_before,
+                "last_tokens_after": self.last_tokens_after,
+            }
+
+
+class HistoryCompactor:
+    """
+    Keeps chat history within a token budget. Over budget, the newest turns
+    stay verbatim and older ones are folded into a rolling summary. The
+    summary is cached per conversation and extended incrementally with only
+    the newly folded turns. Folding goes down to low_water * budget, so the
+    next few turns reuse the cached summary without recomputing it.
+    """
+
+    def __init__(self, budget_tokens=3000, keep_recent_turns=6, summarize_fn=None,
+                 estimator=None, low_water=0.6, max_summary_tokens=None, max_cached_summaries=1000):
+        self.budget_tokens = budget_tokens
+        # The summary must stay well inside the budget it is meant to protect
+        self.max_summary_tokens = max_summary_tokens or max(1, budget_tokens // 4)
+        # Turns come in user/bot pairs; the kept tail must start with a user turn
+        self.keep_recent_turns = max(2, keep_recent_turns + keep_recent_turns % 2)
+        self.summarize_fn = summarize_fn
+        self.estimator = estimator or TokenEstimator()
+        self.low_water = low_water
+        self.stats = CompactionStats()
+        # conversation key -> (folded_turn_count, fingerprint of folded turns, summary)
+        self._summaries = LRUCache(maxsize=max_cached_summaries)
+        self._lock = threading.Lock()
+
+    def compact(self, history, conversation_key=None):
+        """Returns (history_to_send, compacted). history_to_send may start with a summary turn pair."""
+        if self.estimator.count_turns(history) <= self.budget_tokens or len(history) <= self.keep_recent_turns:
+            return history, False
+
+        # Stateless clients resend the same opening turns, which identify the conversation
+        conversation_key = conversation_key or _fingerprint(history[:2])
+        with self._lock:
+            cached = self._summaries.get(conversation_key)
+
+        fold_count = self._fold_boundary(history, cached)
+        if fold_count == 0:
+            return history, False
+        folded = history[:fold_count]
+        if cached and cached[0] == fold_count and cached[1] == _fingerprint(folded):
+            summary = cached[2]
+        else:
+            summary = self._extend_summary(history, fold_count, cached)
+            with self._lock:
+                self._summaries[conversation_key] = (fold_count, _fingerprint(folded), summary)
+
+        compacted = [
+            {'type': 'user', 'text': SUMMARY_PREFIX + summary},
+            {'type': 'bot', 'text': SUMMARY_ACK},
+        ] + history[fold_count:]
+        return compacted, True
+
+    def _fold_boundary(self, history, cached):
+        """Number of leading turns to fold (always even, always leaves keep_recent_turns)."""
+        max_fold = len(history) - self.keep_recent_turns
+        max_fold -= max_fold % 2
+        # Reuse the cached boundary while the tail after it still fits the budget
+        if cached and cached[0] <= max_fold and self.estimator.count_turns(history[cached[0]:]) <= self.budget_tokens:
+            return cached[0]
+
+        target = self.budget_tokens * self.low_water
+        fold_count = 0
+        remaining = self.estimator.count_turns(history)
+        while fold_count < max_fold and remaining > target:
+            remaining -= self.estimator.count_turns(history[fold_count:fold_count + 2])
+            fold_count += 2
+        return fold_count
+
+    def _extend_summary(self, history, fold_count, cached):
+        previous_summary, start = "", 0
+        if cached and cached[0] <= fold_count and cached[1] == _fingerprint(history[:cached[0]]):
+            previous_summary, start = cached[2], cached[0]
+        new_turns = history[start:fold_count]
+
+        self.stats.record_summary()
+        if self.summarize_fn is not None:
+            try:
+                return self.summarize_fn(previous_summary, new_turns)
+            except Exception:
+                logger.exception("History summarizer failed, falling back to extractive summary:")
+        max_chars = int(self.max_summary_tokens * self.estimator.chars_per_token)
+        return extractive_summary(previous_summary, new_turns, max_chars=max_chars)
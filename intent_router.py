@@ -0,0 +1,245 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRAINING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge", "intent_training.jsonl")
+
+# Route names; 'llm' means "no local answer, ask Gemini"
+ROUTE_METRICS = "metrics"
+ROUTE_OFF_TOPIC = "off_topic"
+ROUTE_LLM = "llm"
+
+Route = namedtuple("Route", ["name", "metrics", "topic"])
+
+# --- Keyword rules ---
+# A metric question names the figure ('bitcoin price', 'btc market cap', '24h volume') ...
+METRIC_PATTERNS = {
+    "price": re.compile(
+        r"\b(price|prices|priced|trading at|btc ?/ ?usd|btcusd|usd value|exchange rate"
+        r"|how much (is|are|for) (one |1 |a |an )?(single )?(bitcoin|btc|coin))\b"),
+    "market_cap": re.compile(r"\b(market cap|market caps|market capitalization|market capitalisation|marketcap|mcap)\b"),
+    "volume": re.compile(r"\b((trading|24h|24 hour|24-hour) volume|traded today|trading activity)\b"),
+}
+# ... or uses a vaguer word together with a time cue ('what is 1 bitcoin worth today?'); on their own these
+# are about running costs, 'worth it' or transaction volume
+WEAK_METRIC_PATTERNS = {
+    "price": re.compile(r"\b(worth|cost|costs|value)\b"),
+    "volume": re.compile(r"\b(volume|volumes)\b"),
+}
+CURRENT_CUE_RE = re.compile(r"\b(current|currently|now|today|right now|latest|live|at the moment|this moment)\b")
+MENTIONS_BITCOIN_RE = re.compile(r"\b(bitcoins?|btc)\b")
+# History, predictions, explanations and comparisons need the LLM: past tense, time anchors, movements,
+# how the figure comes about and speculation
+METRIC_BLOCKER_RE = re.compile(
+    r"\b(why|will|would|should|could|predict\w*|forecast\w*|future|tomorrow|next|yesterday|last|target\w*"
+    r"|was|were|did|used to|had|been|when|during|before|after|first|launch\w*|began|begin\w*|start\w*|early|bubble"
+    r"|history|historical|ago|ath|all[- ]time|highest|lowest|record|peak|average|chart|trend\w*|since|compare\w*"
+    r"|versus|vs|affect\w*|impact\w*|influenc\w*|determin\w*|depend\w*|calculat\w*|set|sets|decided|works?|formed"
+    r"|manipulat\w*|controll?\w*|fair|real|fake|mean|means|meaning|define|definition|explain|difference"
+    r"|buy\w*|sell\w*|invest\w*|drop\w*|rise|rising|rose|fall\w*|fell|crash\w*|pump\w*|dump\w*|go|goes|going|gone"
+    r"|went|up|down|higher|lower|increas\w*|decreas\w*|chang\w*|moon|(19|20)\d\d)\b"
+    # Yes/no questions ('is the bitcoin price manipulated?') are not asking for the figure
+    r"|^\s*(is|are|was|were|do|does|did|has|have|had|can (?!you)\w+)\b")
+# Figures the template does not give: fees, transactions, nodes, DCA, other assets, and prices in other currencies or units
+METRIC_EXCLUSION_RE = re.compile(
+    r"[€£¥₹]|\b(fees?|transactions?|txs?|nodes?|bytes?|vbytes?|dca|dollar[- ]cost|averaging|mining|miners?|electricity"
+    r"|energy|convert\w*|conversion|sats?|satoshis?|gold|silver|oil|stocks?|shares?|(in|into) (bitcoins?|btc)"
+    r"|(in|to|into) (euros?|eur|gbp|pounds?|sterling|yen|jpy|yuan|cny|rmb|rupees?|inr|cad|aud|chf|swiss francs?|francs?"
+    r"|rubles?|roubles?|rub|pesos?|mxn|brl|reais|naira|ngn|lira|krona|kronor|krone|sek|nok|dkk|zar|rand|hkd|sgd|nzd|krw"
+    r"|won|gold|ounces?|other currencies|local currency)"
+    r"|(canadian|australian|hong kong|singapore|new zealand) dollars?)\b")
+
+# Other cryptocurrencies: refused unless compared with Bitcoin (see SYSTEM_PROMPT)
+OTHER_CRYPTO_NAMES = {
+    "ethereum": "Ethereum", "ether": "Ethereum", "eth": "Ethereum", "solana": "Solana", "dogecoin": "Dogecoin",
+    "doge": "Dogecoin", "cardano": "Cardano", "ripple": "XRP", "xrp": "XRP", "litecoin": "Litecoin",
+    "ltc": "Litecoin", "bnb": "BNB", "tether": "Tether", "usdt": "Tether", "usdc": "USDC", "polkadot": "Polkadot",
+    "shiba inu": "Shiba Inu", "avalanche": "Avalanche", "avax": "Avalanche", "tron": "TRON", "monero": "Monero",
+    "xmr": "Monero", "chainlink": "Chainlink", "polygon": "Polygon", "matic": "Polygon", "stellar": "Stellar",
+    "pepe": "Pepe", "altcoin": "altcoins", "altcoins": "altcoins", "memecoin": "memecoins", "memecoins": "memecoins",
+    "bitcoin cash": None, # A Bitcoin fork: leave it to the LLM
+}
+OTHER_CRYPTO_RE = re.compile(r"\b(" + "|".join(sorted((re.escape(n) for n in OTHER_CRYPTO_NAMES), key=len, reverse=True)) + r")\b")
+# Any of these makes a question Bitcoin-related enough never to be refused locally
+DOMAIN_TERMS_RE = re.compile(
+    r"\b(bitcoin\w*|btc|satoshi\w*|sats?|blockchain\w*|blocks?|min(e|er|ers|ing)|hash\w*|wallets?|lightning"
+    r"|halving\w*|halvening|crypto\w*|coins?|nodes?|mempool|utxos?|segwit|taproot|forks?|whitepaper|nakamoto"
+    r"|ledger|private keys?|public keys?|seed phrase|address(es)?|transactions?|fees?|exchanges?|decentrali[sz]\w*"
+    r"|digital (currency|money|gold)|proof of work|pow|difficulty|custody|bip\s?\d*|layer 2|l2|on-?chain"
+    r"|network|confirm\w*|hodl\w*|stack(ing)? sats|self-?custody|cold storage|multisig|ordinals?|inscriptions?"
+    r"|txs?|v?bytes?|block ?size|silk road|mt\.? ?gox|microstrategy|saylor|finney|adam back|craig wright|szabo"
+    r"|nostr|cashu|e-?cash|fedimint|cypherpunks?)\b")
+
+# --- Vectorized model: multinomial naive Bayes over hashed word unigrams + bigrams ---
+_WORD_RE = re.compile(r"[a-z0-9']+")
+# Appended for questions without any Bitcoin vocabulary; unseen words alone carry no signal
+_NO_DOMAIN_MARKER = " xxnodomainxx" * 3
+# Words that say nothing about the topic, so never count as off-topic evidence
+_STOPWORDS = frozenset(
+    "a about all am an and any are as at be been best by can could did do does for from get give good had has have he her"
+    " him his how i if in into is it it's its me my new of on or our she so some that the their them there they this to"
+    " was we were what what's when where which who whom why will with would you your xxnodomainxx".split())
+
+
+def model_input(text):
+    """The text the model sees: the question plus the no-domain marker where it applies."""
+    return text + (_NO_DOMAIN_MARKER if not DOMAIN_TERMS_RE.search(text.lower()) else "")
+
+
+def _features(text, num_features):
+    words = _WORD_RE.findall(text.lower())
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return [zlib.crc32(gram.encode("utf-8")) % num_features for gram in grams]
+
+
+class NaiveBayesModel:
+    """Trained at startup from a small labelled file in a few milliseconds; predict() is one column sum."""
+
+    def __init__(self, examples, num_features=1 << 14, alpha=0.5):
+        self.num_features = num_features
+        self.labels = sorted({label for _, label in examples})
+        label_index = {label: i for i, label in enumerate(self.labels)}
+        counts = np.zeros((len(self.labels), num_features), dtype=np.float64)
+        priors = np.zeros(len(self.labels), dtype=np.float64)
+        self.vocabulary = {label: set() for label in self.labels}
+        for text, label in examples:
+            row = label_index[label]
+            priors[row] += 1
+            self.vocabulary[label].update(_WORD_RE.findall(text.lower()))
+            np.add.at(counts[row], _features(text, num_features), 1)
+        self.log_priors = np.log(priors / priors.sum())
+        smoothed = counts + alpha
+        self.log_likelihoods = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+
+    def predict(self, text):
+        """Returns {label: probability}."""
+        features = _features(text, self.num_features)
+        scores = self.log_priors + self.log_likelihoods[:, features].sum(axis=1)
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        return dict(zip(self.labels, probabilities.tolist()))
+
+
+def load_training_examples(path=DEFAULT_TRAINING_PATH):
+    with open(path, encoding="utf-8") as training_file:
+        return [(row["question"], row["label"]) for row in map(json.loads, training_file) if row]
+
+
+class RouterStats:
+    """Per-process counts per route, plus metric questions that fell through for lack of fresh data."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {ROUTE_METRICS: 0, ROUTE_OFF_TOPIC: 0, ROUTE_LLM: 0, "metrics_unavailable": 0}
+        self.classify_seconds_total = 0.0
+
+    def record(self, route_name, seconds=0.0):
+        with self._lock:
+            self.counts[route_name] += 1
+            self.classify_seconds_total += seconds
+
+    def as_dict(self):
+        with self._lock:
+            classified = self.counts[ROUTE_METRICS] + self.counts[ROUTE_OFF_TOPIC] + self.counts[ROUTE_LLM]
+            return dict(self.counts, avg_classify_ms=round(self.classify_seconds_total / (classified or 1) * 1000, 3))
+
+
+class IntentRouter:
+    """
+    Cheap pre-LLM routing. Keyword rules decide the candidate route (they
+    are precise, and they name the metrics a template needs); the model
+    vetoes metric routes that look off-topic ('price of gold') and decides
+    off-topic questions that no rule recognises, provided the question
+    contains a word seen only in off-topic examples. Anything uncertain
+    (such as a name the model has never seen) goes to the LLM.
+    """
+
+    def __init__(self, model, off_topic_threshold=0.85):
+        self.model = model
+        self.off_topic_threshold = off_topic_threshold
+        on_topic = set().union(*(words for label, words in model.vocabulary.items() if label != ROUTE_OFF_TOPIC))
+        self.off_topic_words = frozenset(model.vocabulary.get(ROUTE_OFF_TOPIC, set()) - on_topic - _STOPWORDS)
+        self.stats = RouterStats()
+
+    def classify(self, question, has_history=False):
+        start = time.perf_counter()
+        route = self._classify(question.lower(), has_history)
+        self.stats.record(route.name, time.perf_counter() - start)
+        return route
+
+    @staticmethod
+    def _metrics(text):
+        """The metrics the question clearly asks for; anything less clear goes to the LLM."""
+        current = CURRENT_CUE_RE.search(text) is not None
+        return tuple(name for name, pattern in METRIC_PATTERNS.items()
+                     if pattern.search(text) or (current and name in WEAK_METRIC_PATTERNS and WEAK_METRIC_PATTERNS[name].search(text)))
+
+    def _off_topic_evidence(self, text):
+        return not self.off_topic_words.isdisjoint(_WORD_RE.findall(text))
+
+    def _classify(self, text, has_history):
+        other_crypto = OTHER_CRYPTO_RE.search(text)
+        mentions_bitcoin = MENTIONS_BITCOIN_RE.search(text) is not None
+        if other_crypto and OTHER_CRYPTO_NAMES[other_crypto.group(1)] and not mentions_bitcoin:
+            return Route(ROUTE_OFF_TOPIC, (), OTHER_CRYPTO_NAMES[other_crypto.group(1)])
+
+        metrics = self._metrics(text)
+        if metrics and mentions_bitcoin and not other_crypto and not METRIC_BLOCKER_RE.search(text) \
+                and not METRIC_EXCLUSION_RE.search(text):
+            if not self._off_topic_evidence(text) or self.model.predict(model_input(text)).get(ROUTE_OFF_TOPIC, 0.0) < 0.5:
+                return Route(ROUTE_METRICS, metrics, None)
+
+        # Follow-ups ('and in euros?') lean on the conversation, so only opening questions are refused; missing
+        # Bitcoin vocabulary alone is no reason to refuse ('who is hal finney?'), an off-topic word must be present
+        if not has_history and not DOMAIN_TERMS_RE.search(text) and self._off_topic_evidence(text):
+            if self.model.predict(model_input(text)).get(ROUTE_OFF_TOPIC, 0.0) >= self.off_topic_threshold:
+                return Route(ROUTE_OFF_TOPIC, (), None)
+        return Route(ROUTE_LLM, (), None)
+
+
+# --- Templates ---
+METRIC_LABELS = {"price": "price", "market_cap": "market cap", "volume": "24h trading volume"}
+METRIC_FIELDS = {"price": "usd", "market_cap": "usd_market_cap", "volume": "usd_24h_vol"}
+
+
+def render_metrics_answer(metrics, btc_data):
+    """
+    Answers current-metric questions the way SYSTEM_PROMPT asks the model
+    to, from CoinGecko's 'bitcoin' object. Returns None if a value is missing.
+    """
+    values = [btc_data.get(METRIC_FIELDS[metric]) for metric in metrics]
+    if any(value is None for value in values):
+        return None
+    parts = [f"the current {METRIC_LABELS[metric]} of Bitcoin is **${value:,.2f}**" for metric, value in zip(metrics, values)]
+    sentence = parts[0] if len(parts) == 1 else ", ".join(parts[:-1]) + " and " + parts[-1]
+    answer = f"According to the recent data provided, {sentence} (USD)."
+    if btc_data.get('last_updated_at'):
+        answer += f" Last updated: {time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(btc_data['last_updated_at']))}."
+    return answer
+
+
+def off_topic_refusal(topic=None):
+    """The scope refusal SYSTEM_PROMPT prescribes."""
+    return f"I am a specialized chatbot focused only on Bitcoin, and I cannot answer questions about {topic or 'that topic'}."
+
+
+def create_intent_router(training_path=DEFAULT_TRAINING_PATH, **options):
+    """Trains the model from the labelled file; returns None (routing disabled) if it is unavailable."""
+    try:
+        examples = load_training_examples(training_path)
+    except Exception:
+        logger.exception("Could not load intent training data from %s:", training_path)
+        return None
+    start = time.perf_counter()
+    model = NaiveBayesModel([(model_input(text), label) for text, label in examples])
+    logger.info("Trained intent model on %d examples in %.1f ms.", len(examples), (time.perf_counter() - start) * 1000)
+    return IntentRouter(model, **options)
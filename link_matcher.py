@@ -0,0 +1,85 @@
+import re
+
+# Patterns of the form \b(keyword one|keyword two)\b whose keywords are plain
+# words can be merged into a single trie regex; anything fancier is matched
+# with its own re.search as before.
+_SIMPLE_PATTERN_RE = re.compile(r"^\\b\((?P<alternatives>[^()]*)\)\\b$")
+_PLAIN_KEYWORD_RE = re.compile(r"^[\w' -]+$")
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == "_"
+
+
+def _trie_regex(keywords):
+    """
+    Builds a regex for the keywords shaped like a trie, e.g. 'bit(?:coin(?: wallet)?)?'.
+    Greedy optional groups make the longest keyword match first at any position.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def to_regex(node):
+        is_terminal = "" in node
+        branches = [re.escape(char) + to_regex(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if is_terminal:
+            return "(?:" + body + ")?"
+        return body
+
+    return to_regex(trie)
+
+
+class LinkMatcher:
+    """
+    Matches every RESOURCE_LINKS-style topic against a text in one pass.
+    Built once; find_topics() returns the patterns that re.search would match,
+    with the same word-boundary semantics.
+    """
+
+    def __init__(self, links_dict):
+        self.links_dict = links_dict
+        self._topics_by_keyword = {}
+        self._fallback_patterns = []
+
+        for pattern in links_dict:
+            match = _SIMPLE_PATTERN_RE.match(pattern)
+            alternatives = match.group("alternatives").split("|") if match else []
+            if not alternatives or not all(_PLAIN_KEYWORD_RE.match(keyword) for keyword in alternatives):
+                self._fallback_patterns.append((pattern, re.compile(pattern)))
+                continue
+            for keyword in alternatives:
+                self._topics_by_keyword.setdefault(keyword, set()).add(pattern)
+
+        # A keyword that is a prefix of a longer one, ending on a word boundary
+        # inside it, always matches where the longer one does. The lookahead below
+        # only reports the longest keyword per position, so fold the shorter ones in.
+        keywords = sorted(self._topics_by_keyword, key=len)
+        keyword_set = set(keywords)
+        self._implied_topics = {}
+        for keyword in keywords:
+            topics = set(self._topics_by_keyword[keyword])
+            for end in range(1, len(keyword)):
+                if _is_word_char(keyword[end - 1]) != _is_word_char(keyword[end]) and keyword[:end] in keyword_set:
+                    topics |= self._topics_by_keyword[keyword[:end]]
+            self._implied_topics[keyword] = frozenset(topics)
+
+        # Zero-width lookahead so overlapping keywords are all found in one scan
+        self._regex = re.compile(r"(?=\b(" + _trie_regex(keywords) + r")\b)") if keywords else None
+
+    def find_topics(self, lower_text):
+        """Returns the set of patterns (keys of links_dict) that match the lowercased text."""
+        found = set()
+        if self._regex is not None:
+            for match in self._regex.finditer(lower_text):
+                found |= self._implied_topics[match.group(1)]
+        for pattern, compiled in self._fallback_patterns:
+            if compiled.search(lower_text):
+                found.add(pattern)
+        return found
@@ -0,0 +1,754 @@
+"""
+One interface over the LLM providers the chatbot can use, plus a router that
+spreads a request across them.
+
+Backends (create_backend kind):
+  * gemini - google.generativeai GenerativeModel / ChatSession
+  * genai  - google-genai Client
+  * openai - OpenAI chat completions
+  * fake   - canned answers after a configurable delay, for tests and benchmarks
+
+Each backend answers an LLMRequest (prompt plus chat history) with an
+LLMResponse, either in one piece (generate) or as text chunks (stream).
+SDKs are imported when a backend is first used, not at import.
+
+LLMRouter tries the backends in order:
+  * per-backend timeouts: a backend that has not answered (or, streaming,
+    sent its first chunk) in time counts as failed;
+  * failover: on an error or timeout the next backend gets the request;
+  * hedging: once the running attempt is slower than that backend's recent
+    p95 latency, the next backend gets a copy and the first answer wins.
+    Hedges are capped at a fraction of requests so a slow provider does not
+    double the load on the other;
+  * circuit breaking: after repeated failures a backend is skipped for a
+    cool-down, then let through with a single probe request.
+"""
+import contextvars
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT_SECONDS = 60.0
+
+LLM_CALLS = metrics.counter(
+    "bitcoin_chatbot_llm_calls_total", "LLM backend calls by outcome (ok, error, timeout, cancelled).", ["backend", "outcome"])
+LLM_TOKENS = metrics.counter(
+    "bitcoin_chatbot_llm_tokens_total", "Tokens reported by the winning LLM backend's usage data.", ["backend", "kind"])
+LLM_HEDGES = metrics.counter(
+    "bitcoin_chatbot_llm_hedges_total", "Hedged LLM requests sent, and how many of them answered first.", ["outcome"])
+LLM_CIRCUIT_STATE = metrics.gauge(
+    "bitcoin_chatbot_llm_circuit_state", "Circuit breaker state per LLM backend (0 closed, 1 half-open, 2 open).", ["backend"])
+
+
+class LLMTimeout(TimeoutError):
+    """A backend did not answer within its timeout."""
+
+
+class LLMUnavailable(ConnectionError):
+    """No backend could take the request (not configured, or every circuit is open)."""
+
+
+class LLMRequest:
+    """
+    A prompt on top of a chat history (turns as stored by the app:
+    {'type': 'user' | 'bot', 'text': ...}). chat optionally carries a live
+    Gemini ChatSession already holding that history; only the first
+    attempt uses it, hedges and failovers start from the history.
+    """
+
+    def __init__(self, prompt, history=(), chat=None):
+        self.prompt = prompt
+        self.history = history
+        self.chat = chat
+
+    def without_chat(self):
+        return LLMRequest(self.prompt, self.history) if self.chat is not None else self
+
+
+class LLMResponse:
+    """
+    An answer. ok is False for blocked or empty responses, whose text then
+    describes why. chat is the Gemini ChatSession that produced it (with the
+    new turn appended), if any.
+    """
+
+    def __init__(self, text, ok=True, backend=None, prompt_tokens=None, output_tokens=None, chat=None):
+        self.text = text
+        self.ok = ok
+        self.backend = backend
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.chat = chat
+        self.hedged = False # set by LLMRouter when a hedge was sent for this request
+
+    @property
+    def total_tokens(self):
+        if self.prompt_tokens is None and self.output_tokens is None:
+            return None
+        return (self.prompt_tokens or 0) + (self.output_tokens or 0)
+
+
+def describe_blocked(block_reason, finish_reason):
+    return f"Response blocked or incomplete. Reason: {block_reason}. Finish: {finish_reason}. Please try rephrasing."
+
+
+# --- Backends ---
+class LLMBackend:
+    """
+    Interface for one model at one provider. generate() returns an
+    LLMResponse; stream() is a generator of text chunks whose return value
+    is the LLMResponse. Errors propagate as the SDK's exceptions.
+    """
+
+    kind = None
+
+    def __init__(self, name=None, timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+        self.name = name or self.kind
+        self.timeout_seconds = timeout_seconds
+
+    def generate(self, request):
+        raise NotImplementedError
+
+    def stream(self, request):
+        raise NotImplementedError
+
+    def ready(self):
+        """False while the backend cannot take requests (e.g. its model failed to build)."""
+        return True
+
+
+def gemini_contents(history):
+    return [{'role': 'user' if turn['type'] == 'user' else 'model', 'parts': [{'text': turn['text']}]} for turn in history]
+
+
+class GeminiBackend(LLMBackend):
+    """
+    google.generativeai. model_factory(model_name) builds the GenerativeModel
+    (the app passes its own, which handles configure() and context caching);
+    otherwise the SDK is configured with api_key and the model built here.
+    """
+
+    kind = "gemini"
+
+    def __init__(self, name=None, model_name="gemini-2.0-flash-001", system_prompt=None, model_factory=None,
+                 api_key=None, format_history=gemini_contents, timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+        super().__init__(name, timeout_seconds)
+        self.model_name = model_name
+        self.system_prompt = system_prompt
+        self.model_factory = model_factory
+        self.api_key = api_key
+        self.format_history = format_history
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _build_model(self):
+        if self.model_factory is not None:
+            return self.model_factory(self.model_name)
+        import google.generativeai as genai # deferred: the SDK import takes most of a second
+        if self.api_key:
+            genai.configure(api_key=self.api_key)
+        return genai.GenerativeModel(self.model_name, system_instruction=self.system_prompt)
+
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._build_model()
+        if self._model is None:
+            raise LLMUnavailable(f"Gemini model {self.model_name} is not available.")
+        return self._model
+
+    def ready(self):
+        try:
+            return self.model() is not None
+        except Exception:
+            return False
+
+    def _chat(self, request):
+        if request.chat is not None:
+            return request.chat
+        return self.model().start_chat(history=self.format_history(request.history))
+
+    def _result(self, response, text, chat):
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = usage.prompt_token_count if usage else None
+        output_tokens = usage.candidates_token_count if usage else None
+        if not text:
+            block_reason = response.prompt_feedback.block_reason if response.prompt_feedback else "Unknown"
+            finish_reason = response.candidates[0].finish_reason if response.candidates else "N/A"
+            logger.warning("API response incomplete or blocked. Prompt Feedback: %s, Candidates: %s", response.prompt_feedback, response.candidates)
+            return LLMResponse(describe_blocked(block_reason, finish_reason), False, self.name, prompt_tokens, output_tokens)
+        return LLMResponse(text, True, self.name, prompt_tokens, output_tokens, chat=chat)
+
+    def generate(self, request):
+        chat = self._chat(request)
+        response = chat.send_message(request.prompt, request_options={"timeout": self.timeout_seconds})
+        return self._result(response, response.text.strip() if response.parts else "", chat)
+
+    def stream(self, request):
+        chat = self._chat(request)
+        response = chat.send_message(request.prompt, stream=True, request_options={"timeout": self.timeout_seconds})
+        text = ""
+        for chunk in response:
+            if not chunk.parts:
+                continue
+            piece = chunk.text
+            if not text:
+                piece = piece.lstrip()
+            text += piece
+            yield piece
+        return self._result(response, text.strip(), chat)
+
+
+class GenAIBackend(LLMBackend):
+    """google-genai Client, synchronous API."""
+
+    kind = "genai"
+
+    def __init__(self, name=None, model_name="gemini-2.0-flash", system_prompt=None, api_key=None, base_url=None,
+                 timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+        super().__init__(name, timeout_seconds)
+        self.model_name = model_name
+        self.system_prompt = system_prompt
+        self.api_key = api_key
+        self.base_url = base_url
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        """Returns (client, generate config), built on first use."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from google import genai # deferred: the SDK import takes most of a second
+                    from google.genai import types
+                    http_options = {'timeout': int(self.timeout_seconds * 1000)}
+                    if self.base_url:
+                        http_options['base_url'] = self.base_url
+                    config = types.GenerateContentConfig(system_instruction=self.system_prompt) if self.system_prompt else None
+                    self._client = genai.Client(api_key=self.api_key, http_options=http_options), config
+        return self._client
+
+    def _contents(self, request):
+        return gemini_contents(request.history) + [{'role': 'user', 'parts': [{'text': request.prompt}]}]
+
+    def _result(self, response, text):
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = usage.prompt_token_count if usage else None
+        output_tokens = usage.candidates_token_count if usage else None
+        if not text:
+            feedback = response.prompt_feedback
+            block_reason = feedback.block_reason if feedback and feedback.block_reason else "Unknown"
+            finish_reason = response.candidates[0].finish_reason if response.candidates else "N/A"
+            return LLMResponse(describe_blocked(block_reason, finish_reason), False, self.name, prompt_tokens, output_tokens)
+        return LLMResponse(text, True, self.name, prompt_tokens, output_tokens)
+
+    def generate(self, request):
+        client, config = self.client()
+        response = client.models.generate_content(model=self.model_name, contents=self._contents(request), config=config)
+        return self._result(response, (response.text or "").strip())
+
+    def stream(self, request):
+        client, config = self.client()
+        text, last = "", None
+        for chunk in client.models.generate_content_stream(model=self.model_name, contents=self._contents(request), config=config):
+            last = chunk
+            piece = chunk.text
+            if not piece:
+                continue
+            if not text:
+                piece = piece.lstrip()
+            text += piece
+            yield piece
+        return self._result(last, text.strip())
+
+
+class OpenAIBackend(LLMBackend):
+    """OpenAI (or any compatible server via base_url) chat completions."""
+
+    kind = "openai"
+
+    def __init__(self, name=None, model_name="gpt-4o-mini", system_prompt=None, api_key=None, base_url=None,
+                 timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+        super().__init__(name, timeout_seconds)
+        self.model_name = model_name
+        self.system_prompt = system_prompt
+        self.api_key = api_key
+        self.base_url = base_url
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    # Retries and failover are the router's job
+                    self._client = OpenAI(api_key=self.api_key, base_url=self.base_url, timeout=self.timeout_seconds, max_retries=0)
+        return self._client
+
+    def ready(self):
+        return bool(self.api_key)
+
+    def _messages(self, request):
+        messages = [{"role": "system", "content": self.system_prompt}] if self.system_prompt else []
+        messages += [{"role": "user" if turn['type'] == 'user' else "assistant", "content": turn['text']} for turn in request.history]
+        messages.append({"role": "user", "content": request.prompt})
+        return messages
+
+    def _result(self, text, finish_reason, usage):
+        prompt_tokens = usage.prompt_tokens if usage else None
+        output_tokens = usage.completion_tokens if usage else None
+        if not text or finish_reason == "content_filter":
+            return LLMResponse(describe_blocked("Unknown" if text else "Empty response", finish_reason), False, self.name,
+                               prompt_tokens, output_tokens)
+        return LLMResponse(text, True, self.name, prompt_tokens, output_tokens)
+
+    def generate(self, request):
+        completion = self.client().chat.completions.create(model=self.model_name, messages=self._messages(request))
+        choice = completion.choices[0]
+        return self._result((choice.message.content or "").strip(), choice.finish_reason, completion.usage)
+
+    def stream(self, request):
+        events = self.client().chat.completions.create(model=self.model_name, messages=self._messages(request),
+                                                       stream=True, stream_options={"include_usage": True})
+        text, finish_reason, usage = "", None, None
+        for event in events:
+            usage = event.usage or usage
+            if not event.choices:
+                continue
+            finish_reason = event.choices[0].finish_reason or finish_reason
+            piece = event.choices[0].delta.content
+            if not piece:
+                continue
+            if not text:
+                piece = piece.lstrip()
+            text += piece
+            yield piece
+        return self._result(text.strip(), finish_reason, usage)
+
+
+class FakeBackend(LLMBackend):
+    """
+    Answers every prompt with `answer` after latency +/- jitter seconds;
+    error_rate of the calls raise ConnectionError instead. Streams the answer
+    in `chunks` pieces, chunk_interval seconds apart.
+    """
+
+    kind = "fake"
+
+    def __init__(self, name=None, model_name="fake", system_prompt=None, answer="Bitcoin is a decentralized digital currency.",
+                 latency=0.0, jitter=0.0, error_rate=0.0, chunks=4, chunk_interval=0.0, seed=None,
+                 timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+        super().__init__(name, timeout_seconds)
+        self.model_name = model_name
+        self.answer = answer
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunks = chunks
+        self.chunk_interval = chunk_interval
+        self._rng = random.Random(seed)
+        self.calls = 0
+
+    def _respond(self, request):
+        self.calls += 1
+        time.sleep(max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter)))
+        if self._rng.random() < self.error_rate:
+            raise ConnectionError(f"{self.name}: injected failure")
+
+    def _result(self, request):
+        history_chars = sum(len(turn['text']) for turn in request.history)
+        return LLMResponse(self.answer, True, self.name, (len(request.prompt) + history_chars) // 4, len(self.answer) // 4)
+
+    def generate(self, request):
+        self._respond(request)
+        return self._result(request)
+
+    def stream(self, request):
+        self._respond(request)
+        words = self.answer.split(" ")
+        size = max(1, -(-len(words) // self.chunks))
+        for i in range(0, len(words), size):
+            if i:
+                time.sleep(self.chunk_interval)
+            yield " ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+        return self._result(request)
+
+
+BACKEND_KINDS = {backend.kind: backend for backend in (GeminiBackend, GenAIBackend, OpenAIBackend, FakeBackend)}
+
+
+def parse_backend_specs(spec):
+    """'gemini@30,openai:gpt-4o-mini@20' -> [('gemini', None, 30.0), ('openai', 'gpt-4o-mini', 20.0)]."""
+    backends = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        item, _, timeout = item.partition("@")
+        kind, _, model_name = item.partition(":")
+        backends.append((kind.strip().lower(), model_name.strip() or None, float(timeout) if timeout else None))
+    return backends
+
+
+def create_backend(kind, name=None, model_name=None, timeout_seconds=None, **options):
+    """Builds one backend; options go to its constructor (system_prompt, api_key, ...). None for an unknown kind."""
+    backend_class = BACKEND_KINDS.get(kind)
+    if backend_class is None:
+        logger.warning("Unknown LLM backend '%s', skipping it.", kind)
+        return None
+    model_name = model_name or options.pop("model_name", None)
+    if model_name:
+        options["model_name"] = model_name
+    return backend_class(name=name, timeout_seconds=timeout_seconds or DEFAULT_TIMEOUT_SECONDS, **options)
+
+
+def create_llm_router(spec, system_prompt=None, backend_options=None, default_timeout_seconds=DEFAULT_TIMEOUT_SECONDS,
+                      **router_options):
+    """
+    Builds an LLMRouter from an ordered spec ('kind[:model][@timeout_seconds]',
+    comma-separated; the first is the primary). backend_options maps a kind to
+    extra constructor arguments, e.g. {'openai': {'api_key': ...}}.
+    """
+    backends, names = [], set()
+    for kind, model_name, timeout in parse_backend_specs(spec):
+        name = kind if kind not in names else f"{kind}-{len(backends) + 1}"
+        options = dict((backend_options or {}).get(kind, {}))
+        options.setdefault("system_prompt", system_prompt)
+        backend = create_backend(kind, name, model_name or options.pop("model_name", None),
+                                 timeout or default_timeout_seconds, **options)
+        if backend is not None:
+            backends.append(backend)
+            names.add(name)
+    if not backends:
+        raise ValueError(f"No usable LLM backend in '{spec}'.")
+    logger.info("LLM backends: %s.", ", ".join(backend.name for backend in backends))
+    return LLMRouter(backends, **router_options)
+
+
+# --- Router: timeouts, failover, hedging and circuit breaking ---
+class CircuitBreaker:
+    """Closed -> open after failure_threshold consecutive failures -> half-open (one probe) after reset_seconds."""
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN # let exactly this request through as the probe
+                return True
+            return False
+
+    def available(self):
+        """Whether allow() could let a request through, without claiming the probe."""
+        return self.state != self.OPEN or time.monotonic() - self.opened_at >= self.reset_seconds
+
+    def record_success(self):
+        with self._lock:
+            self.state, self.failures = self.CLOSED, 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state, self.opened_at = self.OPEN, time.monotonic()
+
+    def record_cancelled(self):
+        """A call abandoned before its outcome (lost a hedge race, client gone): frees the probe for the next request."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state, self.opened_at = self.OPEN, time.monotonic() - self.reset_seconds
+
+    def state_name(self):
+        return ("closed", "half_open", "open")[self.state]
+
+
+class LatencyWindow:
+    """The last `size` latencies of one backend, for its hedging percentile."""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q, min_samples=20):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _BackendState:
+    def __init__(self, backend, breaker):
+        self.backend = backend
+        self.breaker = breaker
+        self.latencies = LatencyWindow()
+        self.outcomes = dict.fromkeys(("ok", "error", "timeout", "cancelled"), 0)
+        self._lock = threading.Lock()
+
+    def count(self, outcome):
+        with self._lock:
+            self.outcomes[outcome] += 1
+
+    def outcome_counts(self):
+        with self._lock:
+            return dict(self.outcomes)
+
+
+class _Attempt:
+    """One backend working on a request in the router's pool; reports ('chunk' | 'done' | 'error', payload) events."""
+
+    def __init__(self, state, request, streaming, events):
+        self.state = state
+        self.request = request
+        self.streaming = streaming
+        self.events = events
+        self.started = time.monotonic()
+        self.last_event = self.started
+        self.cancelled = threading.Event()
+        self._settled = False
+        self._settle_lock = threading.Lock()
+
+    def settle(self, outcome, seconds=None):
+        """Records the attempt's outcome once (a timed-out attempt may still fail or finish later)."""
+        with self._settle_lock:
+            if self._settled:
+                return
+            self._settled = True
+        state = self.state
+        state.count(outcome)
+        LLM_CALLS.labels(state.backend.name, outcome).inc()
+        if outcome == "ok":
+            state.breaker.record_success()
+            if seconds is not None:
+                state.latencies.add(seconds)
+        elif outcome in ("error", "timeout"):
+            state.breaker.record_failure()
+        else:
+            state.breaker.record_cancelled()
+        LLM_CIRCUIT_STATE.labels(state.backend.name).set(state.breaker.state)
+
+    def run(self):
+        backend = self.state.backend
+        try:
+            with metrics.upstream_call(backend.name):
+                if not self.streaming:
+                    response = backend.generate(self.request)
+                else:
+                    chunks = backend.stream(self.request)
+                    first_chunk = True
+                    try:
+                        while True:
+                            text = next(chunks)
+                            if self.cancelled.is_set():
+                                chunks.close()
+                                self.settle("cancelled")
+                                return
+                            if first_chunk:
+                                # Streams are hedged on time to first chunk, but only succeed once they finish
+                                self.state.latencies.add(time.monotonic() - self.started)
+                                first_chunk = False
+                            self.events.put((self, "chunk", text))
+                    except StopIteration as stop:
+                        response = stop.value
+        except Exception as e:
+            self.settle("cancelled" if self.cancelled.is_set() else "error")
+            self.events.put((self, "error", e))
+            return
+        self.settle("ok", None if self.streaming else time.monotonic() - self.started)
+        self.events.put((self, "done", response))
+
+
+class LLMStream:
+    """Iterates an answer's text chunks; response holds the LLMResponse once iteration finished."""
+
+    def __init__(self, events):
+        self._events = events
+        self.response = None
+
+    def __iter__(self):
+        for kind, payload in self._events:
+            if kind == "chunk":
+                yield payload
+            else:
+                self.response = payload
+
+    def close(self):
+        self._events.close()
+
+
+class LLMRouter:
+    def __init__(self, backends, hedge=True, hedge_percentile=0.95, hedge_delay_seconds=3.0, min_hedge_delay_seconds=0.2,
+                 max_hedge_ratio=0.1, breaker_failures=5, breaker_reset_seconds=30.0, max_workers=64):
+        """
+        hedge_delay_seconds is used until a backend has enough latency samples
+        for its hedge_percentile; max_hedge_ratio caps hedges as a fraction of
+        requests.
+        """
+        self.states = [_BackendState(backend, CircuitBreaker(breaker_failures, breaker_reset_seconds)) for backend in backends]
+        self.hedge = hedge and len(backends) > 1
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay_seconds = hedge_delay_seconds
+        self.min_hedge_delay_seconds = min_hedge_delay_seconds
+        self.max_hedge_ratio = max_hedge_ratio
+        self._hedge_budget = 1.0
+        self._budget_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        for state in self.states:
+            LLM_CIRCUIT_STATE.labels(state.backend.name).set(state.breaker.state)
+
+    @property
+    def backends(self):
+        return [state.backend for state in self.states]
+
+    def generate(self, request):
+        """Returns the first successful LLMResponse; raises the last error (or LLMUnavailable/LLMTimeout)."""
+        for kind, payload in self._race(request, streaming=False):
+            if kind == "done":
+                return payload
+
+    def stream(self, request):
+        """An LLMStream of the winning backend's chunks. Failover and hedging only happen before the first chunk."""
+        return LLMStream(self._race(request, streaming=True))
+
+    def ready(self):
+        # An open circuit due for its probe counts, or nothing would ever reach _race to close it again
+        return any(state.breaker.available() and state.backend.ready() for state in self.states)
+
+    def stats(self):
+        return {
+            state.backend.name: dict(
+                state.outcome_counts(),
+                circuit=state.breaker.state_name(),
+                p95_ms=round(p95 * 1000, 1) if (p95 := state.latencies.percentile(0.95)) is not None else None,
+            )
+            for state in self.states
+        }
+
+    # --- Internals ---
+    def _hedge_delay(self, state):
+        delay = state.latencies.percentile(self.hedge_percentile)
+        return max(self.min_hedge_delay_seconds, delay if delay is not None else self.hedge_delay_seconds)
+
+    def _take_hedge_budget(self):
+        with self._budget_lock:
+            if self._hedge_budget >= 1.0:
+                self._hedge_budget -= 1.0
+                return True
+            return False
+
+    def _start(self, state, request, streaming, events):
+        attempt = _Attempt(state, request, streaming, events)
+        # Run in a copy of this context so upstream stages land in the request's Server-Timing
+        self._executor.submit(contextvars.copy_context().run, attempt.run)
+        return attempt
+
+    def _race(self, request, streaming):
+        """Yields ('chunk', text)... then ('done', LLMResponse) from whichever attempt answers first."""
+        with self._budget_lock:
+            self._hedge_budget = min(10.0, self._hedge_budget + self.max_hedge_ratio)
+        events = queue.Queue()
+        pending = iter(self.states)
+        running, winner, hedge, hedged, last_error = [], None, None, False, None
+
+        def start_next(first=False):
+            for state in pending:
+                if state.breaker.allow():
+                    running.append(self._start(state, request if first else request.without_chat(), streaming, events))
+                    return True
+                logger.info("Skipping LLM backend %s: circuit open.", state.backend.name)
+            return False
+
+        try:
+            if not start_next(first=True):
+                raise LLMUnavailable("Every LLM backend is unavailable (circuits open).")
+            while True:
+                now = time.monotonic()
+                if winner is not None:
+                    wait = winner.last_event + winner.state.backend.timeout_seconds - now
+                else:
+                    wait = min(attempt.started + attempt.state.backend.timeout_seconds for attempt in running) - now
+                    if self.hedge and not hedged:
+                        wait = min(wait, running[0].started + self._hedge_delay(running[0].state) - now)
+                try:
+                    attempt, kind, payload = events.get(timeout=max(0.0, wait))
+                except queue.Empty:
+                    now = time.monotonic()
+                    if winner is not None:
+                        winner.settle("timeout")
+                        raise LLMTimeout(f"{winner.state.backend.name} stopped streaming for {winner.state.backend.timeout_seconds}s.")
+                    for attempt in [a for a in running if now >= a.started + a.state.backend.timeout_seconds]:
+                        logger.warning("LLM backend %s timed out after %ss.", attempt.state.backend.name, attempt.state.backend.timeout_seconds)
+                        attempt.settle("timeout")
+                        attempt.cancelled.set()
+                        running.remove(attempt)
+                        last_error = LLMTimeout(f"{attempt.state.backend.name} did not answer within {attempt.state.backend.timeout_seconds}s.")
+                    if not running:
+                        if not start_next():
+                            raise last_error
+                    elif self.hedge and not hedged and now >= running[0].started + self._hedge_delay(running[0].state):
+                        hedged = True
+                        if self._take_hedge_budget() and start_next():
+                            hedge = running[-1]
+                            LLM_HEDGES.labels("sent").inc()
+                            logger.info("Hedging slow LLM call to %s.", hedge.state.backend.name)
+                    continue
+
+                if attempt not in running:
+                    continue # a cancelled or timed-out attempt reporting late
+                if kind == "error":
+                    running.remove(attempt)
+                    last_error = payload
+                    logger.warning("LLM backend %s failed: %s", attempt.state.backend.name, payload)
+                    if attempt is winner:
+                        raise payload
+                    if not running and not start_next():
+                        raise last_error
+                    continue
+
+                if winner is None:
+                    winner = attempt
+                    for other in running:
+                        if other is not attempt:
+                            other.cancelled.set()
+                            other.settle("cancelled")
+                    running[:] = [attempt]
+                    if attempt is hedge:
+                        LLM_HEDGES.labels("won").inc()
+                attempt.last_event = time.monotonic()
+                if kind == "chunk":
+                    yield "chunk", payload
+                    continue
+                payload.hedged = hedge is not None
+                LLM_TOKENS.labels(payload.backend, "prompt").inc(payload.prompt_tokens or 0)
+                LLM_TOKENS.labels(payload.backend, "output").inc(payload.output_tokens or 0)
+                yield "done", payload
+                return
+        finally:
+            # The stream closed early (client gone) or every attempt failed: stop whatever is still running
+            for attempt in running:
+                attempt.cancelled.set()
+                attempt.settle("cancelled")
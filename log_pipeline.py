@@ -0,0 +1,268 @@
+"""
+Logging that stays off the request path.
+
+configure_logging() replaces the root logger's handlers with:
+  * a QueueHandler in front: the logging thread only snapshots the record
+    (merging its %-args into the message) and enqueues it; a writer thread
+    formats whatever has queued up and writes it in one go. The queue is
+    bounded, and when the writer cannot keep up records are dropped and
+    counted rather than blocking;
+  * the current request ID on every record (set_request_id, once per
+    request; contextvars carry it into worker threads);
+  * sampling: a record logged with extra={"sample": "<key>"} is kept at the
+    configured rate for that key. The decision hashes the request ID, so one
+    request's sampled lines are kept or dropped together;
+  * text lines (the previous format plus the request ID) or one JSON object
+    per line.
+
+Log calls use lazy %-formatting (logger.info("User Question: %s", question)),
+so a disabled level costs one level check and no string building.
+
+skip_caller_info=True additionally turns off the caller lookup (file, line,
+function) and the multiprocessing lookup for every logger in the process,
+through the logging module's private _srcfile and its logMultiprocessing
+flag. Neither format prints them, and the stack walk is most of the cost of
+creating a record, but any other handler that prints %(pathname)s,
+%(lineno)d, %(funcName)s or %(processName)s then shows placeholders. It is
+off by default.
+
+benchmarks/bench_logging.py measures the cost per request.
+"""
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import uuid
+import zlib
+from logging.handlers import QueueHandler
+
+import metrics
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+# LogRecord attributes that are not user-supplied extras (those go into JSON records as fields)
+_STANDARD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id", "sample"}
+
+LOG_RECORDS_DROPPED = metrics.counter(
+    "bitcoin_chatbot_log_records_dropped_total", "Log records dropped because the log queue was full.")
+LOG_RECORDS_SAMPLED_OUT = metrics.counter(
+    "bitcoin_chatbot_log_records_sampled_out_total", "Log records skipped by sampling, by sample key.", ["sample"])
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+WRITE_BATCH_RECORDS = 512
+_exception_formatter = logging.Formatter()
+_queue_handler = None
+_DEFAULT_CALLER_INFO = (logging._srcfile, logging.logMultiprocessing)
+_writer = None
+
+
+# --- Request IDs ---
+def set_request_id(request_id=None):
+    """Sets the current request's ID (a new one if None) and returns it."""
+    request_id = request_id or uuid.uuid4().hex[:16]
+    _request_id.set(request_id)
+    return request_id
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+def clean_request_id(value):
+    """A client-supplied X-Request-ID if it is short, printable ASCII; otherwise None (a new ID is generated)."""
+    if value and len(value) <= 64 and value.isascii() and value.isprintable() and " " not in value:
+        return value
+    return None
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps record.request_id ('-' outside a request)."""
+
+    def filter(self, record):
+        record.request_id = _request_id.get() or "-"
+        return True
+
+
+# --- Sampling ---
+def parse_sample_rates(spec):
+    """'question=0.1,request=0.5' -> {'question': 0.1, 'request': 0.5}."""
+    rates = {}
+    for item in (spec or "").split(","):
+        key, _, rate = item.partition("=")
+        if key.strip() and rate.strip():
+            rates[key.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps records tagged extra={"sample": key} at rates[key]; untagged records and unknown keys always pass."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        rate = self.rates.get(key, 1.0) if key is not None else 1.0
+        if rate >= 1.0:
+            return True
+        request_id = getattr(record, "request_id", "-")
+        point = zlib.crc32(request_id.encode()) / 0xFFFFFFFF if request_id != "-" else random.random()
+        if point < rate:
+            return True
+        LOG_RECORDS_SAMPLED_OUT.labels(key).inc()
+        return False
+
+
+# --- Formatting and the queue ---
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, message, request_id, extras and any exception."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class OffloadingQueueHandler(QueueHandler):
+    """
+    Enqueues the record without formatting it. The queue is an unbounded
+    SimpleQueue (no locking on put) kept under maxsize by an approximate
+    check; records over it are dropped and counted.
+    """
+
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.SimpleQueue())
+        self.maxsize = maxsize
+
+    def prepare(self, record):
+        # Args may change after the call returns and tracebacks hold frames, so resolve both now;
+        # timestamps, formatting and JSON encoding are left to the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.maxsize:
+            LOG_RECORDS_DROPPED.inc()
+            return
+        self.queue.put(record)
+
+
+class LogWriter(threading.Thread):
+    """Drains the queue in batches: formats each record with output's formatter, then one write and flush per batch."""
+
+    _STOP = object()
+
+    def __init__(self, records, output):
+        super().__init__(name="log-writer", daemon=True)
+        self.records = records
+        self.output = output
+
+    def run(self):
+        while True:
+            batch = [self.records.get()]
+            while batch[-1] is not self._STOP and len(batch) < WRITE_BATCH_RECORDS and not self.records.empty():
+                batch.append(self.records.get())
+            stopping = batch[-1] is self._STOP
+            lines = []
+            for record in batch:
+                if record is self._STOP or record.levelno < self.output.level:
+                    continue
+                try:
+                    lines.append(self.output.format(record))
+                except Exception:
+                    self.output.handleError(record)
+            if lines:
+                try:
+                    self.output.stream.write("\n".join(lines) + "\n")
+                    self.output.stream.flush()
+                except Exception:
+                    self.output.handleError(batch[0])
+            if stopping:
+                return
+
+    def stop(self, timeout=5.0):
+        self.records.put(self._STOP)
+        self.join(timeout)
+
+
+def _start_writer(output):
+    global _writer
+    _writer = LogWriter(_queue_handler.queue, output)
+    _writer.start()
+
+
+def _restart_after_fork():
+    # The writer thread does not survive fork (e.g. gunicorn workers after a preloading master);
+    # the child gets a fresh queue, leaving records the parent had queued to the parent
+    if _writer is not None:
+        _queue_handler.queue = queue.SimpleQueue()
+        _start_writer(_writer.output)
+
+
+def stop_logging():
+    """Writes out what is still queued and stops the writer thread."""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+def _set_caller_info(enabled):
+    """Restores the logging module's defaults, or turns both lookups off."""
+    logging._srcfile, logging.logMultiprocessing = _DEFAULT_CALLER_INFO if enabled else (None, False)
+
+
+def configure_logging(level=logging.INFO, fmt="text", use_queue=True, queue_size=10000, sample_rates=None, stream=None,
+                      skip_caller_info=False):
+    """
+    Installs the pipeline on the root logger, replacing its handlers.
+    fmt is "text" or "json"; without use_queue, records are written
+    synchronously by the logging thread (the sampling and request IDs still apply).
+    skip_caller_info is process-wide; see the module docstring.
+    """
+    global _queue_handler
+    stop_logging()
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    _set_caller_info(not skip_caller_info)
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    front = OffloadingQueueHandler(queue_size) if use_queue else output
+    front.addFilter(RequestIdFilter())
+    if sample_rates:
+        front.addFilter(SamplingFilter(sample_rates))
+    root.addHandler(front)
+
+    if use_queue:
+        first_time = _queue_handler is None
+        _queue_handler = front
+        _start_writer(output)
+        if first_time:
+            os.register_at_fork(after_in_child=_restart_after_fork)
+            atexit.register(stop_logging)
+    return front
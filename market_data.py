@@ -0,0 +1,569 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from price_history import PriceHistory, map_private_file
+
+try:
+    import fcntl # POSIX only; without it single-flight is per process
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def _private_state_dir():
+    """
+    Directory for the files this user's workers share: MARKET_DATA_DIR if
+    set, else a subdirectory of $XDG_RUNTIME_DIR, else a fresh mkdtemp
+    directory. The mkdtemp path is exported as MARKET_DATA_DIR so processes
+    forked or spawned from here share it, and the creating process removes
+    it on exit.
+    """
+    configured = os.getenv("MARKET_DATA_DIR")
+    if configured:
+        return configured
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        path = os.path.join(runtime_dir, "bitcoin_chatbot")
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        return path
+    path = tempfile.mkdtemp(prefix="bitcoin_chatbot-")
+    os.environ["MARKET_DATA_DIR"] = path
+    creator = os.getpid()
+    # Forked workers inherit this handler; only the process that made the directory removes it
+    atexit.register(lambda: os.getpid() == creator and shutil.rmtree(path, ignore_errors=True))
+    return path
+
+
+# --- Configuration ---
+# Overridable so load tests can point at a local stand-in (benchmarks/fake_servers.py)
+COINGECKO_API_BASE_URL = os.getenv("COINGECKO_API_BASE_URL", "https://api.coingecko.com/api/v3").rstrip("/")
+COINGECKO_PRICE_URL = f"{COINGECKO_API_BASE_URL}/simple/price"
+# Fetched together in one simple/price call; bitcoin in USD always comes first (it drives the data block)
+MARKET_DATA_ASSETS = list(dict.fromkeys(["bitcoin"] + [a.strip() for a in os.getenv("MARKET_DATA_ASSETS", "").split(",") if a.strip()]))
+MARKET_DATA_CURRENCIES = list(dict.fromkeys(["usd"] + [c.strip().lower() for c in os.getenv("MARKET_DATA_CURRENCIES", "").split(",") if c.strip()]))
+# Keep-alive connections per host in the pooled session
+HTTP_POOL_SIZE = int(os.getenv("MARKET_DATA_HTTP_POOL_SIZE", "4"))
+CACHE_DURATION_SECONDS = 300
+# Refresh this long before the snapshot goes stale, so requests never see an expired cache
+REFRESH_MARGIN_SECONDS = int(os.getenv("MARKET_DATA_REFRESH_MARGIN_SECONDS", "60"))
+# After a failed refresh, wait this long before trying again
+RETRY_INTERVAL_SECONDS = int(os.getenv("MARKET_DATA_RETRY_SECONDS", "30"))
+FETCH_TIMEOUT_SECONDS = 10
+# Every worker on the host maps the same file, so one fetch serves all of them. The default lives
+# in a directory only this user can write, never at a predictable name in the shared temp dir.
+SNAPSHOT_PATH = os.getenv("MARKET_DATA_SNAPSHOT_PATH") or os.path.join(_private_state_dir(), "market_data.snapshot")
+SNAPSHOT_SIZE_BYTES = 64 * 1024
+# Price time series (see price_history.py): one row per refresh, ~11 days at the default refresh interval
+PRICE_HISTORY_PATH = os.getenv("MARKET_DATA_HISTORY_PATH", SNAPSHOT_PATH + ".history")
+PRICE_HISTORY_CAPACITY = int(os.getenv("MARKET_DATA_HISTORY_CAPACITY", "4096"))
+# Seed an empty history from CoinGecko's market_chart once, so 7d figures are there from the start
+PRICE_HISTORY_BACKFILL = os.getenv("MARKET_DATA_HISTORY_BACKFILL", "true").lower() in ("1", "true", "yes")
+PRICE_CHANGE_WINDOWS = (("24h", 24 * 3600), ("7d", 7 * 24 * 3600))
+
+# Error kinds recorded in the snapshot, mapped to the messages the request path reports
+STALE_FALLBACK_MESSAGES = {
+    'parsing': "Using stale data due to parsing error.",
+    'fetch': "Using stale data due to fetch error.",
+    'unexpected': "Using stale data due to unexpected error.",
+}
+NO_DATA_MESSAGES = {
+    'parsing': "Could not fetch real-time data due to an API response format issue.",
+    'fetch': "Could not fetch real-time data due to an API error.",
+    'unexpected': "Could not fetch real-time data due to an unexpected error.",
+}
+
+
+# hit: fresh snapshot; stale: expired or kept after a failed refresh; miss: no data to serve
+MARKET_DATA_READS = metrics.counter(
+    "bitcoin_chatbot_market_data_reads_total", "Market-data reads on the request path by cache result.", ["result"])
+
+
+class MarketDataError(Exception):
+    """A failed CoinGecko refresh; kind is 'parsing', 'fetch' or 'unexpected'."""
+
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+# --- Formatting of the data block shown to the model ---
+def format_price_changes(price_changes):
+    """Data-block lines for the {'24h': window_stats, ...} computed from the local price history."""
+    lines = ""
+    for label, stats in price_changes.items():
+        sign = "+" if stats['change'] >= 0 else "-"
+        lines += (f"{label} Change (USD): {stats['change_pct']:+.2f}% ({sign}${abs(stats['change']):,.2f}), "
+                  f"Low ${stats['low']:,.2f}, High ${stats['high']:,.2f}")
+        if not stats['complete']:
+            lines += f" (partial: history since {time.strftime('%Y-%m-%d %H:%M UTC', time.gmtime(stats['since']))})"
+        lines += "\n"
+    return lines
+
+
+def format_bitcoin_data(btc_data, price_changes=None):
+    price = btc_data.get('usd')
+    market_cap = btc_data.get('usd_market_cap')
+    volume_24h = btc_data.get('usd_24h_vol')
+    last_updated_unix = btc_data.get('last_updated_at')
+
+    last_updated_readable = "N/A"
+    if last_updated_unix:
+         try:
+            last_updated_readable = time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(last_updated_unix))
+         except Exception:
+             logger.warning("Failed to format last updated timestamp.")
+
+    formatted_data_string = "--- RECENT BITCOIN DATA ---\n"
+    formatted_data_string += f"Current Price (USD): ${price:,.2f}\n" if price is not None else "Current Price (USD): N/A\n"
+    formatted_data_string += f"Market Cap (USD): ${market_cap:,.2f}\n" if market_cap is not None else "Market Cap (USD): N/A\n"
+    formatted_data_string += f"24h Volume (USD): ${volume_24h:,.2f}\n" if volume_24h is not None else "24h Volume (USD): N/A\n"
+    for currency in MARKET_DATA_CURRENCIES[1:]:
+        if btc_data.get(currency) is not None:
+            formatted_data_string += f"Current Price ({currency.upper()}): {btc_data[currency]:,.2f} {currency.upper()}\n"
+    formatted_data_string += format_price_changes(price_changes or {})
+    formatted_data_string += f"Last Updated (UTC): {last_updated_readable}\n"
+    formatted_data_string += "--------------------------\n\n"
+    return formatted_data_string
+
+
+# --- Pooled HTTP session ---
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    """Keep-alive requests.Session for CoinGecko, one per process (forked workers must not share sockets)."""
+    global _session, _session_pid
+    if _session_pid != os.getpid():
+        with _session_lock:
+            if _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers["Accept"] = "application/json"
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def simple_price_params(assets=None, currencies=None):
+    """Query for one batched simple/price call covering every asset and currency."""
+    return {
+        "ids": ",".join(assets or MARKET_DATA_ASSETS),
+        "vs_currencies": ",".join(currencies or MARKET_DATA_CURRENCIES),
+        "include_market_cap": "true",
+        "include_24hr_vol": "true",
+        "include_last_updated_at": "true",
+    }
+
+
+def fetch_simple_prices(assets=None, currencies=None):
+    """One simple/price call over the pooled session; returns the decoded JSON or raises requests exceptions."""
+    with metrics.upstream_call("coingecko"):
+        response = http_session().get(COINGECKO_PRICE_URL, params=simple_price_params(assets, currencies),
+                                      timeout=FETCH_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return response.json()
+
+
+# --- Network fetch (only ever called from a refresher, never on the request path) ---
+def fetch_bitcoin_data():
+    """Fetches CoinGecko data; returns (formatted_string, raw_data) or raises MarketDataError."""
+    logger.info("Fetching fresh data from CoinGecko...")
+    try:
+        data = fetch_simple_prices()
+    except requests.exceptions.RequestException as e:
+        logger.exception("Error fetching Bitcoin data from CoinGecko:")
+        raise MarketDataError('fetch', f"Request Error: {e}")
+    except Exception as e:
+        logger.exception("An unexpected error occurred fetching Bitcoin data:")
+        raise MarketDataError('unexpected', f"Unexpected Error: {e}")
+    return parse_bitcoin_data(data)
+
+
+async def fetch_bitcoin_data_async(client):
+    """Async variant of fetch_bitcoin_data using a shared httpx.AsyncClient."""
+    import httpx
+
+    logger.info("Fetching fresh data from CoinGecko (async)...")
+    try:
+        with metrics.upstream_call("coingecko"):
+            response = await client.get(COINGECKO_PRICE_URL, params=simple_price_params(), timeout=FETCH_TIMEOUT_SECONDS)
+            response.raise_for_status()
+            data = response.json()
+    except httpx.HTTPError as e:
+        logger.exception("Error fetching Bitcoin data from CoinGecko:")
+        raise MarketDataError('fetch', f"Request Error: {e}")
+    except Exception as e:
+        logger.exception("An unexpected error occurred fetching Bitcoin data:")
+        raise MarketDataError('unexpected', f"Unexpected Error: {e}")
+    return parse_bitcoin_data(data)
+
+
+def parse_bitcoin_data(data):
+    """Validates a CoinGecko response; returns (formatted_string, raw_data) or raises MarketDataError."""
+    if 'bitcoin' not in data or 'usd' not in data['bitcoin']:
+        fetch_error = "Could not parse Bitcoin data from CoinGecko API response."
+        logger.error(fetch_error)
+        raise MarketDataError('parsing', fetch_error)
+
+    try:
+        return format_bitcoin_data(data['bitcoin']), data
+    except Exception as e:
+        logger.exception("An unexpected error occurred formatting Bitcoin data:")
+        raise MarketDataError('unexpected', f"Unexpected Error: {e}")
+
+
+# --- Snapshot shared between processes through a memory-mapped file ---
+class SharedSnapshot:
+    """
+    JSON snapshot in a memory-mapped file, guarded by a seqlock.
+    Only the process holding the refresh lock writes; readers never block
+    and retry if they catch a write in progress. Decoded snapshots are
+    cached per process by sequence number.
+    """
+
+    # sequence number (odd while a write is in progress), payload length
+    HEADER = struct.Struct("<QQ")
+
+    def __init__(self, path=SNAPSHOT_PATH, size=SNAPSHOT_SIZE_BYTES):
+        self.path = path
+        self.size = size
+        self._mmap = None
+        self._local_lock = threading.Lock()
+        self._cached_seq = None
+        self._cached_value = None
+
+    def _map(self):
+        if self._mmap is None:
+            self._mmap = map_private_file(self.path, self.size)
+        return self._mmap
+
+    def read(self):
+        """Returns the current snapshot dict, or None if nothing was written yet."""
+        buf = self._map()
+        for _ in range(100):
+            seq, length = self.HEADER.unpack_from(buf, 0)
+            if seq % 2:
+                time.sleep(0.0001)
+                continue
+            if seq == self._cached_seq:
+                return self._cached_value
+            payload = buf[self.HEADER.size:self.HEADER.size + length]
+            if self.HEADER.unpack_from(buf, 0)[0] != seq:
+                continue
+            value = json.loads(payload) if length else None
+            self._cached_seq, self._cached_value = seq, value
+            return value
+        logger.warning("Gave up reading market-data snapshot after repeated concurrent writes.")
+        return self._cached_value
+
+    def write(self, value):
+        payload = json.dumps(value).encode("utf-8")
+        if self.HEADER.size + len(payload) > self.size:
+            raise ValueError(f"Market-data snapshot of {len(payload)} bytes exceeds {self.size} bytes.")
+        buf = self._map()
+        seq = self.HEADER.unpack_from(buf, 0)[0]
+        self.HEADER.pack_into(buf, 0, seq + 1, 0)
+        buf[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+        self.HEADER.pack_into(buf, 0, seq + 2, len(payload))
+
+    @contextmanager
+    def refresh_lock(self):
+        """Non-blocking single-flight lock across threads and processes; yields whether it was acquired."""
+        if not self._local_lock.acquire(blocking=False):
+            yield False
+            return
+        try:
+            if fcntl is None:
+                yield True
+                return
+            fd = os.open(self.path + ".lock", os.O_WRONLY | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600)
+            with os.fdopen(fd, "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    yield False
+                    return
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            self._local_lock.release()
+
+
+snapshot = SharedSnapshot()
+price_history = PriceHistory(
+    PRICE_HISTORY_PATH,
+    [f"{asset}/{currency}" for asset in MARKET_DATA_ASSETS for currency in MARKET_DATA_CURRENCIES],
+    capacity=PRICE_HISTORY_CAPACITY,
+)
+
+
+# --- Price history (written by the refresher under the refresh lock) ---
+_backfill_attempted = False
+
+
+def backfill_price_history(days=7):
+    """
+    Seeds an empty history from CoinGecko's market_chart (hourly points, one
+    call per series), aligned on the first series' timestamps. Returns the
+    number of rows added.
+    """
+    grid, columns = None, []
+    for series in price_history.series:
+        asset, currency = series.split("/")
+        with metrics.upstream_call("coingecko"):
+            response = http_session().get(f"{COINGECKO_API_BASE_URL}/coins/{asset}/market_chart",
+                                          params={"vs_currency": currency, "days": days},
+                                          timeout=FETCH_TIMEOUT_SECONDS)
+            response.raise_for_status()
+            points = np.asarray(response.json().get("prices") or [], dtype=np.float64).reshape(-1, 2)
+        if grid is None:
+            grid = points[:, 0] / 1000
+        if len(points):
+            columns.append(np.interp(grid, points[:, 0] / 1000, points[:, 1], left=np.nan, right=np.nan))
+        else:
+            columns.append(np.full(len(grid), np.nan))
+    if grid is None or not len(grid):
+        return 0
+    return price_history.extend(grid, np.column_stack(columns))
+
+
+def backfill_if_needed():
+    """Backfills once per process while the history is (nearly) empty; failures only cost the 7d figures."""
+    global _backfill_attempted
+    if not PRICE_HISTORY_BACKFILL or _backfill_attempted or len(price_history) >= 2:
+        return
+    _backfill_attempted = True
+    try:
+        added = backfill_price_history()
+        logger.info("Backfilled price history with %d points from CoinGecko market_chart.", added)
+    except Exception:
+        logger.exception("Price history backfill failed; 24h/7d changes will build up from live refreshes:")
+
+
+def price_changes(series="bitcoin/usd", now=None):
+    """{'24h': window_stats, '7d': ...} for the series, from the local history only."""
+    changes = {}
+    for label, seconds in PRICE_CHANGE_WINDOWS:
+        stats = price_history.window_stats(series, seconds, now)
+        if stats is not None:
+            changes[label] = stats
+    return changes
+
+
+def _record_price_history(raw_data, fetched_at):
+    """Appends a successful fetch to the history; returns the price changes for the data block."""
+    try:
+        price_history.append(fetched_at, {
+            f"{asset}/{currency}": (raw_data.get(asset) or {}).get(currency)
+            for asset in MARKET_DATA_ASSETS for currency in MARKET_DATA_CURRENCIES
+        })
+        return price_changes(now=fetched_at)
+    except Exception:
+        logger.exception("Could not update the price history:")
+        return {}
+
+
+# --- Background refresher ---
+def _next_refresh_at(current):
+    if not current:
+        return 0
+    if current.get('error'):
+        return current['attempted_at'] + RETRY_INTERVAL_SECONDS
+    return current['fetched_at'] + CACHE_DURATION_SECONDS - REFRESH_MARGIN_SECONDS
+
+
+def _publish_refresh(current, attempted_at, result=None, error=None):
+    updated = dict(current or {})
+    updated['attempted_at'] = attempted_at
+    if error is None:
+        formatted_string, raw_data = result
+        changes = _record_price_history(raw_data, attempted_at)
+        if changes:
+            formatted_string = format_bitcoin_data(raw_data['bitcoin'], changes)
+        updated.update(formatted_string=formatted_string, raw_data=raw_data, fetched_at=attempted_at, error=None)
+        logger.info("Successfully fetched and cached new CoinGecko data.")
+    else:
+        updated['error'] = {'kind': error.kind, 'message': str(error)}
+    snapshot.write(updated)
+
+
+def refresh_if_due():
+    """Refreshes the shared snapshot if it is due and no other worker is already doing so."""
+    with snapshot.refresh_lock() as acquired:
+        if not acquired:
+            return False
+        # Another worker may have refreshed while we were waiting for the lock
+        current = snapshot.read()
+        if time.time() < _next_refresh_at(current):
+            return False
+
+        backfill_if_needed()
+        attempted_at = time.time()
+        try:
+            _publish_refresh(current, attempted_at, result=fetch_bitcoin_data())
+        except MarketDataError as e:
+            _publish_refresh(current, attempted_at, error=e)
+        return True
+
+
+async def refresh_if_due_async(client):
+    """refresh_if_due for an event loop; the lock is non-blocking, so it never stalls the loop."""
+    with snapshot.refresh_lock() as acquired:
+        if not acquired:
+            return False
+        current = snapshot.read()
+        if time.time() < _next_refresh_at(current):
+            return False
+
+        await asyncio.to_thread(backfill_if_needed)
+        attempted_at = time.time()
+        # Publishing writes the price history and the mmap snapshot, so it runs off the loop like the fetch
+        try:
+            result = await fetch_bitcoin_data_async(client)
+        except MarketDataError as e:
+            await asyncio.to_thread(_publish_refresh, current, attempted_at, error=e)
+        else:
+            await asyncio.to_thread(_publish_refresh, current, attempted_at, result=result)
+        return True
+
+
+_refresher_pid = None
+_refresher_lock = threading.Lock()
+_refresher_wakeup = threading.Event()
+
+
+def _refresher_loop():
+    while True:
+        try:
+            refresh_if_due()
+            delay = _next_refresh_at(snapshot.read()) - time.time()
+        except Exception:
+            logger.exception("Market-data refresher iteration failed:")
+            delay = RETRY_INTERVAL_SECONDS
+        # Poll at least every few seconds so another worker's refresh is picked up
+        _refresher_wakeup.wait(timeout=min(max(delay, 1), 5))
+        _refresher_wakeup.clear()
+
+
+def ensure_refresher_started():
+    """
+    Starts the refresher thread once per process. Called from startup hooks
+    (app.start_background_tasks, in each forked gunicorn worker under
+    preload; the interactive CLI), never from the read path.
+    """
+    global _refresher_pid
+    if _refresher_pid == os.getpid():
+        return
+    with _refresher_lock:
+        if _refresher_pid == os.getpid():
+            return
+        threading.Thread(target=_refresher_loop, name="market-data-refresher", daemon=True).start()
+        _refresher_pid = os.getpid()
+        logger.info("Started market-data refresher thread.")
+
+
+def claim_refresher():
+    """
+    Marks this process as refreshed by an async task (see run_async_refresher),
+    so ensure_refresher_started() does not also start the thread.
+    """
+    global _refresher_pid
+    with _refresher_lock:
+        _refresher_pid = os.getpid()
+
+
+async def run_async_refresher(client):
+    """Event-loop counterpart of the refresher thread; run it as a task for the server's lifetime."""
+    claim_refresher()
+    logger.info("Started async market-data refresher task.")
+    while True:
+        try:
+            await refresh_if_due_async(client)
+            delay = _next_refresh_at(snapshot.read()) - time.time()
+        except Exception:
+            logger.exception("Async market-data refresher iteration failed:")
+            delay = RETRY_INTERVAL_SECONDS
+        await asyncio.sleep(min(max(delay, 1), 5))
+
+
+# --- Request-path accessors (never touch the network) ---
+def get_bitcoin_data():
+    """Returns (formatted_data_string, fetch_error) from the shared snapshot."""
+    with metrics.stage("market_data"):
+        formatted_string, fetch_error, result = _read_bitcoin_data()
+    MARKET_DATA_READS.labels(result).inc()
+    return formatted_string, fetch_error
+
+
+def _read_bitcoin_data():
+    current = snapshot.read()
+
+    if not current or not current.get('formatted_string'):
+        error = (current or {}).get('error')
+        if error:
+            return NO_DATA_MESSAGES[error['kind']], error['message'], "miss"
+        _refresher_wakeup.set()
+        return "Could not fetch real-time data yet.", "Market data is still loading.", "miss"
+
+    if time.time() - current['fetched_at'] < CACHE_DURATION_SECONDS:
+        logger.debug("Using cached data for CoinGecko.")
+        return current['formatted_string'], None, "hit"
+
+    error = current.get('error')
+    if error:
+        logger.warning("Falling back to stale cached data after %s error.", error['kind'])
+        return current['formatted_string'], STALE_FALLBACK_MESSAGES[error['kind']], "stale"
+    # Expired without a recorded failure: a refresh is pending, serve what we have
+    _refresher_wakeup.set()
+    return current['formatted_string'], None, "stale"
+
+
+def build_data_block():
+    """Formats the (cached) market data as the block that heads every prompt (web app and CLI)."""
+    realtime_data_string, fetch_error = get_bitcoin_data()
+
+    data_block_for_prompt = "--- RECENT BITCOIN DATA ---\n"
+    if fetch_error:
+         data_block_for_prompt += f"Data Fetch Status: ERROR - {fetch_error}\n"
+         logger.warning("Data fetch error included in prompt: %s", fetch_error)
+    else:
+         data_block_for_prompt += realtime_data_string.replace("--- RECENT BITCOIN DATA ---\n", "")
+
+    data_block_for_prompt += "--------------------------\n\n"
+    return data_block_for_prompt
+
+
+def get_raw_bitcoin_data():
+    """
+    Returns (CoinGecko 'bitcoin' dict or None, fetch_error) under the same
+    freshness rules as get_bitcoin_data, for callers that need the numbers.
+    """
+    _, fetch_error = get_bitcoin_data()
+    raw_data = (snapshot.read() or {}).get('raw_data') or {}
+    return raw_data.get('bitcoin'), fetch_error
+
+
+def get_data_version():
+    """Timestamp of the last successful refresh; changes whenever the data does."""
+    current = snapshot.read()
+    return int(current['fetched_at']) if current and current.get('fetched_at') else 0
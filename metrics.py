@@ -0,0 +1,309 @@
+"""
+Lightweight in-process metrics: counters, gauges and histograms rendered in
+the Prometheus text format, plus per-request stage timings for the
+Server-Timing header.
+
+Recording is a dict lookup, a bisect and a short lock, so it can stay on
+the hot path. Each process keeps its own numbers; under gunicorn every
+worker reports its own series on /metrics (scrape them through the load
+balancer and aggregate, or run one worker per scrape target).
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers local stages (sub-millisecond) through slow LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Characters of prompt or answer text
+SIZE_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class _HistogramChild:
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self.bounds = bounds
+        self.bucket_counts = [0] * (len(bounds) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Metric:
+    """A named metric family; labels(...) returns the child series for a set of label values."""
+
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self):
+        """Yields (suffix, label values, extra labels, value) for the exposition format."""
+        for values, child in sorted(self._children.items()):
+            yield "", values, (), child.value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, child in sorted(self._children.items()):
+            with child._lock:
+                bucket_counts, total, count = list(child.bucket_counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.bounds + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                yield "_bucket", values, (("le", _format_value(float(bound))),), cumulative
+            yield "_sum", values, (), total
+            yield "_count", values, (), count
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        """Returns the already registered metric of that name (module reloads), else registers this one."""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} is already registered with a different type or labels.")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name, help_text, labelnames=()):
+    return REGISTRY.register(Counter(name, help_text, labelnames))
+
+
+def gauge(name, help_text, labelnames=()):
+    return REGISTRY.register(Gauge(name, help_text, labelnames))
+
+
+def histogram(name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, help_text, labelnames, buckets))
+
+
+def render():
+    return REGISTRY.render()
+
+
+# --- Per-request stage timings (Server-Timing) ---
+STAGE_SECONDS = histogram(
+    "bitcoin_chatbot_stage_duration_seconds", "Time spent per request-processing stage.", ["stage"])
+UPSTREAM_REQUESTS = counter(
+    "bitcoin_chatbot_upstream_requests_total", "Calls to upstream services by outcome.", ["upstream", "outcome"])
+UPSTREAM_SECONDS = histogram(
+    "bitcoin_chatbot_upstream_duration_seconds", "Latency of upstream calls.", ["upstream"])
+UPSTREAM_IN_FLIGHT = gauge(
+    "bitcoin_chatbot_upstream_in_flight", "Upstream calls currently in progress.", ["upstream"])
+
+_current_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Stage durations of one request; repeated stages add up."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing_header(self):
+        entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(entries)
+
+
+def start_request():
+    """Begins collecting stage timings for the current request (thread or task)."""
+    timings = RequestTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+def current_request():
+    """The RequestTimings being collected, or None outside a request."""
+    return _current_timings.get()
+
+
+def resume_request(timings):
+    """Continues collecting into timings, e.g. in a streamed body that runs after the request's teardown."""
+    _current_timings.set(timings)
+
+
+def end_request():
+    _current_timings.set(None)
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.labels(name).observe(seconds)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+@contextmanager
+def upstream_call(upstream):
+    """Times a call to an upstream service; it also counts as a stage of the same name."""
+    in_flight = UPSTREAM_IN_FLIGHT.labels(upstream)
+    in_flight.inc()
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        seconds = time.perf_counter() - start
+        in_flight.dec()
+        UPSTREAM_REQUESTS.labels(upstream, outcome).inc()
+        UPSTREAM_SECONDS.labels(upstream).observe(seconds)
+        record_stage(upstream, seconds)
+
+
+# --- Startup timings (startup report on /readyz) ---
+STARTUP_SECONDS = gauge(
+    "bitcoin_chatbot_startup_step_seconds", "Time spent in each startup step of this process.", ["step"])
+startup_timings = {} # step -> seconds, in the order the steps ran
+
+
+def record_startup_step(name, seconds):
+    startup_timings[name] = seconds
+    STARTUP_SECONDS.labels(name).set(seconds)
+
+
+@contextmanager
+def startup_step(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup_step(name, time.perf_counter() - start)
@@ -1,10 +1,10 @@
 ## FILE: backend/price.py
-import requests
+import market_data
 
 def get_btc_price():
     try:
-        response = requests.get("https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd")
-        data = response.json()
+        # Pooled keep-alive session and request timeout shared with the market-data refresher
+        data = market_data.fetch_simple_prices(["bitcoin"], ["usd"])
         return f"Bitcoin price is ${data['bitcoin']['usd']:,}"
     except Exception:
-        return "Couldn't fetch BTC price right now."
\ No newline at end of file
+        return "Couldn't fetch BTC price right now."
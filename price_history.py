@@ -0,0 +1,162 @@
+"""
+Local price time series: a fixed-size ring buffer of (timestamp, price per
+series) rows in a memory-mapped file, shared by every worker on the host
+like the market-data snapshot.
+
+Only the process holding the market-data refresh lock appends; readers copy
+the rows under a seqlock and never block. Window aggregates (change, low,
+high) are a searchsorted plus a min/max over numpy views, so 24h and 7d
+movements come from local data instead of extra CoinGecko calls.
+"""
+import logging
+import mmap
+import os
+import stat
+import struct
+import time
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HISTORY_MAGIC = b"BTCRING\x01"
+# magic, sequence number (odd while a write is in progress), capacity, columns, layout crc, head, count
+_HEADER = struct.Struct("<8sQIIIQQ")
+_HEADER_BYTES = 64
+# A window counts as fully covered if its oldest point is at most this fraction of the window late
+COVERAGE_TOLERANCE = 0.05
+
+
+def map_private_file(path, size):
+    """
+    Maps path read-write, creating it owner-only and growing it to size.
+    Refuses symlinks, non-regular files and files owned by another user, so
+    a file planted at the path cannot be mapped in its place.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    try:
+        info = os.fstat(fd)
+        if not stat.S_ISREG(info.st_mode):
+            raise PermissionError(f"{path} is not a regular file.")
+        if hasattr(os, "getuid") and info.st_uid != os.getuid():
+            raise PermissionError(f"{path} is owned by uid {info.st_uid}, not by this user.")
+        if info.st_size < size:
+            os.ftruncate(fd, size)
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+
+class PriceHistory:
+    """
+    Ring buffer of price rows. Column 0 is the Unix timestamp, then one
+    float64 column per series ('bitcoin/usd', ...); missing prices are NaN.
+    A file written for a different capacity or series list is reset.
+    """
+
+    def __init__(self, path, series, capacity=4096):
+        self.path = path
+        self.series = tuple(series)
+        self.capacity = capacity
+        self._columns = 1 + len(self.series)
+        self._layout_crc = zlib.crc32(",".join(self.series).encode("utf-8"))
+        self._mmap = None
+        self._rows = None
+
+    def _map(self):
+        if self._mmap is None:
+            self._mmap = map_private_file(self.path, _HEADER_BYTES + self.capacity * self._columns * 8)
+            self._rows = np.frombuffer(self._mmap, dtype=np.float64, count=self.capacity * self._columns,
+                                       offset=_HEADER_BYTES).reshape(self.capacity, self._columns)
+        return self._mmap
+
+    def _header(self):
+        """Returns (seq, head, count); count is 0 for an empty or foreign file."""
+        magic, seq, capacity, columns, layout_crc, head, count = _HEADER.unpack_from(self._map(), 0)
+        if magic != HISTORY_MAGIC or (capacity, columns, layout_crc) != (self.capacity, self._columns, self._layout_crc):
+            return seq, 0, 0
+        return seq, head, count
+
+    def _write_header(self, seq, head, count):
+        _HEADER.pack_into(self._map(), 0, HISTORY_MAGIC, seq, self.capacity, self._columns, self._layout_crc, head, count)
+
+    def __len__(self):
+        return self._header()[2]
+
+    def append(self, timestamp, prices):
+        """Appends one row; prices maps series name -> price. Call with the refresh lock held."""
+        self.extend([timestamp], [[prices.get(name, np.nan) for name in self.series]])
+
+    def extend(self, timestamps, values):
+        """Appends rows in time order (values: one row of series prices per timestamp), skipping old ones."""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64).reshape(len(timestamps), len(self.series))
+        seq, head, count = self._header()
+        seq += seq % 2 # a writer that died mid-write left an odd sequence number
+        last = self._rows[(head - 1) % self.capacity, 0] if count else -np.inf
+        keep = timestamps > last
+        timestamps, values = timestamps[keep], values[keep]
+        if not len(timestamps):
+            return 0
+        if len(timestamps) > self.capacity:
+            timestamps, values = timestamps[-self.capacity:], values[-self.capacity:]
+
+        self._write_header(seq + 1, head, count)
+        positions = (head + np.arange(len(timestamps))) % self.capacity
+        self._rows[positions, 0] = timestamps
+        self._rows[positions, 1:] = values
+        self._write_header(seq + 2, (head + len(timestamps)) % self.capacity, min(count + len(timestamps), self.capacity))
+        return len(timestamps)
+
+    def read(self):
+        """Returns (timestamps, values) copies in time order; values has one column per series."""
+        for _ in range(100):
+            seq, head, count = self._header()
+            if seq % 2:
+                time.sleep(0.0001)
+                continue
+            if count < self.capacity:
+                rows = self._rows[:count].copy()
+            else:
+                rows = np.concatenate((self._rows[head:], self._rows[:head]))
+            if self._header()[0] == seq:
+                return rows[:, 0], rows[:, 1:]
+        logger.warning("Gave up reading price history after repeated concurrent writes.")
+        return np.empty(0), np.empty((0, len(self.series)))
+
+    def window_stats(self, series, window_seconds, now=None):
+        """
+        Change, low and high of one series over the last window_seconds, or
+        None without at least two points. 'complete' is False when the
+        history does not reach back to the start of the window yet.
+        """
+        timestamps, values = self.read()
+        prices = values[:, self.series.index(series)]
+        valid = ~np.isnan(prices)
+        timestamps, prices = timestamps[valid], prices[valid]
+        if len(prices) < 2:
+            return None
+        now = timestamps[-1] if now is None else now
+        window_start = now - window_seconds
+        first = int(np.searchsorted(timestamps, window_start))
+        window = prices[first:]
+        if len(window) < 2:
+            return None
+        start_price, end_price = float(window[0]), float(window[-1])
+        return {
+            "change": end_price - start_price,
+            "change_pct": (end_price - start_price) / start_price * 100 if start_price else 0.0,
+            "low": float(window.min()),
+            "high": float(window.max()),
+            "since": float(timestamps[first]),
+            "points": len(window),
+            "complete": bool(timestamps[first] - window_start <= window_seconds * COVERAGE_TOLERANCE),
+        }
+
+    def close(self):
+        if self._mmap is not None:
+            # The row view exports the mmap's buffer; drop it before closing
+            self._rows = None
+            self._mmap.close()
+            self._mmap = None
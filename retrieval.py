@@ -0,0 +1,372 @@
+"""
+Local BM25 retrieval over the curated Bitcoin corpus (knowledge/bitcoin_faq.jsonl).
+
+The index is built offline into a single file that every worker memory-maps
+read-only, so all processes on a host share one copy through the page cache:
+
+    python -m retrieval build [--corpus knowledge/bitcoin_faq.jsonl] [--output knowledge/bitcoin_faq.idx]
+    python -m retrieval query "what is the halving?"
+
+Terms are hashed into a power-of-two number of buckets (no vocabulary to
+load), and each bucket's postings carry precomputed BM25 weights, so a
+query is a handful of array slices plus one np.bincount. Every posting also
+carries a second, independent hash of its term, so words that share a bucket
+('hi' and 'financial') do not match each other. A question that has the
+same terms as a curated FAQ question matches it with full confidence.
+"""
+import argparse
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge", "bitcoin_faq.jsonl")
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge", "bitcoin_faq.idx")
+
+INDEX_MAGIC = b"BTCBM25\x02"
+# magic, num_buckets, num_docs, num_postings, num_questions, passages_bytes, k1, b
+_HEADER = struct.Struct("<8sIIQIQdd")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can could did do does for from how i if in into is it its me my of on or "
+    "so than that the their them then there these they this to was we what when where which who whom "
+    "why will with would you your about tell explain please more hi hello hey thanks thank ok okay yes no sure".split()
+)
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords; a trailing plural 's' is dropped ('wallets' -> 'wallet')."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if len(token) < 2 or token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def _bucket(term, num_buckets):
+    return zlib.crc32(term.encode("utf-8")) & (num_buckets - 1)
+
+
+def _fingerprint(term):
+    """Tells apart the terms that share a bucket; independent of the bucket hash."""
+    return zlib.adler32(term.encode("utf-8"))
+
+
+# Stopwords, but they tell 'who is satoshi?' from 'what is a satoshi?'
+_QUESTION_WORDS = frozenset(("who", "what", "why", "how", "when", "where", "which"))
+
+
+def question_signature(text):
+    """Order- and repetition-insensitive hash of a question's terms and question words."""
+    terms = set(tokenize(text)) | (_QUESTION_WORDS & set(_TOKEN_RE.findall(text.lower())))
+    return zlib.crc32(" ".join(sorted(terms)).encode("utf-8"))
+
+
+def _idf(num_docs, doc_freqs):
+    return np.log1p((num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+
+
+def _contains(sorted_ids, doc_id):
+    position = int(np.searchsorted(sorted_ids, doc_id))
+    return position < len(sorted_ids) and sorted_ids[position] == doc_id
+
+
+def _passage_text(passage):
+    return " ".join(passage.get(field, "") for field in ("question", "title", "text"))
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as corpus_file:
+        return [json.loads(line) for line in corpus_file if line.strip()]
+
+
+# --- Offline build ---
+def build_index(passages, path, k1=1.2, b=0.75):
+    """Writes the BM25 index for the passages (dicts with 'text' and optional 'question'/'title') to path."""
+    doc_terms = [tokenize(_passage_text(passage)) for passage in passages]
+    vocabulary = {term for terms in doc_terms for term in terms}
+    # Roughly 2 buckets per distinct term keeps hash collisions rare
+    num_buckets = 1 << max(10, math.ceil(math.log2(max(1, 2 * len(vocabulary)))))
+
+    bucket_ids, fingerprints, doc_ids, term_freqs = [], [], [], []
+    for doc_id, terms in enumerate(doc_terms):
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        bucket_ids.extend(_bucket(term, num_buckets) for term in counts)
+        fingerprints.extend(_fingerprint(term) for term in counts)
+        doc_ids.extend([doc_id] * len(counts))
+        term_freqs.extend(counts.values())
+
+    bucket_ids = np.asarray(bucket_ids, dtype=np.uint32)
+    fingerprints = np.asarray(fingerprints, dtype=np.uint32)
+    doc_ids = np.asarray(doc_ids, dtype=np.uint32)
+    term_freqs = np.asarray(term_freqs, dtype=np.float32)
+    doc_lengths = np.asarray([len(terms) for terms in doc_terms], dtype=np.float32)
+    avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 1.0
+
+    # Postings grouped by bucket, then by term, doc ids ascending within a term
+    order = np.lexsort((doc_ids, fingerprints, bucket_ids))
+    bucket_ids, fingerprints, doc_ids, term_freqs = bucket_ids[order], fingerprints[order], doc_ids[order], term_freqs[order]
+    term_offsets = np.zeros(num_buckets + 1, dtype=np.uint64)
+    np.cumsum(np.bincount(bucket_ids, minlength=num_buckets), out=term_offsets[1:])
+
+    # Document frequency of each posting's own term, not of its whole bucket
+    term_starts = np.flatnonzero(np.r_[True, (bucket_ids[1:] != bucket_ids[:-1]) | (fingerprints[1:] != fingerprints[:-1])])
+    doc_freqs = np.repeat(np.diff(np.r_[term_starts, len(doc_ids)]), np.diff(np.r_[term_starts, len(doc_ids)]))
+    idf = _idf(len(passages), doc_freqs).astype(np.float32)
+    length_norm = k1 * (1 - b + b * doc_lengths[doc_ids] / avg_length)
+    weights = (idf * term_freqs * (k1 + 1) / (term_freqs + length_norm)).astype(np.float32)
+
+    blobs = [json.dumps(passage, ensure_ascii=False).encode("utf-8") for passage in passages]
+    passage_offsets = np.zeros(len(blobs) + 1, dtype=np.uint64)
+    np.cumsum([len(blob) for blob in blobs], out=passage_offsets[1:])
+
+    # Curated questions for the exact-match path, sorted by signature for searchsorted
+    questions = [(question_signature(passage["question"]), doc_id)
+                 for doc_id, passage in enumerate(passages) if passage.get("question")]
+    questions.sort()
+    question_signatures = np.asarray([signature for signature, _ in questions], dtype=np.uint32)
+    question_docs = np.asarray([doc_id for _, doc_id in questions], dtype=np.uint32)
+
+    # Write next to the target and rename, so workers holding the old file keep a valid mapping
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as index_file:
+        index_file.write(_HEADER.pack(INDEX_MAGIC, num_buckets, len(passages), len(doc_ids), len(questions),
+                                      int(passage_offsets[-1]), k1, b))
+        # Every array starts 8-byte aligned so the reader can map it in place
+        index_file.write(b"\0" * (-index_file.tell() % 8))
+        for array in (term_offsets, fingerprints, doc_ids, weights, passage_offsets, question_signatures, question_docs):
+            index_file.write(array.tobytes())
+            index_file.write(b"\0" * (-index_file.tell() % 8))
+        index_file.write(b"".join(blobs))
+    os.replace(tmp_path, path)
+    logger.info("Built retrieval index %s: %d passages, %d terms, %d buckets, %d postings.",
+                path, len(passages), len(vocabulary), num_buckets, len(doc_ids))
+
+
+# --- Query side ---
+class BM25Index:
+    """Read-only view over an index file; arrays are np.frombuffer views of one shared mmap."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as index_file:
+            self._mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_buckets, self.num_docs, num_postings, num_questions, passages_bytes, self.k1, self.b = \
+            _HEADER.unpack_from(self._mmap, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} is not a retrieval index (or was built by another version).")
+
+        offset = _HEADER.size + -_HEADER.size % 8
+        arrays = []
+        for dtype, count in ((np.uint64, self.num_buckets + 1), (np.uint32, num_postings), (np.uint32, num_postings),
+                             (np.float32, num_postings), (np.uint64, self.num_docs + 1),
+                             (np.uint32, num_questions), (np.uint32, num_questions)):
+            arrays.append(np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset))
+            offset += count * np.dtype(dtype).itemsize
+            offset += -offset % 8
+        self.term_offsets, self.fingerprints, self.doc_ids, self.weights, self.passage_offsets, \
+            self.question_signatures, self.question_docs = arrays
+        self._passages_start = offset
+
+    def passage(self, doc_id):
+        start = self._passages_start + int(self.passage_offsets[doc_id])
+        end = self._passages_start + int(self.passage_offsets[doc_id + 1])
+        return json.loads(self._mmap[start:end])
+
+    def match_question(self, query):
+        """Doc id of the curated question with the same terms as the query, or None."""
+        signature = question_signature(query)
+        position = int(np.searchsorted(self.question_signatures, signature))
+        if position < len(self.question_signatures) and self.question_signatures[position] == signature:
+            return int(self.question_docs[position])
+        return None
+
+    def _postings(self, term):
+        """(doc_ids, weights) of one term: its bucket's postings, without the other terms hashed there."""
+        start, end = int(self.term_offsets[_bucket(term, self.num_buckets)]), int(self.term_offsets[_bucket(term, self.num_buckets) + 1])
+        doc_ids, weights = self.doc_ids[start:end], self.weights[start:end]
+        if end > start:
+            same_term = self.fingerprints[start:end] == _fingerprint(term)
+            doc_ids, weights = doc_ids[same_term], weights[same_term]
+        return doc_ids, weights
+
+    def search(self, query, k=3):
+        """
+        Returns (confidence, matched_terms, [(score, doc_id), ...]) for the top
+        k passages. confidence is the share of the query's idf mass that the
+        best passage contains, so unknown or unmatched distinctive words pull
+        it down while common ones barely count; matched_terms is how many
+        distinct query terms the best passage contains.
+        """
+        postings = [self._postings(term) for term in set(tokenize(query))]
+        if not postings or not self.num_docs:
+            return 0.0, 0, []
+
+        doc_ids = np.concatenate([ids for ids, _ in postings])
+        if not len(doc_ids):
+            return 0.0, 0, []
+        weights = np.concatenate([term_weights for _, term_weights in postings])
+
+        scores = np.bincount(doc_ids, weights=weights, minlength=self.num_docs)
+        # Select among matching docs only: argpartition is slow on a long run of zeros
+        candidates = np.unique(doc_ids) if len(doc_ids) < self.num_docs // 8 else np.flatnonzero(scores)
+        k = min(k, len(candidates))
+        top = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+        top = top[np.argsort(scores[top])[::-1]]
+        results = [(float(scores[doc_id]), int(doc_id)) for doc_id in top]
+
+        # Postings are sorted by doc id within a term, so membership is a binary search
+        best_doc = results[0][1]
+        idf = _idf(self.num_docs, np.array([len(ids) for ids, _ in postings], dtype=np.float64))
+        matched = np.array([_contains(ids, best_doc) for ids, _ in postings])
+        confidence = float(idf[matched].sum() / idf.sum())
+        return confidence, int(matched.sum()), results
+
+    def close(self):
+        # The array views export the mmap's buffer; drop them before closing it
+        self.term_offsets = self.fingerprints = self.doc_ids = self.weights = self.passage_offsets = None
+        self.question_signatures = self.question_docs = None
+        self._mmap.close()
+
+
+class RetrievalStats:
+    """Per-process counts of how retrieval routed each question."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.answered = 0
+        self.grounded = 0
+        self.passed_through = 0
+        self.query_seconds_total = 0.0
+
+    def record(self, outcome, seconds):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.query_seconds_total += seconds
+
+    def as_dict(self):
+        with self._lock:
+            queries = self.answered + self.grounded + self.passed_through
+            return {
+                "answered": self.answered,
+                "grounded": self.grounded,
+                "passed_through": self.passed_through,
+                "avg_query_ms": round(self.query_seconds_total / (queries or 1) * 1000, 3),
+            }
+
+
+class KnowledgeBase:
+    """
+    Routes a question using the index. A curated question with the same terms,
+    or a passage with confidence >= answer_threshold that also outscores the
+    runner-up by min_margin, scores at least min_answer_score and contains
+    min_answer_terms distinct query terms, answers it directly; confidence >=
+    context_threshold with a score of at least min_context_score attaches the
+    top passages as short reference notes for Gemini; anything lower passes
+    through. The absolute floors keep a one-word match ('hi', 'more') from
+    counting as full confidence.
+    """
+
+    def __init__(self, index, answer_threshold=0.8, context_threshold=0.5, min_margin=1.5, min_answer_score=4.0,
+                 min_answer_terms=2, min_context_score=2.0, max_context_passages=2, max_context_chars=600):
+        self.index = index
+        self.answer_threshold = answer_threshold
+        self.min_answer_score = min_answer_score
+        self.min_answer_terms = min_answer_terms
+        self.min_context_score = min_context_score
+        self.min_margin = min_margin
+        self.context_threshold = context_threshold
+        self.max_context_passages = max_context_passages
+        self.max_context_chars = max_context_chars
+        self.stats = RetrievalStats()
+
+    def lookup(self, question, allow_direct=True):
+        """Returns (direct_answer or None, reference_notes string, possibly empty)."""
+        start = time.perf_counter()
+        exact_doc = self.index.match_question(question) if allow_direct else None
+        if exact_doc is not None:
+            self.stats.record("answered", time.perf_counter() - start)
+            return self.index.passage(exact_doc)["text"], ""
+
+        confidence, matched_terms, results = self.index.search(question, k=max(2, self.max_context_passages))
+        best_score = results[0][0] if results else 0.0
+        # An ambiguous question ('who is satoshi?') must not be answered from the wrong passage
+        unambiguous = len(results) < 2 or best_score >= self.min_margin * results[1][0]
+        if allow_direct and results and confidence >= self.answer_threshold and unambiguous \
+                and best_score >= self.min_answer_score and matched_terms >= self.min_answer_terms:
+            self.stats.record("answered", time.perf_counter() - start)
+            return self.index.passage(results[0][1])["text"], ""
+        if not results or confidence < self.context_threshold or best_score < self.min_context_score:
+            self.stats.record("passed_through", time.perf_counter() - start)
+            return None, ""
+
+        notes = "--- REFERENCE NOTES (curated) ---\n"
+        for _, doc_id in results[:self.max_context_passages]:
+            passage = self.index.passage(doc_id)
+            notes += f"- {passage.get('title', '')}: {passage['text'][:self.max_context_chars]}\n"
+        notes += "--------------------------\n\n"
+        self.stats.record("grounded", time.perf_counter() - start)
+        return None, notes
+
+
+def open_knowledge_base(path=DEFAULT_INDEX_PATH, **options):
+    """Opens the index at path, or returns None (retrieval disabled) if it has not been built."""
+    if not os.path.exists(path):
+        logger.warning("Retrieval index %s not found; build it with 'python -m retrieval build'.", path)
+        return None
+    try:
+        index = BM25Index(path)
+    except Exception:
+        logger.exception("Could not open retrieval index %s:", path)
+        return None
+    logger.info("Loaded retrieval index %s (%d passages).", path, index.num_docs)
+    return KnowledgeBase(index, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="build the index file from a JSONL corpus")
+    build_parser.add_argument("--corpus", default=DEFAULT_CORPUS_PATH)
+    build_parser.add_argument("--output", default=DEFAULT_INDEX_PATH)
+    query_parser = subparsers.add_parser("query", help="show the top passages for a question")
+    query_parser.add_argument("question")
+    query_parser.add_argument("--index", default=DEFAULT_INDEX_PATH)
+    query_parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        build_index(load_corpus(args.corpus), args.output)
+        print(f"Wrote {args.output} ({os.path.getsize(args.output)} bytes) in {time.perf_counter() - start:.2f}s")
+    else:
+        index = BM25Index(args.index)
+        exact_doc = index.match_question(args.question)
+        if exact_doc is not None:
+            print(f"exact question match: {index.passage(exact_doc).get('id', exact_doc)}")
+        confidence, matched_terms, results = index.search(args.question, k=args.k)
+        print(f"confidence {confidence:.2f}, {matched_terms} term(s) matched")
+        for score, doc_id in results:
+            passage = index.passage(doc_id)
+            print(f"{score:7.2f}  {passage.get('id', doc_id)}: {passage.get('question') or passage.get('title', '')}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,160 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from cachetools import LRUCache, TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def new_conversation_id():
+    return uuid.uuid4().hex
+
+
+# --- Session stores: conversation_id -> list of {'type': 'user'|'bot', 'text': ...} turns ---
+class SessionStore:
+    """Interface for conversation stores. Turns are only ever appended."""
+
+    def load(self, conversation_id):
+        """Returns the list of turns, or None for an unknown/expired conversation."""
+        raise NotImplementedError
+
+    def append(self, conversation_id, turns):
+        raise NotImplementedError
+
+    def delete(self, conversation_id):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """Per-process LRU store; idle conversations expire after ttl seconds."""
+
+    def __init__(self, maxsize=10_000, ttl=24 * 3600):
+        self._sessions = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def load(self, conversation_id):
+        with self._lock:
+            turns = self._sessions.get(conversation_id)
+            return list(turns) if turns is not None else None
+
+    def append(self, conversation_id, turns):
+        with self._lock:
+            stored = self._sessions.get(conversation_id, [])
+            stored.extend(turns)
+            # Re-setting refreshes both the LRU position and the TTL
+            self._sessions[conversation_id] = stored
+
+    def delete(self, conversation_id):
+        with self._lock:
+            self._sessions.pop(conversation_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Local stand-in for a shared store such as Redis: every worker on the host
+    opens the same SQLite file, so a conversation can continue on any worker.
+    """
+
+    # Purge idle conversations every this many appends
+    EXPIRE_EVERY_APPENDS = 500
+
+    def __init__(self, path, ttl=24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._appends = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                " conversation_id TEXT NOT NULL, seq INTEGER NOT NULL, type TEXT NOT NULL,"
+                " text TEXT NOT NULL, created_at REAL NOT NULL,"
+                " PRIMARY KEY (conversation_id, seq))"
+            )
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads (or a forked child); keep one per thread and process
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def load(self, conversation_id):
+        rows = self._connect().execute(
+            "SELECT type, text, created_at FROM turns WHERE conversation_id = ? ORDER BY seq",
+            (conversation_id,),
+        ).fetchall()
+        if not rows or rows[-1][2] < time.time() - self.ttl:
+            return None
+        return [{'type': turn_type, 'text': text} for turn_type, text, _ in rows]
+
+    def append(self, conversation_id, turns):
+        now = time.time()
+        with self._connect() as conn:
+            (next_seq,) = conn.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM turns WHERE conversation_id = ?",
+                (conversation_id,),
+            ).fetchone()
+            conn.executemany(
+                "INSERT INTO turns (conversation_id, seq, type, text, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(conversation_id, next_seq + i, turn['type'], turn['text'], now) for i, turn in enumerate(turns)],
+            )
+        self._appends += 1
+        if self._appends % self.EXPIRE_EVERY_APPENDS == 0:
+            self.expire()
+
+    def delete(self, conversation_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM turns WHERE conversation_id = ?", (conversation_id,))
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM turns WHERE conversation_id IN ("
+                " SELECT conversation_id FROM turns GROUP BY conversation_id HAVING MAX(created_at) < ?)",
+                (cutoff,),
+            )
+
+
+def create_session_store(backend, path=None, maxsize=10_000, ttl=24 * 3600):
+    """Builds the configured store: 'memory' (default) or 'sqlite'."""
+    if backend == "sqlite":
+        path = path or os.path.join(os.getcwd(), "sessions.sqlite3")
+        logger.info("Using SQLite session store at %s.", path)
+        return SQLiteSessionStore(path, ttl=ttl)
+    if backend != "memory":
+        logger.warning("Unknown session store backend '%s', falling back to memory.", backend)
+    return MemorySessionStore(maxsize=maxsize, ttl=ttl)
+
+
+# --- Live Gemini ChatSession objects, reused while they match the stored history ---
+class LiveChatRegistry:
+    """
+    Per-process LRU of conversation_id -> (ChatSession, turn_count).
+    checkout() hands a session to exactly one request; a session whose turn
+    count no longer matches the store (e.g. another worker answered in
+    between) is discarded and the caller rebuilds from the stored turns.
+    """
+
+    def __init__(self, maxsize=1_000):
+        self._chats = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def checkout(self, conversation_id, turn_count):
+        with self._lock:
+            entry = self._chats.pop(conversation_id, None)
+        if entry is None:
+            return None
+        chat, chat_turn_count = entry
+        return chat if chat_turn_count == turn_count else None
+
+    def checkin(self, conversation_id, chat, turn_count):
+        with self._lock:
+            self._chats[conversation_id] = (chat, turn_count)
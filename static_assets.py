@@ -0,0 +1,199 @@
+"""
+Static responses built once at startup: the frontend bundle in static/ and
+constant JSON payloads such as /tour.
+
+Every asset is held in memory as identity, gzip and (if the optional
+'brotli' package is installed) brotli bodies, each with a strong ETag, so a
+request costs an Accept-Encoding lookup and a dict access. Hashed bundle
+files (assets/index-<hash>.js) are cached for a year as immutable;
+everything else must revalidate and gets a 304 when the ETag still matches.
+
+Run `python static_assets.py [static]` at build time to write .gz/.br files
+next to the assets; they are picked up instead of compressing at startup.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import sys
+
+try:
+    import brotli # optional; without it only gzip is offered
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+# Vite's content-hashed output, e.g. assets/index-CNuxNnr3.js
+HASHED_ASSET_RE = re.compile(r"(^|/)assets/.+-[A-Za-z0-9_-]{8,}\.\w+$")
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml", "application/xml")
+# Preference order when the client accepts several encodings equally
+ENCODINGS = ("br", "gzip")
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+# Skip an encoding unless it saves at least this fraction of the body
+MIN_COMPRESSION_SAVING = 0.1
+
+
+def compress(body, encoding, fast=False):
+    """gzip/brotli body; fast=True trades ratio for speed (per-response compression)."""
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=5 if fast else 9, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=4 if fast else 11)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def available_encodings():
+    return ENCODINGS if brotli is not None else ("gzip",)
+
+
+def parse_accept_encoding(header):
+    """Returns {coding: q} for an Accept-Encoding header ('*' included if present)."""
+    accepted = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def negotiate_encoding(accept_encoding, offered):
+    """Picks the best of the offered encodings for the header, or None for identity."""
+    accepted = parse_accept_encoding(accept_encoding)
+    best, best_q = None, 0.0
+    for encoding in offered:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def etag_matches(if_none_match, etags):
+    """True if an If-None-Match header matches any of the ETags (weak comparison, as RFC 9110 asks)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return any(etag in candidates for etag in etags)
+
+
+def is_compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class StaticAsset:
+    """One prebuilt response body in every worthwhile encoding."""
+
+    def __init__(self, body, content_type, cache_control=REVALIDATE_CACHE_CONTROL, encoded=None):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.bodies = {None: body}
+        self.etags = {None: f'"{digest}"'}
+        if is_compressible(content_type):
+            encoded = dict(encoded or {})
+            for encoding in available_encodings():
+                if encoding not in encoded:
+                    encoded[encoding] = compress(body, encoding)
+            for encoding, encoded_body in encoded.items():
+                if len(encoded_body) <= len(body) * (1 - MIN_COMPRESSION_SAVING):
+                    self.bodies[encoding] = encoded_body
+                    self.etags[encoding] = f'"{digest}-{encoding}"'
+        self.encodings = tuple(encoding for encoding in ENCODINGS if encoding in self.bodies)
+
+    @classmethod
+    def from_json(cls, payload, cache_control=REVALIDATE_CACHE_CONTROL):
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        return cls(body, "application/json", cache_control)
+
+    def respond(self, accept_encoding=None, if_none_match=None):
+        """Returns (status, headers, body) for a GET: 200 with the best encoding, or an empty 304."""
+        encoding = negotiate_encoding(accept_encoding, self.encodings)
+        headers = [("ETag", self.etags[encoding]), ("Cache-Control", self.cache_control)]
+        if self.encodings:
+            headers.append(("Vary", "Accept-Encoding"))
+        if etag_matches(if_none_match, self.etags.values()):
+            return 304, headers, b""
+        headers.append(("Content-Type", self.content_type))
+        if encoding:
+            headers.append(("Content-Encoding", encoding))
+        return 200, headers, self.bodies[encoding]
+
+
+def _read_precompressed(path):
+    """.gz/.br files written by main() that are at least as new as the source file."""
+    encoded = {}
+    source_mtime = os.path.getmtime(path)
+    for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+        compressed_path = path + suffix
+        if os.path.exists(compressed_path) and os.path.getmtime(compressed_path) >= source_mtime:
+            with open(compressed_path, "rb") as f:
+                encoded[encoding] = f.read()
+    return encoded
+
+
+def _content_type(path):
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if content_type.startswith("text/") or content_type in ("application/javascript", "image/svg+xml"):
+        content_type += "; charset=utf-8"
+    return content_type
+
+
+class StaticBundle:
+    """All files under a directory, keyed by URL path ('index.html', 'assets/index-X.js')."""
+
+    def __init__(self, root=DEFAULT_STATIC_ROOT):
+        self.root = root
+        self.assets = {}
+        for directory, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                if filename.endswith(tuple(PRECOMPRESSED_SUFFIXES.values())):
+                    continue
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    body = f.read()
+                cache_control = IMMUTABLE_CACHE_CONTROL if HASHED_ASSET_RE.search(name) else REVALIDATE_CACHE_CONTROL
+                self.assets[name] = StaticAsset(body, _content_type(path), cache_control, _read_precompressed(path))
+        logger.info("Loaded %d static assets from %s.", len(self.assets), root)
+
+    def get(self, name):
+        """The asset for a URL path ('' is index.html), or None."""
+        return self.assets.get(name.lstrip("/") or "index.html")
+
+
+def main():
+    """Writes .gz (and .br, if brotli is installed) next to every compressible file under the root."""
+    root = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_STATIC_ROOT
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if filename.endswith(tuple(PRECOMPRESSED_SUFFIXES.values())) or not is_compressible(_content_type(path)):
+                continue
+            with open(path, "rb") as f:
+                body = f.read()
+            for encoding in available_encodings():
+                compressed = compress(body, encoding)
+                with open(path + PRECOMPRESSED_SUFFIXES[encoding], "wb") as f:
+                    f.write(compressed)
+                print(f"{path}{PRECOMPRESSED_SUFFIXES[encoding]}: {len(body)} -> {len(compressed)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Run from the repository root:
+    python -m unittest discover -s tests
+"""
+import itertools
+import os
+import tempfile
+import types
+import unittest
+
+import context_cache
+
+
+def fake_caching():
+    """Stands in for google.generativeai.caching, with the server-side caches in a dict."""
+    store, ids = {}, itertools.count(1)
+
+    class CachedContent:
+        def __init__(self, name, display_name):
+            self.name, self.display_name, self.ttl = name, display_name, None
+
+        @classmethod
+        def create(cls, model, display_name, system_instruction, ttl):
+            cached = cls(f"cachedContents/{next(ids)}", display_name)
+            store[cached.name] = cached
+            return cached
+
+        @classmethod
+        def get(cls, name):
+            if name not in store:
+                raise LookupError(name)
+            return store[name]
+
+        @classmethod
+        def list(cls, page_size=1):
+            return list(store.values())
+
+        def update(self, ttl):
+            self.ttl = ttl
+
+        def delete(self):
+            del store[self.name]
+
+    return types.SimpleNamespace(CachedContent=CachedContent), store
+
+
+class SharedContextCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.record_path = os.path.join(self.dir.name, "market_data.snapshot.context_cache")
+        self.caching, self.store = fake_caching()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def get_or_create(self, prompt="system prompt"):
+        return context_cache.get_or_create(self.caching, "gemini-test", prompt, 3600, self.record_path)
+
+    def test_workers_share_one_cache(self):
+        names = {self.get_or_create().name for _ in range(4)}
+        self.assertEqual(len(names), 1)
+        self.assertEqual(len(self.store), 1)
+
+    def test_reuses_a_cache_left_by_an_earlier_run(self):
+        first = self.get_or_create()
+        os.remove(self.record_path)
+        self.assertEqual(self.get_or_create().name, first.name)
+        self.assertEqual(len(self.store), 1)
+
+    def test_changed_prompt_gets_its_own_cache(self):
+        self.get_or_create()
+        self.get_or_create("new system prompt")
+        self.assertEqual(len(self.store), 2)
+
+    def test_expired_cache_is_recreated(self):
+        first = self.get_or_create()
+        self.store.clear()
+        self.assertNotEqual(self.get_or_create().name, first.name)
+        self.assertEqual(len(self.store), 1)
+
+    def test_delete_recorded(self):
+        self.get_or_create()
+        context_cache.delete_recorded(self.caching, self.record_path)
+        self.assertEqual(self.store, {})
+        self.assertFalse(os.path.exists(self.record_path))
+        context_cache.delete_recorded(self.caching, self.record_path) # nothing recorded: no-op
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+Run from the repository root:
+    python -m unittest discover -s tests
+"""
+import time
+import unittest
+from unittest import mock
+
+import llm_backends
+from llm_backends import CircuitBreaker, FakeBackend, LLMRequest, LLMRouter
+
+
+def open_breaker_due_for_probe(router, index):
+    breaker = router.states[index].breaker
+    breaker.state, breaker.opened_at = CircuitBreaker.OPEN, time.monotonic() - breaker.reset_seconds - 1
+    return breaker
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_cancelled_probe_frees_the_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30.0)
+        breaker.record_failure()
+        breaker.opened_at -= 31
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow()) # one probe at a time
+        breaker.record_cancelled()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.allow())
+
+    def test_cancel_does_not_touch_a_closed_breaker(self):
+        breaker = CircuitBreaker()
+        breaker.record_cancelled()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class HedgedProbeTest(unittest.TestCase):
+    def make_router(self):
+        slow = FakeBackend("slow", latency=0.5)
+        fast = FakeBackend("fast")
+        return LLMRouter([slow, fast], hedge_delay_seconds=0.05, min_hedge_delay_seconds=0.05)
+
+    def assert_probe_released(self, router):
+        breaker = router.states[0].breaker
+        self.assertEqual(router.stats()["slow"]["cancelled"], 1)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.allow())
+
+    def test_probe_losing_a_hedge_race(self):
+        router = self.make_router()
+        open_breaker_due_for_probe(router, 0)
+        response = router.generate(LLMRequest("What is Bitcoin?"))
+        self.assertEqual(response.backend, "fast")
+        self.assert_probe_released(router)
+
+    def test_streamed_probe_losing_a_hedge_race(self):
+        router = self.make_router()
+        open_breaker_due_for_probe(router, 0)
+        stream = router.stream(LLMRequest("What is Bitcoin?"))
+        self.assertTrue("".join(stream))
+        self.assertEqual(stream.response.backend, "fast")
+        self.assert_probe_released(router)
+
+
+
+class FailingMidStreamBackend(FakeBackend):
+    def stream(self, request):
+        yield "Bitcoin is "
+        raise ConnectionError(f"{self.name}: stream cut")
+
+
+class StreamOutcomeTest(unittest.TestCase):
+    def test_failure_after_the_first_chunk_counts(self):
+        router = LLMRouter([FailingMidStreamBackend("flaky")], breaker_failures=2)
+        for _ in range(2):
+            stream = router.stream(LLMRequest("What is Bitcoin?"))
+            with self.assertRaises(ConnectionError):
+                list(stream)
+        stats = router.stats()["flaky"]
+        self.assertEqual((stats["ok"], stats["error"]), (0, 2))
+        self.assertEqual(router.states[0].breaker.state, CircuitBreaker.OPEN)
+
+    def test_finished_stream_counts_once(self):
+        router = LLMRouter([FakeBackend("only", chunks=4)])
+        stream = router.stream(LLMRequest("What is Bitcoin?"))
+        self.assertTrue("".join(stream))
+        self.assertEqual(router.stats()["only"]["ok"], 1)
+
+
+class RecoveryTest(unittest.TestCase):
+    def test_open_breaker_is_ready_again_after_reset(self):
+        backend = FakeBackend("only", error_rate=1.0)
+        router = LLMRouter([backend], breaker_failures=2, breaker_reset_seconds=30.0)
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                router.generate(LLMRequest("What is Bitcoin?"))
+        self.assertFalse(router.ready())
+
+        backend.error_rate = 0.0
+        calls = backend.calls
+        clock = time.monotonic
+        with mock.patch.object(llm_backends.time, "monotonic", lambda: clock() + 31):
+            self.assertTrue(router.ready())
+            self.assertEqual(router.states[0].breaker.state, CircuitBreaker.OPEN) # ready() does not claim the probe
+            response = router.generate(LLMRequest("What is Bitcoin?"))
+        self.assertEqual(response.backend, "only")
+        self.assertEqual(backend.calls, calls + 1)
+        self.assertEqual(router.states[0].breaker.state, CircuitBreaker.CLOSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+Run from the repository root:
+    python -m unittest discover -s tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from retrieval import DEFAULT_CORPUS_PATH, BM25Index, KnowledgeBase, build_index, load_corpus
+
+
+class KnowledgeBaseTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(cls.tmp_dir, "faq.idx")
+        build_index(load_corpus(DEFAULT_CORPUS_PATH), path)
+        cls.index = BM25Index(path)
+        cls.knowledge_base = KnowledgeBase(cls.index)
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.knowledge_base
+        cls.index.close()
+        shutil.rmtree(cls.tmp_dir)
+
+    def assert_passes_through(self, questions):
+        for question in questions:
+            with self.subTest(question=question):
+                self.assertEqual(self.knowledge_base.lookup(question), (None, ""))
+
+    def test_greetings(self):
+        self.assert_passes_through(["hi", "hello", "Hey!", "hi there", "thanks", "ok thank you"])
+
+    def test_filler(self):
+        self.assert_passes_through(["tell me more", "what?", "why?", "can you explain?", "yes please"])
+
+    def test_out_of_vocabulary(self):
+        self.assert_passes_through(["qwzx blorp", "zebra xylophone", "sourdough starter"])
+
+    def test_words_sharing_a_bucket_do_not_match(self):
+        # 'hi' shares a bucket with 'financial' and 'hello' with 'newspaper' in this index
+        self.assertEqual(self.index.search("hi"), (0.0, 0, []))
+        self.assertEqual(self.index.search("hello"), (0.0, 0, []))
+
+    def test_single_term_match_is_not_answered_directly(self):
+        direct_answer, _ = self.knowledge_base.lookup("financial")
+        self.assertIsNone(direct_answer)
+
+    def test_curated_question_is_answered(self):
+        direct_answer, _ = self.knowledge_base.lookup("What is a UTXO?")
+        self.assertIsNotNone(direct_answer)
+
+
+if __name__ == "__main__":
+    unittest.main()
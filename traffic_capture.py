@@ -0,0 +1,198 @@
+"""
+Opt-in capture of /ask traffic for offline what-if analysis.
+
+Each captured request becomes one compact JSON line (short keys, no
+whitespace) in a rotating file: past max_bytes the file is gzipped to
+<path>.1.gz and older segments shift up, keeping backup_count of them. The
+request thread only fills in a dict (note()/add() from anywhere in the
+request); a writer thread serializes and writes in batches, and drops and
+counts records when it cannot keep up.
+
+Fields of a record:
+  ts   start time (Unix seconds)            rt   "ask" or "stream"
+  q    question                             h    history turns
+  hf   history fingerprint ("" for none)    v    market-data version
+  src  local | cache | llm | error | rejected
+  rn   intent route, if the router answered locally
+  be   LLM backend    pt, ot  prompt/output tokens    lm  LLM call ms
+  n    answer characters (links included)   l    related links
+  st   stage durations in ms    ms  total ms    s  HTTP status
+
+With several worker processes, put "{pid}" in the path so each writes its
+own file. benchmarks/replay_traffic.py replays captures through candidate
+cache and router settings.
+"""
+import atexit
+import contextvars
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_RECORDS = metrics.counter(
+    "bitcoin_chatbot_traffic_capture_records_total", "Captured /ask requests, by outcome (written or dropped).", ["outcome"])
+
+_current = contextvars.ContextVar("traffic_capture", default=None)
+WRITE_BATCH_RECORDS = 256
+
+
+# --- Request side ---
+def note(**fields):
+    """Sets fields on the current request's record; a no-op when the request is not captured."""
+    entry = _current.get()
+    if entry is not None:
+        entry.update(fields)
+
+
+def add(**counts):
+    """Adds to numeric fields of the current request's record (e.g. tokens of several LLM calls)."""
+    entry = _current.get()
+    if entry is not None:
+        for key, value in counts.items():
+            if value:
+                entry[key] = entry.get(key, 0) + value
+
+
+def detach():
+    """Takes the current record out of the request (None if not captured), to be attach()ed where the request goes on."""
+    entry = _current.get()
+    _current.set(None)
+    return entry
+
+
+def attach(entry):
+    _current.set(entry)
+
+
+class CaptureLog:
+    """The rotating capture file of one process and the thread that writes it."""
+
+    _STOP = object()
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, backup_count=5, queue_size=10000):
+        self.path_template = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue_size = queue_size
+        self._records = queue.SimpleQueue()
+        self._writer_pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def begin(self, route):
+        _current.set({"ts": round(time.time(), 3), "rt": route})
+
+    def finish(self, timings=None):
+        """Queues the current request's record, with the stage timings collected by metrics."""
+        entry = _current.get()
+        if entry is None:
+            return
+        _current.set(None)
+        if timings is not None:
+            entry["st"] = {name: round(seconds * 1000, 2) for name, seconds in timings.stages.items()}
+            entry["ms"] = round(timings.elapsed() * 1000, 2)
+        self._ensure_writer()
+        if self._records.qsize() >= self.queue_size:
+            CAPTURE_RECORDS.labels("dropped").inc()
+            return
+        self._records.put(entry)
+
+    # --- Writer thread ---
+    def _ensure_writer(self):
+        # Started on first use and again in each forked worker (threads do not survive fork)
+        if self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            if self._writer_pid is not None:
+                self._records = queue.SimpleQueue()
+            path = self.path_template.format(pid=os.getpid())
+            self._writer = threading.Thread(target=self._write_loop, args=(self._records, path),
+                                            name="traffic-capture", daemon=True)
+            self._writer.start()
+            self._writer_pid = os.getpid()
+            logger.info("Capturing /ask traffic to %s.", path)
+
+    def _write_loop(self, records, path):
+        output = open(path, "a", encoding="utf-8")
+        try:
+            while True:
+                batch = [records.get()]
+                while batch[-1] is not self._STOP and len(batch) < WRITE_BATCH_RECORDS and not records.empty():
+                    batch.append(records.get())
+                lines = [json.dumps(entry, separators=(",", ":"), ensure_ascii=False)
+                         for entry in batch if entry is not self._STOP]
+                if lines:
+                    output.write("\n".join(lines) + "\n")
+                    output.flush()
+                    CAPTURE_RECORDS.labels("written").inc(len(lines))
+                    if output.tell() >= self.max_bytes:
+                        output.close()
+                        self._rotate(path)
+                        output = open(path, "a", encoding="utf-8")
+                if batch[-1] is self._STOP:
+                    return
+        except Exception:
+            logger.exception("Traffic capture writer failed; capture stopped:")
+        finally:
+            output.close()
+
+    def _rotate(self, path):
+        """path -> path.1.gz, path.1.gz -> path.2.gz, ...; the oldest beyond backup_count is removed."""
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{index}.gz"):
+                os.replace(f"{path}.{index}.gz", f"{path}.{index + 1}.gz")
+        if self.backup_count > 0:
+            with open(path, "rb") as source, gzip.open(f"{path}.1.gz.tmp", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.replace(f"{path}.1.gz.tmp", f"{path}.1.gz")
+        os.remove(path)
+
+    def close(self, timeout=5.0):
+        """Writes out what is still queued and stops the writer thread."""
+        if self._writer_pid == os.getpid():
+            self._records.put(self._STOP)
+            self._writer.join(timeout)
+            self._writer_pid = None
+
+
+def create_capture_log(path, **options):
+    """Returns a CaptureLog, or None (capture off) if path is empty."""
+    if not path:
+        return None
+    return CaptureLog(path, **options)
+
+
+# --- Reading captures back ---
+def capture_segments(path):
+    """The files of one capture, oldest first: path.N.gz ... path.1.gz, then path."""
+    def index(segment):
+        return int(segment[len(path) + 1:-len(".gz")])
+
+    rotated = [segment for segment in glob.glob(glob.escape(path) + ".*.gz") if segment[len(path) + 1:-len(".gz")].isdigit()]
+    segments = sorted(rotated, key=index, reverse=True)
+    if os.path.exists(path):
+        segments.append(path)
+    return segments
+
+
+def iter_records(path):
+    """Streams the records of one capture in the order they were written; a torn last line is skipped."""
+    for segment in capture_segments(path):
+        opener = gzip.open if segment.endswith(".gz") else open
+        with opener(segment, "rt", encoding="utf-8") as lines:
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue